@@ -1,4 +1,5 @@
 import os
+import sys
 import pandas as pd
 from openpyxl import load_workbook
 import xlrd
@@ -12,6 +13,15 @@ import concurrent.futures
 from functools import partial
 import re
 
+import 表格修复
+from 并行稽核 import get_worker_count
+
+try:
+    import win32com.client
+    HAS_WIN32COM = True
+except ImportError:
+    HAS_WIN32COM = False
+
 def select_excel_files():
     """选择多个要测试的Excel文件"""
     root = tk.Tk()
@@ -22,10 +32,10 @@ def select_excel_files():
     )
     return file_paths
 
-def process_single_file(file_path, i, total_files):
-    """处理单个文件的线程函数"""
-    print(f"\n正在处理文件 {i}/{total_files}: {file_path}")
-    if repair_excel_file(file_path):
+def process_single_file(file_path, output_file, i, total_files):
+    """处理单个文件的进程函数"""
+    print(f"\n正在处理文件 {i}/{total_files}: {file_path}", flush=True)
+    if repair_excel_file(file_path, output_file):
         print(f"✅ 文件修复成功: {file_path}")
         return True
     else:
@@ -34,24 +44,30 @@ def process_single_file(file_path, i, total_files):
 
 def main():
     print("=== Excel文件批量修复工具 ===")
-    file_paths = select_excel_files()
+    # 命令行指定文件时不弹出选择对话框，可以在没有界面的服务器上批量修复
+    file_paths = sys.argv[1:] or select_excel_files()
     
     if not file_paths:
         print("未选择文件，程序退出")
         return
     
-    # 使用线程池处理文件
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # 创建处理函数的部分应用
-        process_func = partial(process_single_file, total_files=len(file_paths))
-        # 提交所有任务
-        futures = [executor.submit(process_func, path, i+1) 
-                  for i, path in enumerate(file_paths)]
-        
-        # 统计结果
-        success_count = sum(future.result() for future in concurrent.futures.as_completed(futures) 
-                          if future.result() is not None)
-        fail_count = len(file_paths) - success_count
+    # 输出文件名在分配任务前统一确定，并行修复同名文件时不会互相覆盖
+    output_files = assign_output_files(file_paths)
+    process_func = partial(process_single_file, total_files=len(file_paths))
+    workers = min(get_worker_count(), len(file_paths))
+    if workers > 1:
+        # 纯Python修复是CPU密集的解压、解析和压缩，使用进程池并行
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_func, path, output_file, i+1)
+                      for i, (path, output_file) in enumerate(zip(file_paths, output_files))]
+            results = [future.result() for future in concurrent.futures.as_completed(futures)]
+    else:
+        results = [process_func(path, output_file, i+1)
+                   for i, (path, output_file) in enumerate(zip(file_paths, output_files))]
+    
+    # 统计结果
+    success_count = sum(results)
+    fail_count = len(file_paths) - success_count
     
     print("\n修复结果统计:")
     print(f"成功修复: {success_count} 个文件")
@@ -134,7 +150,7 @@ def check_file_properties(file_path):
             print(f"文件头: {header}")
             
             # 检查是否是加密文件
-            if header.startswith(b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'):
+            if header.startswith(表格修复.OLE_MAGIC):
                 print("⚠️ 文件可能是加密的或受密码保护")
             
         return True
@@ -148,26 +164,74 @@ def extract_chinese_from_filename(filename):
     chinese_part = ''.join(re.findall('[\u4e00-\u9fa5]', filename))
     return chinese_part if chinese_part else os.path.splitext(filename)[0]
 
-def repair_excel_file(file_path):
-    """使用Excel COM修复Excel文件"""
-    print("\n尝试修复Excel文件...")
+def get_output_dir():
+    """修复结果保存目录：脚本所在目录下的考勤数据目录"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, "考勤数据")
+
+def assign_output_files(file_paths, output_dir=None):
+    """按原文件名中的中文部分确定各文件的输出路径，与已有文件或本批其他文件重名时依次加 _1、_2 后缀"""
+    output_dir = output_dir or get_output_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    assigned = set()
+    output_files = []
+    for file_path in file_paths:
+        chinese_name = extract_chinese_from_filename(os.path.basename(file_path))
+        output_file = os.path.join(output_dir, f"{chinese_name}.xlsx")
+        counter = 1
+        while os.path.exists(output_file) or output_file in assigned:
+            output_file = os.path.join(output_dir, f"{chinese_name}_{counter}.xlsx")
+            counter += 1
+        assigned.add(output_file)
+        output_files.append(output_file)
+    return output_files
+
+def repair_excel_file(file_path, output_file=None):
+    """修复Excel文件并保存到考勤数据目录
+
+    先快速检查文件（表格修复.probe_workbook），完好的文件直接复制；否则使用纯Python修复引擎（表格修复.repair_workbook），无法修复时在安装了Excel的Windows上改用Excel COM。
+    output_file 为None时按原文件名的中文部分命名，见 assign_output_files
+    """
+    if output_file is None:
+        output_file = assign_output_files([file_path])[0]
+    
+    # 完好的文件直接复制，不经过修复
+    healthy, reason = 表格修复.probe_workbook(file_path)
+    if healthy:
+        shutil.copyfile(file_path, output_file)
+        print(f"✅ 文件完好，跳过修复: {os.path.basename(output_file)}")
+        return True
+    print(f"\n文件需要修复: {reason}")
+    print("尝试修复Excel文件...")
+    try:
+        actions = 表格修复.repair_workbook(file_path, output_file)
+        print(f"✅ 纯Python修复成功: {os.path.basename(output_file)}")
+        for action in actions:
+            print(f"   - {action}")
+        return True
+    except 表格修复.RepairError as e:
+        print(f"⚠️ 纯Python修复失败: {e}")
+    
+    if not HAS_WIN32COM:
+        print("❌ 未安装pywin32，无法使用Excel COM修复")
+        return False
+    return repair_with_com(file_path, output_file)
+
+def repair_with_com(file_path, output_file):
+    """使用Excel COM修复Excel文件：打开、重新计算并另存为xlsx"""
+    print("尝试使用Excel COM修复...")
+    temp_dir = None
     try:
-        # 创建考勤数据目录（在脚本所在目录下）
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        output_dir = os.path.join(script_dir, "考勤数据")
-        os.makedirs(output_dir, exist_ok=True)
-        
         # 创建临时修复目录
         temp_dir = tempfile.mkdtemp()
         temp_file = os.path.join(temp_dir, "repaired.xlsx")
         
-        import win32com.client
         excel = win32com.client.Dispatch("Excel.Application")
         excel.Visible = False
         excel.DisplayAlerts = False
             
         # 尝试打开文件
-        wb = excel.Workbooks.Open(file_path)
+        wb = excel.Workbooks.Open(os.path.abspath(file_path))
         # 强制重新计算
         excel.CalculateFull()
         # 另存为新文件
@@ -178,17 +242,6 @@ def repair_excel_file(file_path):
         # 验证并保存到考勤数据目录
         if os.path.exists(temp_file):
             print("✅ 使用Excel COM修复成功!")
-            # 从原文件名提取中文部分
-            original_filename = os.path.basename(file_path)
-            chinese_name = extract_chinese_from_filename(original_filename)
-            # 生成输出文件名（使用中文命名）
-            output_file = os.path.join(output_dir, f"{chinese_name}.xlsx")
-            # 处理文件名重复情况
-            counter = 1
-            while os.path.exists(output_file):
-                output_file = os.path.join(output_dir, f"{chinese_name}_{counter}.xlsx")
-                counter += 1
-                
             # 先关闭原文件句柄
             time.sleep(1)
             try:
@@ -201,10 +254,8 @@ def repair_excel_file(file_path):
         print(f"❌ Excel COM修复失败: {e}")
         return False
     finally:
-        try:
+        if temp_dir:
             shutil.rmtree(temp_dir, ignore_errors=True)
-        except:
-            pass
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,31 +1,207 @@
 import os
+import time
+from datetime import date, datetime
+
 import pandas as pd
 import numpy as np
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment, PatternFill, Font, Border, Side
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, PatternFill, Font, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+
+from 步骤调度 import make_manifest, emit_manifest
+from 报表写出 import consecutive_groups, excel_values
+from 考勤日汇总 import FACTS_FILE, read_daily_facts
+
+
+# 核对版单元格使用的命名样式
+DATA_STYLE = "核对版数据"
+DATE_STYLE = "核对版日期"
+DATETIME_STYLE = "核对版日期时间"
+HEADER_STYLE = "核对版表头"
+
+# 核对版各列的列宽
+COLUMN_WIDTH = 15
+
+
+def create_named_styles():
+    """核对版的命名样式：数据居中换行，日期列、日期时间列另带对应的格式，表头加粗并填充灰色
+
+    日期格式与 DataFrame.to_excel 写出时相同：日期为“年-月-日”，日期时间另带“时:分:秒”
+    """
+    alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    thin = Side(style='thin')
+    return [
+        NamedStyle(name=DATA_STYLE, alignment=alignment),
+        NamedStyle(name=DATE_STYLE, alignment=alignment, number_format='YYYY-MM-DD'),
+        NamedStyle(name=DATETIME_STYLE, alignment=alignment, number_format='YYYY-MM-DD HH:MM:SS'),
+        NamedStyle(name=HEADER_STYLE, alignment=alignment, font=Font(bold=True),
+                   fill=PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid"),
+                   border=Border(left=thin, right=thin, top=thin, bottom=thin)),
+    ]
+
+
+def _is_filled(values):
+    """单元格是否有内容（非空且不是空字符串）"""
+    return np.array([not pd.isna(value) and value != '' for value in values], dtype=bool)
+
+
+def get_name_merge_ranges(names):
+    """连续的同一姓名合并为一个区域（只有一行时也合并），返回[(起始行, 结束行)]，行号从0开始且不含表头"""
+    names = np.asarray(names, dtype=object)
+    starts, ends = consecutive_groups(names)
+    keep = _is_filled(names[starts])
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+def get_desc_merge_ranges(descriptions):
+    """有内容的异常描述与其下方连续的空单元格合并为一个区域，返回[(起始行, 结束行)]
+
+    最后一行不作为合并区域的起始行
+    """
+    filled_rows = np.flatnonzero(_is_filled(descriptions))
+    ends = np.r_[filled_rows[1:], len(descriptions)] - 1
+    keep = ends > filled_rows
+    return list(zip(filled_rows[keep].tolist(), ends[keep].tolist()))
+
+
+def build_anomaly_report(df, facts=None):
+    """生成异常报告工作表的各行：异常类型统计、各部门异常数量，有每日考勤汇总时加上各部门出勤汇总"""
+    rows = []
+    anomaly_df = df[df['异常描述'].notna()]
+    
+    # 统计异常类型
+    anomaly_stats = anomaly_df['异常描述'].value_counts().reset_index()
+    anomaly_stats.columns = ['异常类型', '出现次数']
+    
+    # 异常统计
+    rows.append(['异常类型', '出现次数'])
+    for _, row in anomaly_stats.iterrows():
+        rows.append([row['异常类型'], row['出现次数']])
+    
+    # 添加AI分析结论
+    rows.append([''])
+    rows.append(['AI分析结论:'])
+    
+    # 根据异常数据生成分析结论
+    if len(anomaly_df) > 0:
+        most_common = anomaly_stats.iloc[0]['异常类型']
+        rows.append([f"最常见的异常类型是: {most_common}"])
+        
+        # 按部门分析异常
+        dept_stats = anomaly_df.groupby('部门')['异常描述'].count().sort_values(ascending=False)
+        rows.append([''])
+        rows.append(['各部门异常数量统计:'])
+        for dept, count in dept_stats.items():
+            rows.append([dept, count])
+        
+        rows.append([''])
+        rows.append(["建议: 重点关注异常高发的部门和异常类型"])
+    else:
+        rows.append(["未发现异常记录"])
+    
+    # 各部门出勤汇总，直接读取每日考勤汇总（见 考勤日汇总.build_daily_facts）
+    if facts is not None and len(facts) > 0:
+        summary = facts.groupby('部门').agg(出勤人次=('姓名', 'size'), 外出分钟=('外出分钟', 'sum'),
+                                          加班在场小时=('加班在场小时', 'sum'))
+        rows.append([''])
+        rows.append(['各部门出勤汇总:'])
+        rows.append(['部门', '出勤人次', '外出时长(小时)', '加班在场时长(小时)'])
+        for dept, row in summary.iterrows():
+            rows.append([dept, int(row['出勤人次']), round(row['外出分钟'] / 60, 2), round(row['加班在场小时'], 2)])
+    return rows
+
+
+def write_optimized_report(df, output_file, report_rows=None):
+    """一次写出核对版：合并姓名和异常描述单元格，设置单元格样式和列宽，并写入异常报告工作表
+
+    合并区域预先按DataFrame计算，单元格使用命名样式，按列选择数据、日期或日期时间样式，
+    以只写模式逐行写出后只保存一次
+    """
+    columns = [excel_values(df[col]) for col in df.columns]
+    name_col = df.columns.get_loc('姓名')
+    desc_col = df.columns.get_loc('异常描述')
+    name_ranges = get_name_merge_ranges(columns[name_col])
+    desc_ranges = get_desc_merge_ranges(columns[desc_col])
+
+    # 合并区域中除首行外的单元格为空
+    names = columns[name_col]
+    for start, end in name_ranges:
+        names[start + 1:end + 1] = [None] * (end - start)
+
+    # 含有日期时间的列使用日期时间样式，只含日期（如加班单开始日期）的列使用日期样式
+    column_styles = []
+    for col, values in zip(df.columns, columns):
+        if df[col].dtype.kind == 'M' or any(isinstance(value, datetime) for value in values):
+            column_styles.append(DATETIME_STYLE)
+        elif any(isinstance(value, date) for value in values):
+            column_styles.append(DATE_STYLE)
+        else:
+            column_styles.append(DATA_STYLE)
+
+    wb = Workbook(write_only=True)
+    for style in create_named_styles():
+        wb.add_named_style(style)
+    ws = wb.create_sheet("Sheet1")
+    for col in range(1, len(df.columns) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = COLUMN_WIDTH
+
+    def styled_row(values, styles):
+        cells = []
+        for value, style in zip(values, styles):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style
+            cells.append(cell)
+        return cells
+
+    ws.append(styled_row(df.columns, [HEADER_STYLE] * len(df.columns)))
+    for row in zip(*columns):
+        ws.append(styled_row(row, column_styles))
+
+    # Excel数据从第2行开始（第1行是表头）
+    merge_ranges = []
+    for col, ranges in ((name_col, name_ranges), (desc_col, desc_ranges)):
+        letter = get_column_letter(col + 1)
+        merge_ranges.extend(CellRange(f"{letter}{start + 2}:{letter}{end + 2}") for start, end in ranges)
+    ws.merged_cells = MultiCellRange(merge_ranges)
 
+    if report_rows is not None:
+        report_sheet = wb.create_sheet("异常报告")
+        for row in report_rows:
+            report_sheet.append(row)
 
-def optimize_excel():
-    """优化核对版数据Excel文件，合并相同人员的单元格和相关信息"""
+    wb.save(output_file)
+
+
+def optimize_excel(df=None, facts=None):
+    """优化核对版数据Excel文件，合并相同人员的单元格和相关信息
+
+    df 为流水线中直接传入的核对版数据；为空时从考勤数据文件夹读取。
+    facts 为流水线中直接传入的每日考勤汇总；为空时读取考勤数据文件夹中写出的汇总，没有时异常报告不含出勤汇总。
+    成功时返回结果清单，失败时返回False
+    """
     try:
+        start_time = time.time()
+        
         # 获取脚本所在目录
         script_dir = os.path.dirname(os.path.abspath(__file__))
         data_dir = os.path.join(script_dir, "考勤数据")
         
-        # 查找核对版数据文件
-        input_file = None
-        for file in os.listdir(data_dir):
-            if "核对版数据" in file:
-                input_file = os.path.join(data_dir, file)
-                break
-        
-        if not input_file:
-            print("未找到核对版数据文件")
-            return False
-        
-        # 读取Excel文件
-        df = pd.read_excel(input_file)
+        if df is None:
+            # 查找核对版数据文件
+            input_file = None
+            for file in os.listdir(data_dir):
+                if "核对版数据" in file:
+                    input_file = os.path.join(data_dir, file)
+                    break
+            
+            if not input_file:
+                print("未找到核对版数据文件")
+                return False
+            
+            # 读取Excel文件
+            df = pd.read_excel(input_file)
         
         # 按姓名和刷卡日期排序
         df = df.sort_values(['姓名', '刷卡日期'])
@@ -36,188 +212,214 @@ def optimize_excel():
         # 创建输出文件路径
         output_file = os.path.join(data_dir, "考勤稽核数据核对版.xlsx")
         
-        # 保存为新的Excel文件
-        df.to_excel(output_file, index=False)
-        
-        # 使用openpyxl加载工作簿进行格式调整
-        wb = load_workbook(output_file)
-        ws = wb.active
-        
-        # 获取姓名列索引
-        name_col = None
-        for col in range(1, ws.max_column + 1):
-            if ws.cell(row=1, column=col).value == "姓名":
-                name_col = col
-                break
-                
-        # 合并姓名单元格并居中
-        current_name = None
-        start_row = 2
-        for row in range(2, ws.max_row + 1):
-            name = ws.cell(row=row, column=name_col).value
-            if name != current_name:
-                if current_name and row > start_row:
-                    ws.merge_cells(start_row=start_row, start_column=name_col, 
-                                 end_row=row-1, end_column=name_col)
-                    # 设置合并后的单元格垂直居中
-                    ws.cell(row=start_row, column=name_col).alignment = Alignment(
-                        vertical='center',
-                        horizontal='center'
-                    )
-                current_name = name
-                start_row = row
-                
-        # 合并最后一批姓名
-        if current_name and ws.max_row >= start_row:
-            ws.merge_cells(start_row=start_row, start_column=name_col,
-                         end_row=ws.max_row, end_column=name_col)
-            ws.cell(row=start_row, column=name_col).alignment = Alignment(
-                vertical='center',
-                horizontal='center'
-            )
-        
-        # 获取列索引
-        name_col = None
-        desc_col = None
-        overtime_col = None
-        
-        for col in range(1, ws.max_column + 1):
-            header = ws.cell(row=1, column=col).value
-            if header == "姓名":
-                name_col = col
-            elif header == "异常描述":
-                desc_col = col
-            elif header == "加班单时数":
-                overtime_col = col
-        
-        if not all([name_col, desc_col, overtime_col]):
+        if not all(col in df.columns for col in ("姓名", "异常描述", "加班单时数")):
             print("未找到必要的列")
             return False
         
-        # 创建一个字典来跟踪每个姓名的行范围
-        name_ranges = {}
-        current_name = None
-        start_row = None
-        
-        # 首先确保数据按姓名排序
-        df = df.sort_values('姓名')
-        
-        # 从第2行开始（跳过标题行）
-        for row in range(2, ws.max_row + 1):
-            name = ws.cell(row=row, column=name_col).value
-            
-            if name != current_name:
-                # 如果有前一个名字的范围，保存它
-                if current_name and start_row:
-                    name_ranges[current_name] = (start_row, row - 1)
-                
-                # 开始新的名字范围
-                current_name = name
-                start_row = row
-        
-        # 添加最后一个名字的范围
-        if current_name and start_row:
-            name_ranges[current_name] = (start_row, ws.max_row)
-        
-        # 只合并姓名单元格
-        for name, (start, end) in name_ranges.items():
-            if start != end:  # 只有多行才需要合并
-                ws.merge_cells(start_row=start, start_column=name_col, end_row=end, end_column=name_col)
-        
-        # 合并异常描述列（当下方单元格为空时）
-        if desc_col:
-            for row in range(2, ws.max_row):
-                current_value = ws.cell(row=row, column=desc_col).value
-                next_value = ws.cell(row=row+1, column=desc_col).value
-                
-                if current_value and not next_value:
-                    # 找到下方连续空单元格的范围
-                    end_row = row + 1
-                    while end_row < ws.max_row and not ws.cell(row=end_row+1, column=desc_col).value:
-                        end_row += 1
-                    
-                    # 合并单元格
-                    ws.merge_cells(start_row=row, start_column=desc_col, 
-                                 end_row=end_row, end_column=desc_col)
-                    # 设置合并后的单元格垂直居中
-                    ws.cell(row=row, column=desc_col).alignment = Alignment(
-                        vertical='center',
-                        horizontal='center'
-                    )
-        
-        # 设置单元格格式
-        for row in range(1, ws.max_row + 1):
-            for col in range(1, ws.max_column + 1):
-                cell = ws.cell(row=row, column=col)
-                
-                # 设置对齐方式
-                cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-                
-                # 设置标题行格式
-                if row == 1:
-                    cell.font = Font(bold=True)
-                    cell.fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
-        
-        # 调整列宽
-        for col in range(1, ws.max_column + 1):
-            column_letter = get_column_letter(col)
-            ws.column_dimensions[column_letter].width = 15
-        
-        # 保存优化后的文件
-        wb.save(output_file)
-        print(f"优化完成！结果已保存至: {output_file}")
+        if facts is None and os.path.exists(os.path.join(data_dir, FACTS_FILE)):
+            facts = read_daily_facts(os.path.join(data_dir, FACTS_FILE))
         
         # 生成异常报告
         try:
-            # 创建异常报告工作表
-            report_sheet = wb.create_sheet("异常报告")
-            
-            # 分析异常数据
-            anomaly_df = df[df['异常描述'].notna()]
-            
-            # 统计异常类型
-            anomaly_stats = anomaly_df['异常描述'].value_counts().reset_index()
-            anomaly_stats.columns = ['异常类型', '出现次数']
-            
-            # 写入异常统计
-            report_sheet.append(['异常类型', '出现次数'])
-            for _, row in anomaly_stats.iterrows():
-                report_sheet.append([row['异常类型'], row['出现次数']])
-            
-            # 添加AI分析结论
-            report_sheet.append([''])
-            report_sheet.append(['AI分析结论:'])
-            
-            # 根据异常数据生成分析结论
-            if len(anomaly_df) > 0:
-                most_common = anomaly_stats.iloc[0]['异常类型']
-                report_sheet.append([f"最常见的异常类型是: {most_common}"])
-                
-                # 按部门分析异常
-                dept_stats = anomaly_df.groupby('部门')['异常描述'].count().sort_values(ascending=False)
-                report_sheet.append([''])
-                report_sheet.append(['各部门异常数量统计:'])
-                for dept, count in dept_stats.items():
-                    report_sheet.append([dept, count])
-                
-                report_sheet.append([''])
-                report_sheet.append(["建议: 重点关注异常高发的部门和异常类型"]) 
-            else:
-                report_sheet.append(["未发现异常记录"]) 
-            
-            # 保存包含报告的文件
-            wb.save(output_file)
-            print(f"异常报告已生成并保存至: {output_file}")
-            
+            report_rows = build_anomaly_report(df.sort_values('姓名'), facts)
         except Exception as e:
+            report_rows = None
             print(f"生成异常报告时出错: {str(e)}")
-            
-        return True
+        
+        write_optimized_report(df, output_file, report_rows)
+        print(f"优化完成！结果已保存至: {output_file}")
+        if report_rows is not None:
+            print(f"异常报告已生成并保存至: {output_file}")
+        
+        return make_manifest("内容优化", outputs={"考勤稽核数据核对版": output_file},
+                             rows={"考勤稽核数据核对版": len(df)}, elapsed=time.time() - start_time)
         
     except Exception as e:
         print(f"优化文件时出错: {str(e)}")
         return False
 
 
+def optimize_excel_reload(df, output_file):
+    """原实现：写出后重新加载，逐个单元格合并和设置格式并保存两次，用于性能基准对比"""
+    # 保存为新的Excel文件
+    df.to_excel(output_file, index=False)
+
+    # 使用openpyxl加载工作簿进行格式调整
+    wb = load_workbook(output_file)
+    ws = wb.active
+
+    # 获取姓名列索引
+    name_col = None
+    for col in range(1, ws.max_column + 1):
+        if ws.cell(row=1, column=col).value == "姓名":
+            name_col = col
+            break
+
+    # 合并姓名单元格并居中
+    current_name = None
+    start_row = 2
+    for row in range(2, ws.max_row + 1):
+        name = ws.cell(row=row, column=name_col).value
+        if name != current_name:
+            if current_name and row > start_row:
+                ws.merge_cells(start_row=start_row, start_column=name_col, 
+                             end_row=row-1, end_column=name_col)
+                # 设置合并后的单元格垂直居中
+                ws.cell(row=start_row, column=name_col).alignment = Alignment(
+                    vertical='center',
+                    horizontal='center'
+                )
+            current_name = name
+            start_row = row
+
+    # 合并最后一批姓名
+    if current_name and ws.max_row >= start_row:
+        ws.merge_cells(start_row=start_row, start_column=name_col,
+                     end_row=ws.max_row, end_column=name_col)
+        ws.cell(row=start_row, column=name_col).alignment = Alignment(
+            vertical='center',
+            horizontal='center'
+        )
+
+    # 获取列索引
+    name_col = None
+    desc_col = None
+    overtime_col = None
+
+    for col in range(1, ws.max_column + 1):
+        header = ws.cell(row=1, column=col).value
+        if header == "姓名":
+            name_col = col
+        elif header == "异常描述":
+            desc_col = col
+        elif header == "加班单时数":
+            overtime_col = col
+
+    if not all([name_col, desc_col, overtime_col]):
+        print("未找到必要的列")
+        return False
+
+    # 创建一个字典来跟踪每个姓名的行范围
+    name_ranges = {}
+    current_name = None
+    start_row = None
+
+    # 首先确保数据按姓名排序
+    df = df.sort_values('姓名')
+
+    # 从第2行开始（跳过标题行）
+    for row in range(2, ws.max_row + 1):
+        name = ws.cell(row=row, column=name_col).value
+
+        if name != current_name:
+            # 如果有前一个名字的范围，保存它
+            if current_name and start_row:
+                name_ranges[current_name] = (start_row, row - 1)
+
+            # 开始新的名字范围
+            current_name = name
+            start_row = row
+
+    # 添加最后一个名字的范围
+    if current_name and start_row:
+        name_ranges[current_name] = (start_row, ws.max_row)
+
+    # 只合并姓名单元格
+    for name, (start, end) in name_ranges.items():
+        if start != end:  # 只有多行才需要合并
+            ws.merge_cells(start_row=start, start_column=name_col, end_row=end, end_column=name_col)
+
+    # 合并异常描述列（当下方单元格为空时）
+    if desc_col:
+        for row in range(2, ws.max_row):
+            current_value = ws.cell(row=row, column=desc_col).value
+            next_value = ws.cell(row=row+1, column=desc_col).value
+
+            if current_value and not next_value:
+                # 找到下方连续空单元格的范围
+                end_row = row + 1
+                while end_row < ws.max_row and not ws.cell(row=end_row+1, column=desc_col).value:
+                    end_row += 1
+
+                # 合并单元格
+                ws.merge_cells(start_row=row, start_column=desc_col, 
+                             end_row=end_row, end_column=desc_col)
+                # 设置合并后的单元格垂直居中
+                ws.cell(row=row, column=desc_col).alignment = Alignment(
+                    vertical='center',
+                    horizontal='center'
+                )
+
+    # 设置单元格格式
+    for row in range(1, ws.max_row + 1):
+        for col in range(1, ws.max_column + 1):
+            cell = ws.cell(row=row, column=col)
+
+            # 设置对齐方式
+            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+
+            # 设置标题行格式
+            if row == 1:
+                cell.font = Font(bold=True)
+                cell.fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
+
+    # 调整列宽
+    for col in range(1, ws.max_column + 1):
+        column_letter = get_column_letter(col)
+        ws.column_dimensions[column_letter].width = 15
+
+    # 保存优化后的文件
+    wb.save(output_file)
+    print(f"优化完成！结果已保存至: {output_file}")
+
+    # 生成异常报告
+    try:
+        # 创建异常报告工作表
+        report_sheet = wb.create_sheet("异常报告")
+
+        # 分析异常数据
+        anomaly_df = df[df['异常描述'].notna()]
+
+        # 统计异常类型
+        anomaly_stats = anomaly_df['异常描述'].value_counts().reset_index()
+        anomaly_stats.columns = ['异常类型', '出现次数']
+
+        # 写入异常统计
+        report_sheet.append(['异常类型', '出现次数'])
+        for _, row in anomaly_stats.iterrows():
+            report_sheet.append([row['异常类型'], row['出现次数']])
+
+        # 添加AI分析结论
+        report_sheet.append([''])
+        report_sheet.append(['AI分析结论:'])
+
+        # 根据异常数据生成分析结论
+        if len(anomaly_df) > 0:
+            most_common = anomaly_stats.iloc[0]['异常类型']
+            report_sheet.append([f"最常见的异常类型是: {most_common}"])
+
+            # 按部门分析异常
+            dept_stats = anomaly_df.groupby('部门')['异常描述'].count().sort_values(ascending=False)
+            report_sheet.append([''])
+            report_sheet.append(['各部门异常数量统计:'])
+            for dept, count in dept_stats.items():
+                report_sheet.append([dept, count])
+
+            report_sheet.append([''])
+            report_sheet.append(["建议: 重点关注异常高发的部门和异常类型"]) 
+        else:
+            report_sheet.append(["未发现异常记录"]) 
+
+        # 保存包含报告的文件
+        wb.save(output_file)
+        print(f"异常报告已生成并保存至: {output_file}")
+
+    except Exception as e:
+        print(f"生成异常报告时出错: {str(e)}")
+    return True
+
+
 if __name__ == "__main__":
-    optimize_excel()
+    manifest = optimize_excel()
+    if manifest:
+        emit_manifest(manifest)
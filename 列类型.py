@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+
+# 取值重复较多的文本列，读取后转换为分类类型
+CATEGORY_COLUMNS = ('单位', '部门', '部门CXO-2', '姓名', '刷卡机', '班别', '来源')
+
+# 各标志对应的列和该列取值中包含的文字
+FLAG_RULES = {
+    'is_in': ('刷卡机', '进'),
+    'is_out': ('刷卡机', '出'),
+    'is_day': ('班别', '白班'),
+    'is_rest_day': ('班别', '休息白班'),
+    'is_half_hour': ('班别', '连班半小时白班'),
+    'is_night': ('班别', '夜班'),
+}
+
+
+def categorize_columns(df, columns=CATEGORY_COLUMNS):
+    """把 df 中存在的文本列转换为分类类型（原地修改），返回 df"""
+    for col in columns:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def contains_flag(series, text):
+    """每条记录的取值是否包含 text，空值为False
+
+    判断只对每个不同的取值执行一次，再按编码展开到各行
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        categories = series.cat.categories
+    else:
+        codes, categories = pd.factorize(series)
+    category_flags = np.array([text in str(value) for value in categories] + [False], dtype=bool)
+    # 空值的编码为-1，对应末尾的False
+    return category_flags[codes]
+
+
+def row_flags(df, *names):
+    """按 FLAG_RULES 计算各行的标志，返回 {标志名: 布尔数组}"""
+    return {name: contains_flag(df[FLAG_RULES[name][0]], FLAG_RULES[name][1]) for name in names}
@@ -0,0 +1,349 @@
+import bisect
+
+import numpy as np
+import pandas as pd
+
+from 时间换算 import MISSING, SECONDS_PER_DAY, SECONDS_PER_MINUTE, to_seconds, to_timestamps
+
+
+# 查询键中员工编码左移的位数，时间戳（秒）小于2^33，约为2242年
+_CODE_SHIFT = 33
+
+# 请假区间表的列：姓名、开始时刻、结束时刻（日期时间类型）
+INTERVAL_COLUMNS = ['姓名', '开始时间', '结束时间']
+
+# 加班单区间表的列：请假区间表的列加上加班单时数
+OVERTIME_INTERVAL_COLUMNS = INTERVAL_COLUMNS + ['加班单时数']
+
+
+def _lookup_codes(codes_by_name, names):
+    """各姓名的员工编码，没有区间的员工为-1"""
+    codes = pd.Series(names, dtype=object).map(codes_by_name)
+    return codes.fillna(-1).to_numpy(dtype=np.int64)
+
+
+class IntervalIndex:
+    """按员工组织的时间区间索引，时刻为从1970-01-01起算的秒数
+
+    各员工的区间按开始时刻排序，相互重叠或首尾相接的区间合并为一个，全部员工的区间依次存放在
+    连续的数组中。查询用(员工编码, 时刻)组成的键二分查找，单次查询为O(log n)，批量查询按数组一次完成
+    """
+
+    def __init__(self, names, starts, ends):
+        names = pd.Series(names, dtype=object).reset_index(drop=True)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        valid = names.notna().to_numpy() & (starts >= 0) & (ends >= starts)
+
+        codes, uniques = pd.factorize(names[valid])
+        self.codes_by_name = {name: code for code, name in enumerate(uniques)}
+        starts, ends = starts[valid], ends[valid]
+        order = np.lexsort((starts, codes))
+        codes, starts, ends = codes[order].astype(np.int64), starts[order], ends[order]
+
+        # 同一员工内结束时刻的累计最大值，键中含员工编码，各员工分别累计
+        offset = codes << _CODE_SHIFT
+        reach = np.maximum.accumulate(offset + ends) - offset if len(codes) else ends
+        # 与之前的区间既不重叠也不相接时开始一个新区间
+        new_block = np.ones(len(codes), dtype=bool)
+        new_block[1:] = (codes[1:] != codes[:-1]) | (starts[1:] > reach[:-1] + 1)
+        block_starts = np.flatnonzero(new_block)
+        block_ends = np.r_[block_starts[1:], len(codes)] - 1 if len(codes) else block_starts
+
+        self.codes = codes[block_starts]
+        self.starts = starts[block_starts]
+        self.ends = reach[block_ends]
+        self.keys = (self.codes << _CODE_SHIFT) + self.starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup_codes(self, names):
+        """各姓名的员工编码，没有区间的员工为-1"""
+        return _lookup_codes(self.codes_by_name, names)
+
+    def _containing(self, codes, times):
+        """各时刻之前（含）最后一个开始的区间的序号，同一员工没有这样的区间时为-1"""
+        keys = (codes << _CODE_SHIFT) + times
+        index = np.searchsorted(self.keys, keys, side='right') - 1
+        found = (codes >= 0) & (index >= 0)
+        found[found] = self.codes[index[found]] == codes[found]
+        return np.where(found, index, -1)
+
+    def covers(self, names, starts, ends):
+        """各时间段[start, end]是否完全在同一员工的某个区间内，任一时刻为MISSING时为False"""
+        codes = self.lookup_codes(names)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        codes = np.where((starts >= 0) & (ends >= 0), codes, -1)
+        index = self._containing(codes, starts)
+        found = index >= 0
+        covered = np.zeros(len(codes), dtype=bool)
+        covered[found] = (self.ends[index[found]] >= np.maximum(starts, ends)[found])
+        return covered
+
+    def overlaps(self, names, starts, ends):
+        """各时间段[start, end]是否与同一员工的某个区间有重叠"""
+        codes = self.lookup_codes(names)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        # 在结束时刻之前开始的最后一个区间，其结束时刻不早于开始时刻即有重叠
+        index = self._containing(codes, ends)
+        found = index >= 0
+        overlapping = np.zeros(len(codes), dtype=bool)
+        overlapping[found] = self.ends[index[found]] >= starts[found]
+        return overlapping
+
+    def overlap_seconds(self, names, starts, ends):
+        """各时间段[start, end]与同一员工的区间重叠部分的总秒数，任一时刻为MISSING时为0"""
+        codes = self.lookup_codes(names)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        codes = np.where((starts >= 0) & (ends >= starts), codes, -1)
+        if len(self) == 0:
+            return np.zeros(len(codes), dtype=np.int64)
+
+        # 第一个重叠的区间：包含开始时刻的区间，没有时为其后的下一个区间
+        first = self._containing(codes, starts)
+        first_clipped = np.maximum(first, 0)
+        first = np.where((first >= 0) & (self.ends[first_clipped] > starts), first,
+                         np.searchsorted(self.keys, (codes << _CODE_SHIFT) + starts, side='right'))
+        # 最后一个重叠的区间：结束时刻之前（含）开始的最后一个区间
+        last = self._containing(codes, ends)
+        found = (codes >= 0) & (last >= first)
+
+        # 区间互不重叠，重叠部分为其间各区间的长度之和减去首尾超出时间段的部分
+        lengths = np.r_[0, np.cumsum(self.ends - self.starts)]
+        first = np.where(found, first, 0)
+        last = np.where(found, last, 0)
+        total = (lengths[last + 1] - lengths[first] - np.maximum(starts - self.starts[first], 0)
+                 - np.maximum(self.ends[last] - ends, 0))
+        return np.where(found, np.maximum(total, 0), 0)
+
+    def intervals_of(self, name):
+        """某员工合并后的区间，返回(开始时刻列表, 结束时刻列表)，按开始时刻排序"""
+        code = self.codes_by_name.get(name)
+        if code is None:
+            return [], []
+        lo, hi = np.searchsorted(self.codes, [code, code + 1])
+        return self.starts[lo:hi].tolist(), self.ends[lo:hi].tolist()
+
+
+class OvertimeIndex:
+    """按员工组织的加班单索引，时刻为从1970-01-01起算的秒数
+
+    与 IntervalIndex 不同，各张加班单不合并，按(员工, 开始时刻)排序后依次存放，
+    同一天的多张加班单、跨零点的加班单都单独保留，查询某时间段内开始的加班单时汇总
+    """
+
+    def __init__(self, names, starts, ends, hours):
+        names = pd.Series(names, dtype=object).reset_index(drop=True)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        hours = np.asarray(hours, dtype=float)
+        valid = names.notna().to_numpy() & (starts >= 0) & (ends >= starts)
+
+        codes, uniques = pd.factorize(names[valid])
+        self.codes_by_name = {name: code for code, name in enumerate(uniques)}
+        order = np.lexsort((starts[valid], codes))
+        self.codes = codes[order].astype(np.int64)
+        self.starts = starts[valid][order]
+        self.ends = ends[valid][order]
+        self.hours = hours[valid][order]
+        self.keys = (self.codes << _CODE_SHIFT) + self.starts
+        # 加班单时数的前缀和，用于汇总一段连续的加班单
+        self.hour_sums = np.r_[0.0, np.cumsum(self.hours)]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def forms_starting(self, names, window_starts, window_ends):
+        """各员工在时间段[window_start, window_end)内开始的加班单
+
+        返回(张数, 最早开始时刻, 最晚结束时刻, 加班单时数合计)四个数组，没有加班单时开始、结束时刻为MISSING
+        """
+        codes = _lookup_codes(self.codes_by_name, names)
+        base = codes << _CODE_SHIFT
+        lo = np.searchsorted(self.keys, base + np.asarray(window_starts, dtype=np.int64), side='left')
+        hi = np.searchsorted(self.keys, base + np.asarray(window_ends, dtype=np.int64), side='left')
+        count = np.where(codes >= 0, np.maximum(hi - lo, 0), 0)
+        has_form = count > 0
+
+        first = np.minimum(lo, max(len(self) - 1, 0))
+        form_starts = np.where(has_form, self.starts[first] if len(self) else MISSING, MISSING)
+        form_ends = np.where(has_form, self.ends[first] if len(self) else MISSING, MISSING)
+        # 同一时间段有多张加班单的情况很少，逐个取最晚的结束时刻
+        for i in np.flatnonzero(count > 1):
+            form_ends[i] = self.ends[lo[i]:hi[i]].max()
+        hours = np.where(has_form, self.hour_sums[np.where(has_form, hi, 0)] - self.hour_sums[np.where(has_form, lo, 0)], 0.0)
+        return count, form_starts, form_ends, hours
+
+
+def interval_covers(starts, ends, start, end):
+    """时间段[start, end]是否完全在某个区间内，starts、ends 为 intervals_of 返回的一名员工的区间"""
+    if start < 0 or end < 0:
+        return False
+    index = bisect.bisect_right(starts, start) - 1
+    return index >= 0 and ends[index] >= max(start, end)
+
+
+def interval_overlap(starts, ends, start, end):
+    """时间段[start, end]与 intervals_of 返回的一名员工的区间重叠部分的总秒数"""
+    if start < 0 or end < start:
+        return 0
+    total = 0
+    for index in range(max(bisect.bisect_right(starts, start) - 1, 0), bisect.bisect_right(starts, end)):
+        total += max(min(ends[index], end) - max(starts[index], start), 0)
+    return total
+
+
+def _clock_intervals(names, start_date, end_date, start_times, end_times):
+    """由日期和“时:分”时间计算起止时刻，结束时刻早于开始时刻时顺延一天，返回(起止时刻表, 有效行)"""
+    start_sec = to_seconds(start_times)
+    end_sec = to_seconds(end_times)
+
+    starts = start_date + pd.to_timedelta(np.maximum(start_sec, 0), unit='s')
+    ends = end_date + pd.to_timedelta(np.maximum(end_sec, 0), unit='s')
+    ends = ends.where(ends >= starts, ends + pd.Timedelta(days=1))
+
+    valid = (start_date.notna() & (start_sec != MISSING) & (end_sec != MISSING) & names.notna()).to_numpy()
+    return pd.DataFrame({
+        '姓名': names.to_numpy(dtype=object)[valid],
+        '开始时间': starts.to_numpy()[valid],
+        '结束时间': ends.to_numpy()[valid],
+    }), valid
+
+
+def _to_dates(values):
+    return pd.to_datetime(pd.Series(values).reset_index(drop=True), errors='coerce').dt.normalize()
+
+
+def leave_intervals(leave, start_date_col='请假开始日期', end_date_col='请假结束日期'):
+    """由请假记录计算各条请假的起止时刻，返回 INTERVAL_COLUMNS 三列的表
+
+    起止时刻为开始（结束）日期加请假开始（结束）时间；结束日期为空时与开始日期相同，
+    结束时刻早于开始时刻时（跨零点的请假只填写了开始日期）顺延一天。
+    日期或时间为空、无法解析的请假与原实现一样不参与判断
+    """
+    if leave is None or len(leave) == 0 or any(col not in leave.columns for col in
+                                                ('姓名', start_date_col, '请假开始时间', '请假结束时间')):
+        return pd.DataFrame(columns=INTERVAL_COLUMNS)
+
+    leave = leave.reset_index(drop=True)
+    start_date = _to_dates(leave[start_date_col])
+    end_date = start_date
+    if end_date_col in leave.columns:
+        end_date = _to_dates(leave[end_date_col]).fillna(start_date)
+    intervals, _ = _clock_intervals(leave['姓名'], start_date, end_date, leave['请假开始时间'], leave['请假结束时间'])
+    return intervals
+
+
+def row_leave_intervals(df):
+    """由班别匹配结果各记录上的请假开始、结束时间计算请假起止时刻（没有请假流程表时使用）
+
+    记录上的请假是按(姓名, 刷卡日期)匹配到的，起止时刻取该记录刷卡日期的对应时间
+    """
+    columns = ['姓名', '刷卡日期', '请假开始时间', '请假结束时间']
+    if any(col not in df.columns for col in columns):
+        return pd.DataFrame(columns=INTERVAL_COLUMNS)
+    rows = df[columns][df['请假开始时间'].notna().to_numpy() & df['请假结束时间'].notna().to_numpy()]
+    rows = rows.astype(object).drop_duplicates()
+    return leave_intervals(rows, start_date_col='刷卡日期', end_date_col=None)
+
+
+def leave_index(intervals):
+    """请假区间索引，与原实现一样按分钟比较：开始时刻取整到分钟，结束时刻延长到该分钟末"""
+    starts = to_timestamps(intervals['开始时间'])
+    ends = to_timestamps(intervals['结束时间'])
+    starts = np.where(starts >= 0, starts - starts % SECONDS_PER_MINUTE, MISSING)
+    ends = np.where(ends >= 0, ends - ends % SECONDS_PER_MINUTE + SECONDS_PER_MINUTE - 1, MISSING)
+    return IntervalIndex(intervals['姓名'], starts, ends)
+
+
+def overtime_intervals(overtime, date_col='出勤日期'):
+    """由加班单计算各张加班单的起止时刻和时数，返回 OVERTIME_INTERVAL_COLUMNS 四列的表
+
+    开始（结束）时刻为加班单开始（结束）日期加开始（结束）时间，开始日期为空时使用 date_col 列
+    （加班流程表的出勤日期或刷卡明细的刷卡日期），结束日期为空时与开始日期相同，
+    结束时刻早于开始时刻时（跨零点的加班单只填写了开始日期）顺延一天。
+    同一人同一天的多张加班单都保留，完全相同的加班单（重复导出）只保留一张；
+    时间为空、无法解析的加班单不参与核算，时数为空或无法解析时为0
+    """
+    if overtime is None or len(overtime) == 0 or any(col not in overtime.columns for col in
+                                                    ('姓名', '加班单开始时间', '加班单结束时间')):
+        return pd.DataFrame(columns=OVERTIME_INTERVAL_COLUMNS)
+
+    overtime = overtime.reset_index(drop=True)
+    start_date = pd.Series(pd.NaT, index=overtime.index, dtype='datetime64[ns]')
+    if '加班单开始日期' in overtime.columns:
+        start_date = _to_dates(overtime['加班单开始日期'])
+    if date_col in overtime.columns:
+        start_date = start_date.fillna(_to_dates(overtime[date_col]))
+    end_date = start_date
+    if '加班单结束日期' in overtime.columns:
+        end_date = _to_dates(overtime['加班单结束日期']).fillna(start_date)
+
+    intervals, valid = _clock_intervals(overtime['姓名'], start_date, end_date,
+                                        overtime['加班单开始时间'], overtime['加班单结束时间'])
+    hours = overtime['加班单时数'] if '加班单时数' in overtime.columns else pd.Series(0, index=overtime.index)
+    intervals['加班单时数'] = pd.to_numeric(hours, errors='coerce').fillna(0).to_numpy(dtype=float)[valid]
+    return intervals.drop_duplicates().reset_index(drop=True)
+
+
+def row_overtime_intervals(df):
+    """由班别匹配结果各记录上的加班单计算加班单起止时刻（没有加班流程表时使用）
+
+    记录上的加班单是按(姓名, 刷卡日期)匹配到的，加班单开始日期为空时使用该记录的刷卡日期
+    """
+    columns = [col for col in ['姓名', '刷卡日期', '加班单开始日期', '加班单开始时间', '加班单结束日期',
+                               '加班单结束时间', '加班单时数'] if col in df.columns]
+    if any(col not in columns for col in ('姓名', '加班单开始时间', '加班单结束时间')):
+        return pd.DataFrame(columns=OVERTIME_INTERVAL_COLUMNS)
+    rows = df[columns][df['加班单开始时间'].notna().to_numpy() & df['加班单结束时间'].notna().to_numpy()]
+    rows = rows.astype(object).drop_duplicates()
+    return overtime_intervals(rows, date_col='刷卡日期')
+
+
+def overtime_index(intervals):
+    """由加班单区间表建立加班单索引"""
+    return OvertimeIndex(intervals['姓名'], to_timestamps(intervals['开始时间']),
+                         to_timestamps(intervals['结束时间']), intervals['加班单时数'])
+
+
+def absence_index(names, stamps, is_out, next_in):
+    """员工不在场的区间索引：每次外出到其后第一次进入
+
+    next_in 为出入时段表（见 在场时段.build_sessions，按员工分组）中各记录之后的第一条进入记录，
+    外出后再没有进入记录的，视为从外出起一天内都不在场。用于从加班时间段中扣除外出时间，
+    得到实际在场的加班时长
+    """
+    names = pd.Series(names, dtype=object).reset_index(drop=True)
+    stamps = np.asarray(stamps, dtype=np.int64)
+    next_in = np.asarray(next_in)
+    out_rows = np.flatnonzero(np.asarray(is_out, dtype=bool) & (stamps >= 0))
+    returns = next_in[out_rows]
+    ends = np.where(returns >= 0, stamps[returns], stamps[out_rows] + SECONDS_PER_DAY)
+    return IntervalIndex(names[out_rows], stamps[out_rows], ends)
+
+
+def first_stamp_between(names, stamps, query_names, query_starts, query_ends):
+    """各查询员工在时间段[query_start, query_end)内的第一个时刻，没有时为MISSING
+
+    names、stamps 为全部候选时刻（如全部外出记录）及其员工，按(员工, 时刻)排序后二分查找
+    """
+    names = pd.Series(names, dtype=object).reset_index(drop=True)
+    stamps = np.asarray(stamps, dtype=np.int64)
+    codes, uniques = pd.factorize(names)
+    codes = codes.astype(np.int64)
+    valid = (codes >= 0) & (stamps >= 0)
+    keys = np.sort((codes << _CODE_SHIFT)[valid] + stamps[valid])
+
+    query_codes = _lookup_codes({name: code for code, name in enumerate(uniques)}, query_names)
+    query_starts = np.asarray(query_starts, dtype=np.int64)
+    query_ends = np.asarray(query_ends, dtype=np.int64)
+    pos = np.searchsorted(keys, (query_codes << _CODE_SHIFT) + query_starts, side='left')
+    found_keys = keys[np.minimum(pos, len(keys) - 1)] if len(keys) else np.zeros(len(pos), dtype=np.int64)
+    found_stamps = found_keys - (query_codes << _CODE_SHIFT)
+    found = ((query_codes >= 0) & (pos < len(keys)) & (found_keys >> _CODE_SHIFT == query_codes)
+             & (found_stamps < query_ends))
+    return np.where(found, found_stamps, MISSING)
@@ -1,6 +1,12 @@
 import pandas as pd
+import numpy as np
 import os
-from openpyxl import Workbook
+import sys
+import time
+
+from 步骤调度 import make_manifest, emit_manifest
+from 报表写出 import consecutive_groups, write_report
+from 流式读取 import read_excel_streaming
 
 def get_files_from_attendance_folder():
     """从考勤数据文件夹获取稽查结果文件"""
@@ -22,64 +28,71 @@ def get_files_from_attendance_folder():
         os.path.join(attendance_dir, day_file)
     )
 
+def _sort_codes(values):
+    """把一列转换为按取值排序的整数编码，空值排在最后"""
+    codes, _ = pd.factorize(values, sort=True)
+    return np.where(codes < 0, codes.max() + 1, codes)
+
+def merge_frames(df1, df2):
+    """按(姓名, 刷卡日期)归并夜班(df1)和白班(df2)稽查结果，返回(合并结果, 异常描述合并区域)
+
+    两份结果各自已按姓名、日期排序，稳定排序后同一员工同一天的记录相邻，日期相同时夜班在前。
+    合并区域由排序后的分组边界得到：同一来源、同一员工同一天的多行为一组，
+    行号从0开始且不含表头
+    """
+    # 转换刷卡时间格式
+    frames = [df1.copy(), df2.copy()]
+    for df in frames:
+        if '刷卡时间' in df.columns:
+            df['刷卡时间'] = pd.to_datetime(df['刷卡时间']).dt.strftime('%H:%M:%S')
+    merged_df = pd.concat(frames, ignore_index=True)
+    if merged_df.empty:
+        return merged_df, []
+
+    # 夜班结果的刷卡日期为日期时间，白班结果为文本，统一为日期后比较
+    name_codes = _sort_codes(merged_df['姓名'])
+    date_codes = _sort_codes(pd.to_datetime(merged_df['刷卡日期'], errors='coerce').dt.normalize())
+    sources = np.repeat([0, 1], [len(frames[0]), len(frames[1])])
+
+    order = np.lexsort((np.arange(len(merged_df)), date_codes, name_codes))
+    merged_df = merged_df.take(order).reset_index(drop=True)
+
+    starts, ends = consecutive_groups(name_codes[order], date_codes[order], sources[order])
+    multi = ends > starts
+    return merged_df, list(zip(starts[multi].tolist(), ends[multi].tolist()))
+
+def save_merged_result(merged_df, output_file, merge_ranges=()):
+    """保存合并结果，并合并相同员工当天的异常描述单元格"""
+    write_report(merged_df, output_file, sheet_name='Sheet', merge_ranges=merge_ranges)
+
 def merge_excel_files(file1, file2, output_file):
-    """合并两个Excel文件"""
+    """合并夜班、白班稽查结果，成功时返回结果清单，失败时返回None
+
+    file1、file2 可以是稽查结果文件路径，也可以是流水线中直接传入的DataFrame
+    """
     try:
-        # 读取文件
-        df1 = pd.read_excel(file1)
-        df2 = pd.read_excel(file2)
-        
-        # 转换刷卡时间格式
-        for df in [df1, df2]:
-            if '刷卡时间' in df.columns:
-                df['刷卡时间'] = pd.to_datetime(df['刷卡时间']).dt.strftime('%H:%M:%S')
-        
-        # 合并数据
-        merged_df = pd.concat([df1, df2], ignore_index=True)
-        
-        # 确保输出目录存在
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        start_time = time.time()
         
-        # 使用openpyxl保存以保留合并单元格
-        wb = Workbook()
-        ws = wb.active
-        
-        # 写入表头
-        for col_num, column in enumerate(merged_df.columns, 1):
-            ws.cell(row=1, column=col_num, value=column)
-        
-        # 写入数据并处理合并单元格
-        current_group = None
-        start_row = 2
-        
-        for row_num, row in merged_df.iterrows():
-            group_key = f"{row['姓名']}_{row['刷卡日期']}"
-            
-            if group_key != current_group:
-                if current_group is not None:
-                    # 合并上一个组的异常描述单元格
-                    ws.merge_cells(start_row=start_row, start_column=merged_df.columns.get_loc('异常描述')+1,
-                                  end_row=row_num+1, end_column=merged_df.columns.get_loc('异常描述')+1)
-                
-                current_group = group_key
-                start_row = row_num + 2
-            
-            # 写入数据
-            for col_num, value in enumerate(row, 1):
-                ws.cell(row=row_num+2, column=col_num, value=value)
+        # 读取文件
+        df1 = file1 if isinstance(file1, pd.DataFrame) else read_excel_streaming(file1)
+        df2 = file2 if isinstance(file2, pd.DataFrame) else read_excel_streaming(file2)
         
-        # 保存文件
-        wb.save(output_file)
+        merged_df, merge_ranges = merge_frames(df1, df2)
+        save_merged_result(merged_df, output_file, merge_ranges)
         print(f"文件已成功合并并保存到: {output_file}")
-        return True
+        return make_manifest("合并文件", outputs={"合并结果": output_file},
+                             rows={"合并结果": len(merged_df)}, elapsed=time.time() - start_time)
     except Exception as e:
         print(f"合并文件时出错: {str(e)}")
-        return False
+        return None
 
 if __name__ == "__main__":
     try:
-        # 自动获取文件
-        night_file, day_file = get_files_from_attendance_folder()
+        # 使用命令行指定的夜班、白班稽查结果文件，未指定时自动获取
+        if len(sys.argv) > 2:
+            night_file, day_file = sys.argv[1], sys.argv[2]
+        else:
+            night_file, day_file = get_files_from_attendance_folder()
         
         # 设置输出路径
         output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "考勤数据")
@@ -87,7 +100,9 @@ if __name__ == "__main__":
         output_file = os.path.join(output_dir, "合并结果.xlsx")
         
         # 合并文件
-        merge_excel_files(night_file, day_file, output_file)
+        manifest = merge_excel_files(night_file, day_file, output_file)
+        if manifest:
+            emit_manifest(manifest)
         
     except Exception as e:
         print(f"程序运行出错：{str(e)}")
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+from 时间换算 import MISSING, SECONDS_PER_MINUTE
+
+
+# 两次打卡间隔不超过该秒数时视为重复打卡
+REPEAT_WINDOW = 2 * SECONDS_PER_MINUTE
+
+
+def _next_index(mask, group_ids):
+    """各记录之后同一组内第一条 mask 为True的记录的序号，没有时为-1"""
+    count = len(mask)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+    positions = np.where(mask, np.arange(count), count)
+    # 从后往前的累计最小值为该记录及其后第一条满足条件的记录，右移一位即为其后的第一条
+    following = np.minimum.accumulate(positions[::-1])[::-1]
+    next_index = np.r_[following[1:], count]
+    found = next_index < count
+    found[found] = group_ids[next_index[found]] == group_ids[found]
+    return np.where(found, next_index, -1)
+
+
+def build_sessions(group_ids, stamps, is_in, is_out):
+    """由按(组, 刷卡时刻)排序的打卡记录建立出入时段表，每条记录一行
+
+    组为员工、员工的一天或一个班次。各列为：
+        next_in、next_out：同一组内其后第一条进入、外出记录的序号，没有时为-1
+        partner：其后第一条方向相反的记录（进入对应外出，外出对应进入），没有时为-1
+        duration：到 partner 的秒数，外出记录即为外出时长，没有 partner 时为MISSING
+        repeat：其后第一条方向相同的记录，没有时为-1
+        repeat_gap：到 repeat 的秒数，不超过重复打卡间隔时为重复打卡，没有 repeat 时为MISSING
+        unmatched：进出记录在同方向的下一条记录（或组结束）之前没有方向相反的记录，
+                   即有进无出、有出无进
+    配对只用相邻记录的位置关系（反向累计最小值）一次求出，各规则按需取用
+    """
+    group_ids = np.asarray(group_ids)
+    stamps = np.asarray(stamps, dtype=np.int64)
+    is_in = np.asarray(is_in, dtype=bool)
+    is_out = np.asarray(is_out, dtype=bool)
+
+    next_in = _next_index(is_in, group_ids)
+    next_out = _next_index(is_out, group_ids)
+    partner = np.where(is_in, next_out, np.where(is_out, next_in, -1))
+    repeat = np.where(is_in, next_in, np.where(is_out, next_out, -1))
+    has_partner = partner >= 0
+    has_repeat = repeat >= 0
+
+    duration = np.full(len(stamps), MISSING, dtype=np.int64)
+    duration[has_partner] = stamps[partner[has_partner]] - stamps[has_partner]
+    repeat_gap = np.full(len(stamps), MISSING, dtype=np.int64)
+    repeat_gap[has_repeat] = stamps[repeat[has_repeat]] - stamps[has_repeat]
+    unmatched = (is_in | is_out) & (~has_partner | (has_repeat & (repeat < partner)))
+    return pd.DataFrame({'next_in': next_in, 'next_out': next_out, 'partner': partner, 'duration': duration,
+                         'repeat': repeat, 'repeat_gap': repeat_gap, 'unmatched': unmatched})
+
+
+def collapse_repeats(group_ids, stamps, window=REPEAT_WINDOW):
+    """把同一组内的重复打卡划分为若干段，返回各记录所在段第一条记录的序号
+
+    记录按(组, 刷卡时刻)排序。每段从一条记录开始，包含其后 window 秒内（含）的全部记录，
+    下一条记录开始新的一段。相邻间隔都不超过 window 的记录先用差分划分为连续的一串，
+    一串的总跨度不超过 window 时整串为一段；跨度更大的串很少，逐条划分
+    """
+    group_ids = np.asarray(group_ids)
+    stamps = np.asarray(stamps, dtype=np.int64)
+    count = len(stamps)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    new_run = np.ones(count, dtype=bool)
+    new_run[1:] = (group_ids[1:] != group_ids[:-1]) | (np.diff(stamps) > window)
+    run_starts = np.flatnonzero(new_run)
+    run_ends = np.r_[run_starts[1:], count]
+    anchors = np.repeat(run_starts, run_ends - run_starts)
+
+    wide = stamps[run_ends - 1] - stamps[run_starts] > window
+    for start, end in zip(run_starts[wide].tolist(), run_ends[wide].tolist()):
+        anchor = start
+        for i in range(start, end):
+            if stamps[i] - stamps[anchor] > window:
+                anchor = i
+            anchors[i] = anchor
+    return anchors
+
+
+def last_of_runs(anchors):
+    """各记录是否为 collapse_repeats 划分出的一段中的最后一条"""
+    anchors = np.asarray(anchors)
+    return np.r_[anchors[1:] != anchors[:-1], True] if len(anchors) else np.zeros(0, dtype=bool)
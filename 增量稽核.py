@@ -0,0 +1,341 @@
+import os
+import pickle
+import logging
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+import 并行稽核
+import 白班稽核1_1
+import 夜班稽核
+from 表格缓存 import get_cache_dir
+from 时间换算 import MISSING, SECONDS_PER_DAY, to_timestamps
+from 区间索引 import row_leave_intervals, row_overtime_intervals
+from 考勤日汇总 import day_shift_rows, get_shift_dates, get_swipe_datetimes, night_shift_rows
+from 稽核阈值 import DEFAULT_THRESHOLDS
+from 步骤缓存 import code_version
+
+
+# 保存结构变化时修改，使旧的稽核结果失效
+STORE_VERSION = 1
+
+# 上次稽核结果保存在程序所在目录下的该文件夹中（放在考勤数据文件夹外面的原因见 表格缓存.get_cache_dir）
+STORE_DIR_NAME = "稽核缓存"
+
+# 员工日指纹中，前后记录与当天无关时的取值
+NOT_APPLICABLE = -2
+
+
+def _day_numbers(values):
+    """日期时间列转换为从1970-01-01起算的天数，空值和无法解析的取值为MISSING"""
+    stamps = to_timestamps(values)
+    return np.where(stamps >= 0, stamps // SECONDS_PER_DAY, MISSING)
+
+
+def _key_index(names, days):
+    return pd.MultiIndex.from_arrays([pd.Series(names, dtype=object), np.asarray(days, dtype=np.int64)],
+                                     names=['姓名', 'day'])
+
+
+def _group_sums(keys, hashes):
+    """按(姓名, 天)合计各行的哈希值（uint64按位溢出），返回以(姓名, 天)为索引的Series"""
+    if len(keys) == 0:
+        return pd.Series([], index=_key_index([], []), dtype=np.uint64)
+    codes, uniques = pd.factorize(keys, sort=True)
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    sums = np.add.reduceat(hashes[order], starts)
+    return pd.Series(sums, index=uniques, dtype=np.uint64)
+
+
+def _interval_hashes(intervals, first_day, last_day):
+    """请假、加班单区间表的每个区间按覆盖的每一天展开，返回((姓名, 天)索引, 哈希值)
+
+    只展开到考勤数据的日期范围前后各一天，跨很多天的请假不会产生大量的行
+    """
+    if intervals is None or len(intervals) == 0:
+        return _key_index([], []), np.zeros(0, dtype=np.uint64)
+    hashes = pd.util.hash_pandas_object(intervals.astype(object), index=False).to_numpy()
+    starts = np.maximum(_day_numbers(intervals['开始时间']), first_day - 1)
+    ends = np.minimum(_day_numbers(intervals['结束时间']), last_day + 1)
+    valid = (starts >= 0) & (ends >= starts)
+    counts = np.where(valid, ends - starts + 1, 0)
+    rows = np.repeat(np.arange(len(intervals)), counts)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    names = intervals['姓名'].to_numpy(dtype=object)[rows]
+    return _key_index(names, starts[rows] + offsets), hashes[rows]
+
+
+def _neighbor_stamps(rows):
+    """某种班次的记录按员工、刷卡时刻排序后，各员工日与前后几天相关的刷卡时刻
+
+    返回以(姓名, 天)为索引的两列：
+        prev_out：当天第一条记录的前一条记录为外出时，其刷卡时刻（这次外出到当天的进入为不在场时段）
+        next_in：当天最后一条记录为外出时，其后第一次进入的刷卡时刻（没有时为MISSING）
+    与当天无关时为 NOT_APPLICABLE
+    """
+    rows = rows[rows['stamp'].to_numpy() >= 0].sort_values(['姓名', 'stamp'], kind='stable')
+    names = rows['姓名'].to_numpy(dtype=object)
+    stamps = rows['stamp'].to_numpy(dtype=np.int64)
+    is_in = rows['is_in'].to_numpy(dtype=bool)
+    is_out = rows['is_out'].to_numpy(dtype=bool)
+    days = stamps // SECONDS_PER_DAY
+    if len(rows) == 0:
+        return pd.DataFrame({'prev_out': [], 'next_in': []}, index=_key_index([], []), dtype=np.int64)
+
+    same_person = np.r_[False, names[1:] == names[:-1]]
+    new_day = np.r_[True, ~same_person[1:] | (days[1:] != days[:-1])]
+    first_rows = np.flatnonzero(new_day)
+    last_rows = np.r_[first_rows[1:], len(rows)] - 1
+
+    prev_rows = first_rows - 1
+    has_prev = same_person[first_rows] & is_out[np.maximum(prev_rows, 0)]
+    prev_out = np.where(has_prev, stamps[np.maximum(prev_rows, 0)], NOT_APPLICABLE)
+
+    # 其后第一次进入：从后往前的累计最小值，与 在场时段.build_sessions 的做法相同
+    positions = np.where(is_in, np.arange(len(rows)), len(rows))
+    following = np.r_[np.minimum.accumulate(positions[::-1])[::-1][1:], len(rows)]
+    next_rows = following[last_rows]
+    found = next_rows < len(rows)
+    found[found] = names[next_rows[found]] == names[last_rows[found]]
+    next_in = np.where(found, stamps[np.minimum(next_rows, len(rows) - 1)], MISSING)
+    next_in = np.where(is_out[last_rows], next_in, NOT_APPLICABLE)
+
+    return pd.DataFrame({'prev_out': prev_out, 'next_in': next_in},
+                        index=_key_index(names[first_rows], days[first_rows]))
+
+
+def _in_stamps(rows):
+    """某种班次中全部进入记录的(姓名, 刷卡时刻)，按刷卡时刻排序，用于 merge_asof 查找前后的进入"""
+    rows = rows[rows['is_in'].to_numpy(dtype=bool) & (rows['stamp'].to_numpy() >= 0)]
+    return pd.DataFrame({'姓名': rows['姓名'].to_numpy(dtype=object),
+                         'stamp': rows['stamp'].to_numpy(dtype=np.int64)}).sort_values('stamp', kind='stable')
+
+
+class PersonDays:
+    """班别匹配结果按员工日（姓名, 刷卡日期）划分，计算每个员工日输入数据的指纹
+
+    指纹包括当天全部记录、覆盖当天的请假和加班单，以及白班、夜班稽核中与前后几天相关的刷卡时刻
+    （跨天的不在场时段）。两次运行之间指纹不变的员工日，稽核结果也不会变化。
+    leaves、overtimes 与稽核函数的同名参数相同，为None时指纹使用由各记录上的请假、加班单得到的区间
+    """
+
+    def __init__(self, df, leaves=None, overtimes=None):
+        self.df = df
+        self.leaves = leaves
+        self.overtimes = overtimes
+
+        # 姓名或刷卡日期为空的记录两种稽核都不处理，不属于任何员工日
+        self.names = df['姓名'].to_numpy(dtype=object)
+        self.days = _day_numbers(pd.to_datetime(df['刷卡日期'], errors='coerce'))
+        self.valid = df['姓名'].notna().to_numpy() & (self.days >= 0)
+        names, days = self.names[self.valid], self.days[self.valid]
+
+        row_hashes = pd.util.hash_pandas_object(df[self.valid], index=False).to_numpy()
+        keys = [_key_index(names, days)]
+        hashes = [row_hashes]
+        if len(days):
+            for intervals in (row_leave_intervals(df) if leaves is None else leaves,
+                              row_overtime_intervals(df) if overtimes is None else overtimes):
+                interval_keys, interval_hashes = _interval_hashes(intervals, days.min(), days.max())
+                keys.append(interval_keys)
+                hashes.append(interval_hashes)
+        all_keys = keys[0].append(keys[1:]) if len(keys) > 1 else keys[0]
+        content = _group_sums(all_keys, np.concatenate(hashes).astype(np.uint64))
+
+        # 白班、夜班稽核检测的记录，与两种稽核的出入时段表使用的记录相同
+        self.shift_rows = [day_shift_rows(df), night_shift_rows(df)]
+        parts = [pd.Series(content.to_numpy().view(np.int64), index=content.index, name='content')]
+        for i, rows in enumerate(self.shift_rows):
+            parts.append(_neighbor_stamps(rows).add_suffix(str(i)))
+        table = pd.concat(parts, axis=1).fillna(NOT_APPLICABLE).astype(np.int64)
+        self.fingerprints = pd.Series(pd.util.hash_pandas_object(table, index=True).to_numpy(),
+                                      index=table.index, dtype=np.uint64)
+
+    def changed(self, previous):
+        """与上次的指纹相比变化了的员工日（新增、删除或内容变化），previous 为None时为全部员工日"""
+        if previous is None:
+            return self.fingerprints.index
+        index = self.fingerprints.index.union(previous.index)
+        current = self.fingerprints.reindex(index, fill_value=0).to_numpy()
+        before = previous.reindex(index, fill_value=0).to_numpy()
+        return index[current != before]
+
+    def context_rows(self, changed):
+        """重新检测 changed 员工日及受影响的班次时需要的记录，返回按 df 行顺序的布尔数组
+
+        每个变化的员工日取前两天到后一天的全部记录：前一天的白班跨零点加班、夜班班次都用到次日的记录，
+        没有请假流程表时前一天的跨零点请假来自再前一天的记录。再向前、向后各扩展到白班、夜班中
+        最近的一次进入所在的一天，跨天的不在场时段在这些记录中完整
+        """
+        if len(changed) == 0:
+            return np.zeros(len(self.df), dtype=bool)
+        names = changed.get_level_values(0).to_numpy(dtype=object)
+        days = changed.get_level_values(1).to_numpy(dtype=np.int64)
+        queries = pd.DataFrame({'姓名': names, 'lo': (days - 2) * SECONDS_PER_DAY,
+                                'hi': (days + 2) * SECONDS_PER_DAY, 'order': np.arange(len(days))})
+        first_days = days - 2
+        last_days = days + 1
+        for rows in self.shift_rows:
+            in_stamps = _in_stamps(rows)
+            before = pd.merge_asof(queries.sort_values('lo'), in_stamps, left_on='lo', right_on='stamp',
+                                   by='姓名', direction='backward', allow_exact_matches=False).sort_values('order')
+            after = pd.merge_asof(queries.sort_values('hi'), in_stamps, left_on='hi', right_on='stamp',
+                                  by='姓名', direction='forward').sort_values('order')
+            # 之前没有进入时，之前的全部外出都到当天的进入为止不在场，取到该员工最早的一条记录
+            earliest = rows[rows['stamp'].to_numpy() >= 0].groupby('姓名', observed=True)['stamp'].min()
+            earliest = earliest.reindex(pd.Series(names, dtype=object)).to_numpy(dtype=float)
+            before_stamps = before['stamp'].to_numpy(dtype=float)
+            before_stamps = np.where(np.isnan(before_stamps), earliest, before_stamps)
+            before_days = np.where(np.isnan(before_stamps), first_days,
+                                   np.nan_to_num(before_stamps).astype(np.int64) // SECONDS_PER_DAY)
+            after_stamps = after['stamp'].to_numpy(dtype=float)
+            after_days = np.where(np.isnan(after_stamps), last_days,
+                                  np.nan_to_num(after_stamps).astype(np.int64) // SECONDS_PER_DAY)
+            first_days = np.minimum(first_days, before_days)
+            last_days = np.maximum(last_days, after_days)
+
+        # 员工日编码为 姓名编码 * 2^32 + 天数，区间[first_days, last_days]内的员工日都取
+        codes, uniques = pd.factorize(pd.Series(self.names[self.valid], dtype=object))
+        name_codes = pd.Index(uniques).get_indexer(pd.Series(names, dtype=object))
+        known = name_codes >= 0
+        row_keys = codes.astype(np.int64) * 2 ** 32 + self.days[self.valid]
+        unique_keys = np.unique(row_keys)
+        lo = np.searchsorted(unique_keys, name_codes[known] * 2 ** 32 + first_days[known], side='left')
+        hi = np.searchsorted(unique_keys, name_codes[known] * 2 ** 32 + last_days[known], side='right')
+        depth = np.zeros(len(unique_keys) + 1, dtype=np.int64)
+        np.add.at(depth, lo, 1)
+        np.add.at(depth, hi, -1)
+        covered = np.cumsum(depth[:-1]) > 0
+
+        mask = np.zeros(len(self.df), dtype=bool)
+        mask[self.valid] = covered[np.searchsorted(unique_keys, row_keys)]
+        return mask
+
+
+def recheck_keys(changed):
+    """需要重新检测的白班组和夜班班次：变化的员工日及其前一天
+
+    前一天的白班跨零点加班单用到当天的外出记录，前一天的夜班班次包含当天12点前的记录
+    """
+    names = changed.get_level_values(0).to_numpy(dtype=object)
+    days = changed.get_level_values(1).to_numpy(dtype=np.int64)
+    keys = _key_index(np.r_[names, names], np.r_[days, days - 1])
+    return keys.unique()
+
+
+def day_result_keys(result_df):
+    """白班稽核结果（未整理格式）各记录所在的(姓名, 刷卡日期)"""
+    return _key_index(result_df['姓名'].to_numpy(dtype=object), _day_numbers(result_df['刷卡日期']))
+
+
+def night_result_keys(result_df):
+    """夜班稽核结果（未整理格式）各记录所在的(姓名, 班次日期)"""
+    shift_dates = get_shift_dates(get_swipe_datetimes(result_df))
+    return _key_index(result_df['姓名'].to_numpy(dtype=object), _day_numbers(shift_dates))
+
+
+class AuditStore:
+    """上次稽核的员工日指纹和结果（未整理格式），保存在 稽核缓存 文件夹中，每种稽核一个文件"""
+
+    def __init__(self, name, store_dir=None):
+        self.store_dir = store_dir or get_cache_dir(STORE_DIR_NAME)
+        self.store_file = os.path.join(self.store_dir, f"{name}.pkl")
+
+    def load(self, settings):
+        """读取上次的(指纹, 结果)，没有保存、版本或稽核设置（阈值和代码版本）不同时返回(None, None)"""
+        if not os.path.exists(self.store_file):
+            return None, None
+        try:
+            with open(self.store_file, 'rb') as f:
+                stored = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"读取上次稽核结果失败: {self.store_file}, 错误: {str(e)}")
+            return None, None
+        if stored.get('version') != STORE_VERSION or stored.get('settings') != settings:
+            return None, None
+        return stored['fingerprints'], stored['result']
+
+    def save(self, settings, fingerprints, result):
+        """先写入临时文件再改名，保存失败时只记录警告，下次运行重新检测全部数据"""
+        temp_file = f"{self.store_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            with open(temp_file, 'wb') as f:
+                pickle.dump({'version': STORE_VERSION, 'settings': settings,
+                             'fingerprints': fingerprints, 'result': result}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, self.store_file)
+        except Exception as e:
+            logging.warning(f"保存稽核结果失败: {self.store_file}, 错误: {str(e)}")
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+
+def run_incremental(name, person_days, audit_chunk, result_keys, workers=1, thresholds=None, store_dir=None):
+    """只重新检测输入变化了的员工日，其余员工日沿用上次的稽核结果
+
+    audit_chunk 为按姓名分块执行的稽核函数（见 并行稽核.run_by_name），result_keys 取稽核结果各记录的组。
+    返回合并后的稽核结果（未整理格式），记录顺序与检测全部数据时相同，没有异常时返回None
+    """
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    # 稽核阈值或程序代码变化时，上次的结果全部作废
+    settings = (repr(thresholds), code_version())
+    store = AuditStore(name, store_dir)
+    previous_fingerprints, previous_result = store.load(settings)
+    if previous_fingerprints is None:
+        previous_result = None
+
+    changed = person_days.changed(previous_fingerprints)
+    recheck = recheck_keys(changed)
+    context = person_days.context_rows(changed)
+
+    parts = []
+    if previous_result is not None and len(previous_result):
+        parts.append(previous_result[~result_keys(previous_result).isin(recheck)])
+    carried = sum(len(part) for part in parts)
+    if context.any():
+        results = 并行稽核.run_by_name(person_days.df[context], audit_chunk, workers)
+        for result_df in results:
+            parts.append(result_df[result_keys(result_df).isin(recheck)])
+    logging.info(f"增量稽核: {name}, 变化的员工日 {len(changed)} 个, 重新检测记录 {int(context.sum())} 条, "
+                 f"沿用异常记录 {carried} 条")
+
+    parts = [part for part in parts if len(part)]
+    result_df = pd.concat(parts, ignore_index=True) if parts else None
+    if result_df is not None:
+        # 各组的记录都来自同一次检测，按(姓名, 组)稳定排序即为检测全部数据时的顺序
+        keys = result_keys(result_df)
+        order = pd.DataFrame({'姓名': keys.get_level_values(0), 'day': keys.get_level_values(1)}).sort_values(
+            ['姓名', 'day'], kind='stable').index
+        result_df = result_df.iloc[order].reset_index(drop=True)
+
+    store.save(settings, person_days.fingerprints, result_df)
+    return result_df
+
+
+def audit_day_shift(df, workers=1, leaves=None, overtimes=None, facts=None, thresholds=None, person_days=None,
+                    store_dir=None):
+    """增量执行白班稽核，参数和返回值与 白班稽核1_1.process_attendance_data 相同
+
+    person_days 为 PersonDays，为None时由 df 建立；store_dir 为保存上次稽核结果的文件夹，None表示 稽核缓存
+    """
+    person_days = person_days or PersonDays(df, leaves, overtimes)
+    audit_chunk = partial(白班稽核1_1.audit_day_shift_chunk, leaves=person_days.leaves,
+                          overtimes=person_days.overtimes, facts=facts, thresholds=thresholds)
+    result_df = run_incremental("白班稽核", person_days, audit_chunk, day_result_keys, workers, thresholds, store_dir)
+    if result_df is None:
+        return None
+    return 白班稽核1_1.format_result(result_df)
+
+
+def audit_night_shift(df, workers=1, leaves=None, overtimes=None, facts=None, thresholds=None, person_days=None,
+                      store_dir=None):
+    """增量执行夜班稽核，参数和返回值与 夜班稽核.build_night_result 相同，其余参数见 audit_day_shift"""
+    person_days = person_days or PersonDays(df, leaves, overtimes)
+    audit_chunk = partial(夜班稽核.check_night_shift_anomalies, leaves=person_days.leaves,
+                          overtimes=person_days.overtimes, facts=facts, thresholds=thresholds)
+    result_df = run_incremental("夜班稽核", person_days, audit_chunk, night_result_keys, workers, thresholds,
+                                store_dir)
+    return 夜班稽核.format_night_result(result_df if result_df is not None else pd.DataFrame())
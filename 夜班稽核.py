@@ -1,13 +1,25 @@
+import numpy as np
 import pandas as pd
 import tkinter as tk
 from tkinter import filedialog
-import datetime
-import re
-from collections import defaultdict
 import os
-import concurrent.futures
+import sys
+import time
 from functools import partial
 
+import 并行稽核
+import 班别分类
+from 步骤调度 import make_manifest, emit_manifest
+from 流式读取 import read_excel_streaming, restore_object_columns
+from 报表写出 import consecutive_groups, write_report
+from 列类型 import categorize_columns, row_flags
+from 时间换算 import SECONDS_PER_DAY, SECONDS_PER_MINUTE, clock, minute_text, seconds_text, time_of_day, to_timestamps
+from 在场时段 import build_sessions, collapse_repeats, last_of_runs
+from 区间索引 import absence_index, interval_covers, interval_overlap, leave_index, row_leave_intervals
+from 稽核阈值 import DEFAULT_THRESHOLDS
+from 考勤日汇总 import (NIGHT_SHIFT, build_daily_facts, build_night_shift_table, get_shift_dates, get_swipe_datetimes,
+                   shift_facts)
+
 
 def select_file():
     """选择输入文件"""
@@ -20,487 +32,373 @@ def select_file():
     return file_path
 
 
-def is_night_shift(shift):
-    """判断是否为夜班"""
-    return '夜班' in str(shift)
-
-
-def parse_datetime(date_str, time_str):
-    """解析日期和时间字符串为datetime对象"""
-    try:
-        # 确保输入不是空值或数字
-        if pd.isna(date_str) or pd.isna(time_str) or isinstance(date_str, (int, float)) or isinstance(time_str, (int, float)):
-            return None
-            
-        # 转换为datetime对象
-        date_obj = pd.to_datetime(date_str, errors='coerce')
-        time_obj = pd.to_datetime(time_str, errors='coerce')
-        
-        # 检查转换是否成功
-        if pd.isna(date_obj) or pd.isna(time_obj):
-            return None
-            
-        return datetime.datetime.combine(date_obj.date(), time_obj.time())
-    except Exception as e:
-        print(f"解析日期时间错误: {e}, date_str={date_str}, time_str={time_str}")
-        return None
-
-
-def get_time_diff_minutes(time1, time2):
-    """计算两个时间之间的分钟差"""
-    diff = (time2 - time1).total_seconds() / 60
-    return abs(diff)
-
+# 夜班的上班时间(20:00)和下班时间(04:00)，从0点起算的秒数，即默认阈值
+WORK_START = DEFAULT_THRESHOLDS.night_start
+WORK_END = DEFAULT_THRESHOLDS.night_end
+
+
+def select_valid_records(shift_ids, stamps, clocks, is_in, thresholds=None):
+    """选出各班次参与异常检测的有效记录，返回其在班次表中的序号
+
+    记录按(班次, 刷卡时刻)排序。上班前（20:00前）的记录只保留最后一次进入记录，
+    04:00~04:40的记录同样早于20:00，与原实现一样归入上班前记录；其余为工作时间内的记录。
+    两分钟内的多次打卡划分为一段（见 在场时段.collapse_repeats），段首在工作时间内时只保留最后一条，
+    否则全部保留。上班、下班时间和重复打卡间隔取自 thresholds，为None时使用默认阈值
+    """
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    work_start, work_end = thresholds.night_start, thresholds.night_end
+    shift_ids = np.asarray(shift_ids)
+    before_work = clocks < work_start
+    candidates = ~before_work
+    before_in = np.flatnonzero(before_work & is_in)
+    last_before_in = before_in[np.r_[shift_ids[before_in][1:] != shift_ids[before_in][:-1], True]] \
+        if len(before_in) else before_in
+    candidates[last_before_in] = True
+
+    rows = np.flatnonzero(candidates)
+    anchors = collapse_repeats(shift_ids[rows], stamps[rows], thresholds.duplicate_window)
+    anchor_clocks = clocks[rows][anchors]
+    in_work_time = (anchor_clocks >= work_start) | (anchor_clocks <= work_end)
+    return rows[~in_work_time | last_of_runs(anchors)]
+
+
+def check_night_shift(shift_start, stamps, clocks, is_in, is_out, partners, durations, repeats, overtime_form,
+                      leave_starts, leave_ends, absence_starts, absence_ends, thresholds=DEFAULT_THRESHOLDS):
+    """检查单个夜班班次的异常
+
+    shift_start 为班次日期0点的时间戳（秒），stamps、clocks 为该班次有效记录（见 select_valid_records）
+    按刷卡时刻排序后的时间戳和从0点起算的秒数，is_in、is_out 为对应记录是否为进入、外出记录（见 列类型.row_flags），
+    partners、durations、repeats 为这些记录的出入时段表（见 在场时段.build_sessions）中的 partner、duration、repeat，
+    记录序号为班次内的序号，
+    leave_starts、leave_ends 为该员工全部请假的起止时刻（见 IntervalIndex.intervals_of），
+    absence_starts、absence_ends 为该员工每次外出到再次进入的不在场时段，
+    overtime_form 为该班次的加班单(最早开始时刻, 最晚结束时刻, 时数合计)，没有加班单时为None，
+    thresholds 为 稽核阈值.AuditThresholds。
+    返回(异常描述列表, 需要写入该班次全部记录的附加列取值)
+    """
+    extra_values = {}
+
+    # 获取夜班的上班时间(20:00)和下班时间(04:00)
+    work_start_time = thresholds.night_start
+    work_end_time = thresholds.night_end
+
+    # 获取加班单信息
+    has_overtime_form = overtime_form is not None
+    overtime_form_hours = overtime_form[2] if has_overtime_form else 0
+
+    # 默认的加班开始时间和结束时间，用于划分记录；有加班单时核算加班时长使用加班单的起止时刻
+    overtime_start_time = clock(4, 40)
+    overtime_end_time = clock(8, 10)
+
+    # 各记录已是该班次的有效记录（见 select_valid_records），按刷卡时刻排序
+    records = list(range(len(stamps)))
+
+    # 检查其他异常
+    descriptions = []
+
+    if records:
+        # 检查上班打卡 - 以上班前最后一次进入记录为准
+        last_in_before_work = None
+        for record in records:
+            if is_in[record] and clocks[record] < work_start_time:
+                last_in_before_work = record
+
+        # 如果没有上班前的进入记录，查找最早的进入记录
+        first_in = None
+        for record in records:
+            if is_in[record]:
+                first_in = record
+                break
+
+        # 检查迟到是否被请假覆盖
+        late_covered_by_leave = False
+        if first_in is not None:
+            late_covered_by_leave = interval_covers(leave_starts, leave_ends,
+                                                    shift_start + work_start_time, stamps[first_in])
+
+        # 判断迟到
+        if last_in_before_work is None and first_in is not None and clocks[first_in] > thresholds.night_late_after \
+                and not late_covered_by_leave:
+            descriptions.append(f"首次进入时间为{seconds_text(clocks[first_in])}，"
+                                f"超过{minute_text(thresholds.night_late_after)}")
+
+    # 下班判定逻辑
+    # 无加班单：以4:00后第一条"刷卡机=出"记录作为下班时间，后续打卡记录忽略
+    # 有加班单：以加班单结束时间后的第一条"刷卡机=出"记录作为下班时间，后续打卡记录忽略
+    first_out_after_work = None
+    first_out_after_overtime = None
+
+    # 如果没有加班单，以4:00后第一条出记录为下班时间
+    if not has_overtime_form:
+        for record in records:
+            if is_out[record] and clocks[record] > work_end_time:
+                first_out_after_work = record
+                break
+    # 如果有加班单，以加班单结束时刻后的第一条出记录为下班时间
+    else:
+        for record in records:
+            if is_out[record] and stamps[record] > overtime_form[1]:
+                first_out_after_overtime = record
+                break
+
+    # 如果没有下班后的出记录，查找最后一次出记录
+    last_out = None
+    for record in reversed(records):
+        if is_out[record]:
+            last_out = record
+            break
+
+    # 添加对提前下班的检查
+    if not has_overtime_form and last_out is not None and clocks[last_out] < work_end_time and first_out_after_work is None:
+        descriptions.append(f"最后一次出卡时间为{seconds_text(clocks[last_out])}，"
+                            f"早于正常下班时间{minute_text(work_end_time)}")
+
+    def in_work_or_overtime(record_time):
+        """是否在工作时间或加班时间内"""
+        return (work_start_time <= record_time or record_time <= work_end_time
+                or overtime_start_time <= record_time <= overtime_end_time)
+
+    # 相邻两条有效记录都在工作时间或加班时间内时才判断异常
+    for current, following in zip(records, records[1:]):
+        if not (in_work_or_overtime(clocks[current]) and in_work_or_overtime(clocks[following])):
+            continue
+        current_text = seconds_text(clocks[current])
+        following_text = seconds_text(clocks[following])
+
+        # 检查异常1：工作期间出入时间差大于15分钟，外出与紧接的进入配对
+        if is_out[current] and partners[current] == following:
+            time_diff = durations[current] / SECONDS_PER_MINUTE
+            if time_diff > thresholds.outing_minutes:
+                # 检查外出时间是否被请假覆盖
+                out_time_covered_by_leave = interval_covers(leave_starts, leave_ends, stamps[current], stamps[following])
+
+                # 记录外出信息，无论是否异常
+                extra_values['外出时间'] = current_text
+                extra_values['进入时间'] = following_text
+                extra_values['外出时长'] = int(time_diff)
+
+                # 只有当外出时间未被请假覆盖时才标记为异常
+                if not out_time_covered_by_leave:
+                    descriptions.append(f"外出时间为{current_text}，再次进入时间为{following_text}，外出时长{int(time_diff)}分钟")
+
+    for current, following in zip(records, records[1:]):
+        if not (in_work_or_overtime(clocks[current]) and in_work_or_overtime(clocks[following])):
+            continue
 
-def parse_time(time_val):
-    """解析时间值为datetime.time对象"""
-    if pd.isna(time_val):
-        return None
-        
-    if isinstance(time_val, datetime.datetime):
-        return time_val.time()
-    elif isinstance(time_val, datetime.time):
-        return time_val
-    elif isinstance(time_val, str):
-        try:
-            return datetime.datetime.strptime(time_val, '%H:%M:%S').time()
-        except ValueError:
-            try:
-                return datetime.datetime.strptime(time_val, '%H:%M').time()
-            except ValueError:
-                return None
-    return None
-
-
-def is_time_covered_by_leave(work_time, actual_time, leave_start, leave_end):
-    """检查迟到时间是否被请假时间段覆盖"""
-    if pd.isna(leave_start) or pd.isna(leave_end):
-        return False
-    
-    # 转换为time对象以便比较
-    work_time = parse_time(work_time)
-    actual_time = parse_time(actual_time)
-    leave_start = parse_time(leave_start)
-    leave_end = parse_time(leave_end)
-    
-    if not work_time or not actual_time or not leave_start or not leave_end:
-        return False
-    
-    # 检查迟到时间段是否被请假时间段覆盖
-    # 将time对象转换为分钟数进行比较
-    def time_to_minutes(t):
-        return t.hour * 60 + t.minute
-    
-    work_minutes = time_to_minutes(work_time)
-    actual_minutes = time_to_minutes(actual_time)
-    leave_start_minutes = time_to_minutes(leave_start)
-    leave_end_minutes = time_to_minutes(leave_end)
-    
-    # 如果请假时间覆盖了迟到时间段，则返回True
-    return leave_start_minutes <= work_minutes and leave_end_minutes >= actual_minutes
+        # 检查异常2：有进无出，进入之后紧接着同方向的下一条记录
+        if is_in[current] and repeats[current] == following:
+            # 记录连续进入时间
+            extra_values['连续进入时间1'] = seconds_text(clocks[current])
+            extra_values['连续进入时间2'] = seconds_text(clocks[following])
+            descriptions.append(f"在{seconds_text(clocks[current])}进入后，"
+                                f"在{seconds_text(clocks[following])}再次进入，无出记录")
 
+    for current, following in zip(records, records[1:]):
+        if not (in_work_or_overtime(clocks[current]) and in_work_or_overtime(clocks[following])):
+            continue
 
-def check_night_shift_anomalies(df):
-    """检查夜班考勤异常"""
-    # 初始化结果 DataFrame
-    result_df = pd.DataFrame()  # 显式初始化为空 DataFrame
-    
-    # 初始化额外的列
-    extra_columns = ['外出时间', '进入时间', '外出时长', '连续进入时间1', '连续进入时间2']  # 删除'实际加班时长'
+        # 检查异常3：有出无进，外出之后紧接着同方向的下一条记录
+        if is_out[current] and repeats[current] == following:
+            descriptions.append(f"在{seconds_text(clocks[current])}外出后，"
+                                f"在{seconds_text(clocks[following])}再次外出，无进入记录")
+
+    # 加班进入判定和加班时长核算
+    if has_overtime_form:
+        # 检查4:00是否有出记录
+        has_out_at_work_end = any(is_out[r] and work_end_time < clocks[r] < overtime_start_time
+                                  for r in records)
+
+        # 如果4:00有出记录，则需要在加班开始时间前有进入记录
+        if has_out_at_work_end:
+            # 第一条有效记录不是加班开始前的进入记录时判定为加班未进入
+            if not (is_in[records[0]] and clocks[records[0]] < overtime_start_time):
+                descriptions.append("加班开始前未进入")
+
+            # 计算实际加班时长
+            # 起始时间：加班单开始时刻
+            # 结束时间：加班单结束时刻后的第一条"刷卡机=出"记录
+            # 其间外出到再次进入的时间不计入
+            overtime_start_stamp = overtime_form[0]
+            overtime_end_stamp = None
+
+            if first_out_after_overtime is not None:
+                overtime_end_stamp = stamps[first_out_after_overtime]
+            elif last_out is not None and stamps[last_out] > overtime_start_stamp:
+                overtime_end_stamp = stamps[last_out]
+
+            if overtime_end_stamp is not None:
+                absent = interval_overlap(absence_starts, absence_ends, overtime_start_stamp, overtime_end_stamp)
+                actual_overtime_minutes = (overtime_end_stamp - overtime_start_stamp - absent) / SECONDS_PER_MINUTE
+                actual_overtime_hours = actual_overtime_minutes / 60
+
+                # 记录实际加班时长
+                extra_values['实际加班时长'] = round(actual_overtime_hours, 2)
+
+                # 如果实际加班时长小于加班单时数，标记为异常
+                if actual_overtime_hours < overtime_form_hours:
+                    descriptions.append(f"实际加班时长{round(actual_overtime_hours, 2)}小时，少于加班单时数{overtime_form_hours}小时")
+        else:
+            # 无加班单情况下的加班时长检查
+            overtime_in_records = [r for r in records if overtime_start_time <= clocks[r] <= overtime_end_time
+                                   and is_in[r]]
+            overtime_out_records = [r for r in records if overtime_start_time <= clocks[r] <= overtime_end_time
+                                    and is_out[r]]
+
+            if overtime_in_records and overtime_out_records:
+                # 计算加班时长 - 取最早的进入和最晚的外出
+                overtime_in = stamps[min(overtime_in_records, key=lambda r: stamps[r])]
+                overtime_out = stamps[max(overtime_out_records, key=lambda r: stamps[r])]
+
+                # 如果加班开始时间早于4:40，则按4:40计算
+                start_time = max(overtime_in, overtime_in - overtime_in % SECONDS_PER_DAY + overtime_start_time)
+
+                overtime_minutes = abs(overtime_out - start_time) / SECONDS_PER_MINUTE
+                overtime_hours = overtime_minutes / 60
+
+                # 记录实际加班时长
+                extra_values['实际加班时长'] = round(overtime_hours, 2)
+
+                if overtime_minutes < thresholds.night_overtime_minutes:
+                    descriptions.append(f"加班时长为{int(overtime_minutes)}分钟，"
+                                        f"不足{thresholds.night_overtime_minutes / 60:g}小时")
+
+    return descriptions, extra_values
+
+
+class NightShiftData:
+    """夜班稽核中与阈值无关的数据，建立一次后可以按不同阈值多次检测（见 detect_night_anomalies）
+
+    每个(姓名, 班次日期)为一个班次，记录按(姓名, 班次日期, 刷卡时刻)排序；
+    各班次的加班单取自每日考勤汇总，各员工的请假和不在场时段在首次用到时取出并保留
+    """
+
+    def __init__(self, df, leaves=None, overtimes=None, facts=None):
+        """df 为班别匹配结果，参数见 check_night_shift_anomalies"""
+        # 一次性解析全部夜班记录的刷卡时刻并按员工、班次排序
+        table = build_night_shift_table(df)
+        self.positions = table['position'].to_numpy()
+        self.stamps = to_timestamps(table['datetime'])
+        self.clocks = time_of_day(self.stamps)
+        # 进出方向取自刷卡机列（分类类型）的进入、外出标志
+        flags = row_flags(df, 'is_in', 'is_out')
+        self.is_in = flags['is_in'][self.positions]
+        self.is_out = flags['is_out'][self.positions]
+        # 员工的全部请假组成区间索引，同一天多条请假、跨天请假都参与判断
+        self.leave_idx = leave_index(row_leave_intervals(df) if leaves is None else leaves)
+
+        # 每个(姓名, 班次日期)为一个班次
+        names = table['姓名'].to_numpy()
+        shift_values = table['shift_date'].to_numpy()
+        boundaries = np.flatnonzero((names[1:] != names[:-1]) | (shift_values[1:] != shift_values[:-1])) + 1
+        self.starts = np.r_[0, boundaries] if len(table) else np.zeros(0, dtype=int)
+        self.ends = np.r_[boundaries, len(table)] if len(table) else np.zeros(0, dtype=int)
+        self.shift_ids = np.repeat(np.arange(len(self.starts)), self.ends - self.starts)
+        self.shift_names = names[self.starts]
+        self.shift_starts = to_timestamps(table['shift_date'])[self.starts].tolist()
+
+        # 出入时段表按员工建立一次：每次外出到再次进入的不在场时段，核算实际加班时长时扣除
+        sessions = build_sessions(pd.factorize(names)[0], self.stamps, self.is_in, self.is_out)
+        self.absence_idx = absence_index(names, self.stamps, self.is_out, sessions['next_in'].to_numpy())
+        self.person_intervals = {}
+
+        # 班次的加班单取自每日考勤汇总：在班次日期12点到次日12点之间开始的全部加班单
+        if facts is None:
+            facts = build_daily_facts(df, overtimes, shifts=(NIGHT_SHIFT,))
+        night_facts = shift_facts(facts, NIGHT_SHIFT, self.shift_names, shift_values[self.starts])
+        form_count = night_facts['加班单数'].fillna(0).to_numpy(dtype=np.int64)
+        form_starts = to_timestamps(night_facts['加班开始']).tolist()
+        form_ends = to_timestamps(night_facts['加班结束']).tolist()
+        form_hours = night_facts['加班单时数'].tolist()
+        self.overtime_forms = [(start, end, hours) if count else None for count, start, end, hours in
+                               zip(form_count.tolist(), form_starts, form_ends, form_hours)]
+
+    def intervals_of(self, name):
+        """员工的请假和不在场时段，返回(请假开始, 请假结束, 不在场开始, 不在场结束)四个列表"""
+        if name not in self.person_intervals:
+            self.person_intervals[name] = self.leave_idx.intervals_of(name) + self.absence_idx.intervals_of(name)
+        return self.person_intervals[name]
+
+
+def detect_night_anomalies(data, thresholds=None):
+    """按阈值检测各夜班班次的异常
+
+    data 为 NightShiftData，thresholds 为 稽核阈值.AuditThresholds，为None时使用默认阈值。
+    返回有异常的班次列表[(班次序号, 异常描述列表, 附加列取值)]
+    """
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+
+    # 各班次的有效记录（上班前只保留最后一次进入、两分钟内的重复打卡合并），在班次表中连续存放
+    valid_rows = select_valid_records(data.shift_ids, data.stamps, data.clocks, data.is_in, thresholds)
+    valid_shift_ids = data.shift_ids[valid_rows]
+    bounds = np.searchsorted(valid_shift_ids, np.arange(len(data.starts) + 1))
+    valid_bounds = bounds.tolist()
+    valid_stamps = data.stamps[valid_rows].tolist()
+    valid_clocks = data.clocks[valid_rows].tolist()
+    valid_is_in = data.is_in[valid_rows].tolist()
+    valid_is_out = data.is_out[valid_rows].tolist()
+
+    # 有效记录按班次建立出入时段表，配对和同方向的下一条记录换算为班次内的序号
+    sessions = build_sessions(valid_shift_ids, data.stamps[valid_rows], data.is_in[valid_rows], data.is_out[valid_rows])
+    shift_lo = bounds[valid_shift_ids]
+    valid_partners, valid_repeats = (np.where(sessions[c] >= 0, sessions[c] - shift_lo, -1).tolist()
+                                     for c in ('partner', 'repeat'))
+    valid_durations = sessions['duration'].tolist()
+
+    anomalies = []
+    for shift, (name, overtime_form) in enumerate(zip(data.shift_names, data.overtime_forms)):
+        leave_starts, leave_ends, absence_starts, absence_ends = data.intervals_of(name)
+        lo, hi = valid_bounds[shift], valid_bounds[shift + 1]
+        descriptions, extra_values = check_night_shift(data.shift_starts[shift], valid_stamps[lo:hi],
+                                                       valid_clocks[lo:hi], valid_is_in[lo:hi], valid_is_out[lo:hi],
+                                                       valid_partners[lo:hi], valid_durations[lo:hi],
+                                                       valid_repeats[lo:hi], overtime_form, leave_starts, leave_ends,
+                                                       absence_starts, absence_ends, thresholds)
+        if descriptions:
+            anomalies.append((shift, descriptions, extra_values))
+    return anomalies
+
+
+def check_night_shift_anomalies(df, leaves=None, overtimes=None, facts=None, thresholds=None):
+    """检查夜班考勤异常，姓名、班别、刷卡机等文本列先转换为分类类型
+
+    与阈值无关的准备见 NightShiftData，按阈值检测见 detect_night_anomalies。
+    leaves 为请假区间表（见 区间索引.leave_intervals），为None时由各记录上的请假时间得到；
+    overtimes 为加班单区间表（见 区间索引.overtime_intervals），为None时由各记录上的加班单得到；
+    facts 为每日考勤汇总（见 考勤日汇总.build_daily_facts），各班次的加班单从中读取，为None时由 df 和 overtimes 生成；
+    thresholds 为 稽核阈值.AuditThresholds，为None时使用默认阈值
+    """
+    categorize_columns(df)
+
+    # 额外的列
+    extra_columns = ['外出时间', '进入时间', '外出时长', '连续进入时间1', '连续进入时间2']
     for col in extra_columns:
         df[col] = None
 
-    # 按员工分组
-    employee_groups = df.groupby('姓名')
-
-    for name, group in employee_groups:
-        # 筛选夜班记录
-        night_shifts = group[group['班别'].apply(is_night_shift)]
-        if night_shifts.empty:
-            continue
-
-        # 按日期和时间排序
-        night_shifts = night_shifts.sort_values(['刷卡日期', '刷卡时间'])
-
-        # 重新组织夜班记录（以12点为分界）
-        shift_records = defaultdict(list)
-        for _, row in night_shifts.iterrows():
-            dt = parse_datetime(row['刷卡日期'], row['刷卡时间'])
-            if not dt:
-                continue
-
-            # 忽略12:00-18:00的打卡记录
-            if datetime.time(12, 0) <= dt.time() <= datetime.time(18, 0):
-                continue
-
-            # 确定记录属于哪个夜班班次（以12点为分界）
-            if dt.time() >= datetime.time(12, 0):
-                shift_date = dt.date()
-            else:
-                shift_date = dt.date() - datetime.timedelta(days=1)
-
-            shift_records[shift_date].append({
-                'datetime': dt,
-                'type': row['来源'],
-                'direction': row['刷卡机'],
-                'row': row
-            })
-
-        # 检查每个夜班班次的异常
-        for shift_date, records in shift_records.items():
-            # 按时间排序
-            records = sorted(records, key=lambda x: x['datetime'])
-            
-            # 保存原始记录，用于输出完整打卡记录
-            original_records = records.copy()
-            
-            # 获取夜班的上班时间(20:00)和下班时间(04:00)
-            work_start_time = datetime.time(20, 0)
-            work_end_time = datetime.time(4, 0)
-
-            # 获取加班单信息
-            # has_overtime_form = False
-            # overtime_form_start_time = None
-            # overtime_form_end_time = None
-            # overtime_form_hours = 0
-            has_overtime_form = False
-            overtime_form_start_time = None
-            overtime_form_end_time = None
-            overtime_form_hours = 0
-            
-            if records and 'row' in records[0]:
-                row = records[0]['row']
-                if not pd.isna(row.get('加班单开始时间')) and not pd.isna(row.get('加班单结束时间')):
-                    has_overtime_form = True
-                    overtime_form_start_time = parse_time(row.get('加班单开始时间'))
-                    overtime_form_end_time = parse_time(row.get('加班单结束时间'))
-                    overtime_form_hours = float(row.get('加班单时数', 0)) if not pd.isna(row.get('加班单时数', 0)) else 0
-            
-            # 加班开始时间和结束时间
-            # 如果有加班单，使用加班单的时间，否则使用默认时间
-            overtime_start_time = datetime.time(4, 40)
-            overtime_end_time = datetime.time(8, 10)
-            
-            # 分类记录：上班前、工作时间内、下班后、加班时间内
-            before_work_records = []
-            work_time_records = []
-            after_work_records = []
-            # overtime_records = []  # 删除加班时间记录
-            
-            for record in records:
-                record_time = record['datetime'].time()
-                # 上班前记录 (< 20:00)
-                if record_time < work_start_time:
-                    before_work_records.append(record)
-                # 下班后记录 (> 04:00 且 < 05:10)
-                elif record_time > work_end_time and record_time < overtime_start_time:
-                    after_work_records.append(record)
-                # 加班时间记录 (>= 05:10 且 <= 08:10)
-                # elif overtime_start_time <= record_time <= overtime_end_time:
-                #     overtime_records.append(record)
-                # 工作时间记录 (>= 20:00 或 <= 04:00)
-                else:
-                    work_time_records.append(record)
-            
-            # 处理上班前记录 - 只保留最后一次进入记录
-            last_in_before_work = None
-            for record in reversed(before_work_records):
-                if record['direction'] == '进':
-                    last_in_before_work = record
-                    break
-            
-            # 处理下班后记录 - 只保留第一次打卡记录
-            first_after_work = after_work_records[0] if after_work_records else None
-            
-            # 合并有效记录
-            filtered_records = []
-            if last_in_before_work:
-                filtered_records.append(last_in_before_work)
-            filtered_records.extend(work_time_records)
-            if first_after_work:
-                filtered_records.append(first_after_work)
-            # filtered_records.extend(overtime_records)  # 删除加班时间记录
-            
-            # 重新按时间排序
-            filtered_records = sorted(filtered_records, key=lambda x: x['datetime'])
-            
-            # 处理两分钟内多次打卡的情况
-            processed_records = []
-            i = 0
-            while i < len(filtered_records):
-                current = filtered_records[i]
-                j = i + 1
-                duplicates = [current]
-
-                # 查找2分钟内的所有记录
-                while j < len(filtered_records) and (filtered_records[j]['datetime'] - current['datetime']).total_seconds() <= 120:
-                    duplicates.append(filtered_records[j])
-                    j += 1
-
-                # 获取当前时间
-                current_time = current['datetime'].time()
-                
-                # 判断是否在工作时间内或加班时间内
-                is_work_time = (work_start_time <= current_time or current_time <= work_end_time)
-                # is_overtime = overtime_start_time <= current_time <= overtime_end_time
-                # 不再检查进出方向不一致，只保留最后一条记录
-                if (is_work_time):
-                    # 只保留最后一条记录
-                    processed_records.append(duplicates[-1])
-                else:
-                    # 非工作时间，保留所有记录
-                    for r in duplicates:
-                        processed_records.append(r)
-
-                i = j
-
-            # 使用处理后的记录进行异常检测
-            records = processed_records
-
-            # 检查其他异常
-            anomalies = []
-            descriptions = []
-
-            if records:
-                # 获取请假信息
-                leave_start = None
-                leave_end = None
-                if 'row' in records[0] and '请假开始时间' in records[0]['row'] and '请假结束时间' in records[0]['row']:
-                    leave_start = records[0]['row'].get('请假开始时间')
-                    leave_end = records[0]['row'].get('请假结束时间')
-                
-                # 检查上班打卡 - 以上班前最后一次进入记录为准
-                last_in_before_work = None
-                for record in records:
-                    if record['direction'] == '进' and record['datetime'].time() < work_start_time:
-                        last_in_before_work = record
-                
-                # 如果没有上班前的进入记录，查找最早的进入记录
-                first_in = None
-                for record in records:
-                    if record['direction'] == '进':
-                        first_in = record
-                        break
-                
-                # 检查迟到是否被请假覆盖
-                late_covered_by_leave = False
-                if first_in and leave_start is not None and leave_end is not None:
-                    late_covered_by_leave = is_time_covered_by_leave(work_start_time, first_in['datetime'].time(), leave_start, leave_end)
-                
-                # 判断迟到
-                if not last_in_before_work and first_in and first_in['datetime'].time() > datetime.time(20, 1) and not late_covered_by_leave:
-                    anomalies.append("首次进入超时")
-                    descriptions.append(f"首次进入时间为{first_in['datetime'].strftime('%H:%M:%S')}，超过20:01")
-
-                # 下班判定逻辑
-                # 无加班单：以4:00后第一条"刷卡机=出"记录作为下班时间，后续打卡记录忽略
-                # 有加班单：以加班单结束时间后的第一条"刷卡机=出"记录作为下班时间，后续打卡记录忽略
-                # 只保留无加班单逻辑
-                first_out_after_work = None
-                for record in records:
-                    if record['direction'] == '出' and record['datetime'].time() > work_end_time:
-                        first_out_after_work = record
-                        break
-            # 删除所有与加班时长异常相关的异常判定与描述输出
-            # 检查下班打卡
-            first_out_after_overtime = None
-            
-            # 如果没有加班单，以4:00后第一条出记录为下班时间
-            if not has_overtime_form:
-                for record in records:
-                    if record['direction'] == '出' and record['datetime'].time() > work_end_time:
-                        first_out_after_work = record
-                        break
-            # 如果有加班单，以加班单结束时间后的第一条出记录为下班时间
-            else:
-                for record in records:
-                    if record['direction'] == '出' and record['datetime'].time() > overtime_end_time:
-                        first_out_after_overtime = record
-                        break
-            
-            # 如果没有下班后的出记录，查找最后一次出记录
-            last_out = None
-            for record in reversed(records):
-                if record['direction'] == '出':
-                    last_out = record
-                    break
-            
-            # 添加对提前下班的检查
-            if not has_overtime_form and last_out and last_out['datetime'].time() < work_end_time and not first_out_after_work:
-                anomalies.append("提前下班")
-                descriptions.append(f"最后一次出卡时间为{last_out['datetime'].strftime('%H:%M:%S')}，早于正常下班时间04:00")
-
-            # 检查异常1：工作期间出入时间差大于15分钟 - 只在工作时间和加班时间内判断
-            i = 0
-            while i < len(records) - 1:
-                current_time = records[i]['datetime'].time()
-                next_time = records[i+1]['datetime'].time()
-                
-                # 判断是否在工作时间内或加班时间内
-                current_in_work_time = (work_start_time <= current_time or current_time <= work_end_time)
-                current_in_overtime = overtime_start_time <= current_time <= overtime_end_time
-                next_in_work_time = (work_start_time <= next_time or next_time <= work_end_time)
-                next_in_overtime = overtime_start_time <= next_time <= overtime_end_time
-                
-                if (current_in_work_time or current_in_overtime) and (next_in_work_time or next_in_overtime):
-                    if records[i]['direction'] == '出' and records[i + 1]['direction'] == '进':
-                        time_diff = get_time_diff_minutes(records[i]['datetime'], records[i + 1]['datetime'])
-                        if time_diff > 15:
-                            # 检查外出时间是否被请假覆盖
-                            out_time_covered_by_leave = False
-                            if leave_start is not None and leave_end is not None:
-                                out_time_covered_by_leave = is_time_covered_by_leave(records[i]['datetime'].time(), 
-                                                                                    records[i + 1]['datetime'].time(), 
-                                                                                    leave_start, leave_end)
-                            
-                            # 记录外出信息，无论是否异常
-                            for record in original_records:
-                                if 'row' in record:
-                                    record['row']['外出时间'] = records[i]['datetime'].strftime('%H:%M:%S')
-                                    record['row']['进入时间'] = records[i + 1]['datetime'].strftime('%H:%M:%S')
-                                    record['row']['外出时长'] = int(time_diff)
-                            
-                            # 只有当外出时间未被请假覆盖时才标记为异常
-                            if not out_time_covered_by_leave:
-                                anomalies.append("工作时间外出超过15分钟")
-                                descriptions.append(f"外出时间为{records[i]['datetime'].strftime('%H:%M:%S')}，"
-                                                        f"再次进入时间为{records[i + 1]['datetime'].strftime('%H:%M:%S')}，"
-                                                        f"外出时长{int(time_diff)}分钟")
-                i += 1
-
-            # 检查异常2：有进无出 - 只在工作时间和加班时间内判断
-            i = 0
-            while i < len(records) - 1:
-                current_time = records[i]['datetime'].time()
-                next_time = records[i+1]['datetime'].time()
-                
-                # 判断是否在工作时间内或加班时间内
-                current_in_work_time = (work_start_time <= current_time or current_time <= work_end_time)
-                current_in_overtime = overtime_start_time <= current_time <= overtime_end_time
-                next_in_work_time = (work_start_time <= next_time or next_time <= work_end_time)
-                next_in_overtime = overtime_start_time <= next_time <= overtime_end_time
-                
-                if (current_in_work_time or current_in_overtime) and (next_in_work_time or next_in_overtime):
-                    if records[i]['direction'] == '进' and records[i + 1]['direction'] == '进':
-                        # 记录连续进入时间
-                        for record in original_records:
-                            if 'row' in record:
-                                record['row']['连续进入时间1'] = records[i]['datetime'].strftime('%H:%M:%S')
-                                record['row']['连续进入时间2'] = records[i + 1]['datetime'].strftime('%H:%M:%S')
-                        
-                        anomalies.append("有进无出")
-                        descriptions.append(f"在{records[i]['datetime'].strftime('%H:%M:%S')}进入后，"
-                                                f"在{records[i + 1]['datetime'].strftime('%H:%M:%S')}再次进入，无出记录")
-                i += 1
-
-            # 检查异常3：有出无进 - 只在工作时间和加班时间内判断
-            i = 0
-            while i < len(records) - 1:
-                current_time = records[i]['datetime'].time()
-                next_time = records[i+1]['datetime'].time()
-                
-                # 判断是否在工作时间内或加班时间内
-                current_in_work_time = (work_start_time <= current_time or current_time <= work_end_time)
-                current_in_overtime = overtime_start_time <= current_time <= overtime_end_time
-                next_in_work_time = (work_start_time <= next_time or next_time <= work_end_time)
-                next_in_overtime = overtime_start_time <= next_time <= overtime_end_time
-                
-                if (current_in_work_time or current_in_overtime) and (next_in_work_time or next_in_overtime):
-                    if records[i]['direction'] == '出' and records[i + 1]['direction'] == '出':
-                        anomalies.append("有出无进")
-                        descriptions.append(f"在{records[i]['datetime'].strftime('%H:%M:%S')}外出后，"
-                                                f"在{records[i + 1]['datetime'].strftime('%H:%M:%S')}再次外出，无进入记录")
-                i += 1
-
-            # 加班进入判定和加班时长核算
-            if has_overtime_form:
-                # 检查4:00是否有出记录
-                has_out_at_work_end = False
-                for record in records:
-                    if record['direction'] == '出' and record['datetime'].time() > work_end_time and record['datetime'].time() < overtime_start_time:
-                        has_out_at_work_end = True
-                        break
-                
-                # 如果4:00有出记录，则需要在加班开始时间前有进入记录
-                if has_out_at_work_end:
-                    has_in_before_overtime = False
-                    for record in records:
-                        if record['direction'] == '进' and record['datetime'].time() < overtime_start_time:
-                            has_in_before_overtime = True
-                            break
-                        
-                        if not has_in_before_overtime:
-                            anomalies.append("加班未进入")
-                            descriptions.append("加班开始前未进入")
-                    
-                    # 计算实际加班时长
-                    # 起始时间：4:40
-                    # 结束时间：加班单结束时间后的第一条"刷卡机=出"记录
-                    overtime_start_datetime = datetime.datetime.combine(shift_date, overtime_start_time)
-                    overtime_end_datetime = None
-                    
-                    if first_out_after_overtime:
-                        overtime_end_datetime = first_out_after_overtime['datetime']
-                    elif last_out and last_out['datetime'].time() > overtime_start_time:
-                        overtime_end_datetime = last_out['datetime']
-                    
-                    if overtime_end_datetime:
-                        actual_overtime_minutes = get_time_diff_minutes(overtime_start_datetime, overtime_end_datetime)
-                        actual_overtime_hours = actual_overtime_minutes / 60
-                        
-                        # 记录实际加班时长
-                        for record in original_records:
-                            if 'row' in record:
-                                record['row']['实际加班时长'] = round(actual_overtime_hours, 2)
-                        
-                        # 如果实际加班时长小于加班单时数，标记为异常
-                        if actual_overtime_hours < overtime_form_hours:
-                            anomalies.append("加班时长不足")
-                            descriptions.append(f"实际加班时长{round(actual_overtime_hours, 2)}小时，少于加班单时数{overtime_form_hours}小时")
-                else:
-                    # 无加班单情况下的加班时长检查
-                    overtime_in_records = [r for r in records if r['datetime'].time() >= overtime_start_time
-                                        and r['datetime'].time() <= overtime_end_time and r['direction'] == '进']
-                    overtime_out_records = [r for r in records if r['datetime'].time() >= overtime_start_time
-                                         and r['datetime'].time() <= overtime_end_time and r['direction'] == '出']
-
-                    if overtime_in_records and overtime_out_records:
-                        # 计算加班时长 - 取最早的进入和最晚的外出
-                        overtime_in = min(overtime_in_records, key=lambda x: x['datetime'])
-                        overtime_out = max(overtime_out_records, key=lambda x: x['datetime'])
-
-                        # 如果加班开始时间早于4:40，则按4:40计算
-                        start_time = max(overtime_in['datetime'],
-                                         datetime.datetime.combine(overtime_in['datetime'].date(), overtime_start_time))
-
-                        overtime_minutes = get_time_diff_minutes(start_time, overtime_out['datetime'])
-                        overtime_hours = overtime_minutes / 60
-                        
-                        # 记录实际加班时长
-                        for record in original_records:
-                            if 'row' in record:
-                                record['row']['实际加班时长'] = round(overtime_hours, 2)
-                        
-                        if overtime_minutes < 180:  # 3小时 = 180分钟
-                            anomalies.append("加班时长不足3小时")
-                            descriptions.append(f"加班时长为{int(overtime_minutes)}分钟，不足3小时")
-
-            # 如果有异常，将该班次的所有原始打卡记录添加到结果中
-            if anomalies:
-                # 获取异常描述
-                desc = '；'.join(set(descriptions))
-                
-                # 将所有原始记录添加到结果中
-                for record in original_records:
-                    new_row = record['row'].copy()
-                    new_row['异常'] = '是'
-                    new_row['异常描述'] = desc
-
-                    if result_df.empty:
-                        result_df = pd.DataFrame([new_row])
-                    else:
-                        result_df = pd.concat([result_df, pd.DataFrame([new_row])], ignore_index=True)
-
+    data = NightShiftData(df, leaves, overtimes, facts)
+
+    # 异常班次的记录行号、异常描述和附加列取值，全部检查完后一次性生成DataFrame
+    result_positions = []
+    result_descriptions = []
+    result_extra_values = []
+
+    for shift, descriptions, extra_values in detect_night_anomalies(data, thresholds):
+        # 将有异常的班次的所有原始打卡记录添加到结果中
+        start, end = data.starts[shift], data.ends[shift]
+        desc = '；'.join(dict.fromkeys(descriptions))
+        result_positions.extend(data.positions[start:end].tolist())
+        result_descriptions.extend([desc] * (end - start))
+        result_extra_values.extend([extra_values] * (end - start))
+
+    if not result_positions:
+        return pd.DataFrame()
+
+    result_df = df.iloc[result_positions].reset_index(drop=True)
+    for col in extra_columns + ['实际加班时长']:
+        values = [extra_values.get(col) for extra_values in result_extra_values]
+        if col in extra_columns or any(v is not None for v in values):
+            result_df[col] = pd.Series(values, dtype=object)
+    result_df['异常'] = '是'
+    result_df['异常描述'] = result_descriptions
     return result_df
 
 
@@ -522,91 +420,101 @@ def get_matched_file():
     matched_file = max(matched_files, key=lambda f: os.path.getmtime(os.path.join(attendance_dir, f)))
     return os.path.join(attendance_dir, matched_file)
 
-def process_in_thread(file_path):
-    """线程处理函数"""
+NIGHT_RESULT_COLUMNS = ['单位', '部门', '部门CXO-2', '工号', '姓名', '刷卡日期', '刷卡时间', '刷卡机', '班别',
+                        '加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数',
+                        '请假开始时间', '请假结束时间', '请假时数', '异常', '异常描述',
+                        '外出时间', '进入时间', '外出时长', '连续进入时间1', '连续进入时间2', '实际加班时长']
+
+
+def build_night_result(df, workers=1, leaves=None, overtimes=None, facts=None, thresholds=None):
+    """检查夜班异常并按输出列顺序整理结果
+
+    workers 为并行进程数，None表示使用全部CPU核心，大于1时按姓名分块在多个进程中检测。
+    leaves 为请假流程表的请假区间表，为None时使用班别匹配结果各记录上的请假时间；
+    overtimes 为加班流程表的加班单区间表，为None时使用班别匹配结果各记录上的加班单；
+    facts 为每日考勤汇总，为None时各分块由自己的记录生成；
+    thresholds 为 稽核阈值.AuditThresholds，为None时使用默认阈值
+    """
+    # 处理夜班考勤异常
+    results = 并行稽核.run_by_name(df, partial(check_night_shift_anomalies, leaves=leaves, overtimes=overtimes,
+                                               facts=facts, thresholds=thresholds), workers)
+    return format_night_result(pd.concat(results, ignore_index=True) if results else pd.DataFrame())
+
+
+def format_night_result(result_df):
+    """补齐夜班稽核结果的输出列并按输出列顺序排列，分类类型的列还原为普通列"""
+    # 确保所有列都存在
+    for col in NIGHT_RESULT_COLUMNS:
+        if col not in result_df.columns:
+            result_df[col] = None
+
+    # 按照要求的列顺序排列，分类类型的列还原为普通列
+    return restore_object_columns(result_df[NIGHT_RESULT_COLUMNS].copy())
+
+
+def get_merge_ranges(result_df):
+    """计算需要合并异常描述单元格的行范围
+
+    连续的同一员工同一班次（以12点为分界）为一组，返回[(起始行, 结束行)]，行号从0开始且不含表头
+    """
+    if len(result_df) < 2:
+        return []
+
+    # 确定班次日期（以12点为分界），无法解析的记录班次日期相同
+    shift_dates = get_shift_dates(get_swipe_datetimes(result_df)).fillna(pd.Timestamp.min).to_numpy()
+    names = result_df['姓名'].to_numpy()
+
+    # 新的员工或班次开始一个合并区域，最后一个区域只有多于一行时才合并
+    starts, ends = consecutive_groups(names, shift_dates)
+    if ends[-1] == starts[-1]:
+        starts, ends = starts[:-1], ends[:-1]
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def save_night_result(result_df, output_path):
+    """保存夜班稽查结果，并合并相同班次的异常描述单元格"""
+    write_report(result_df, output_path, sheet_name='夜班异常', merge_ranges=get_merge_ranges(result_df))
+
+
+def process_file(file_path):
+    """读取班别匹配结果，按姓名分块并行检测夜班异常并保存结果
+
+    成功时返回结果清单，失败时返回None
+    """
     try:
+        start_time = time.time()
+        
         # 读取文件
         if file_path.endswith('.csv'):
             df = pd.read_csv(file_path)
         else:
-            df = pd.read_excel(file_path)
+            df = read_excel_streaming(file_path)
 
-        # 处理夜班考勤异常
-        result_df = check_night_shift_anomalies(df)
+        # 处理夜班考勤异常，请假、加班流程表与班别匹配结果在同一文件夹中
+        data_dir = os.path.dirname(os.path.abspath(file_path))
+        leaves = 班别分类.load_leave_intervals(data_dir)
+        overtimes = 班别分类.load_overtime_intervals(data_dir)
+        result_df = build_night_result(df, workers=None, leaves=leaves, overtimes=overtimes)
 
         # 保存结果
         output_path = os.path.join(os.path.dirname(file_path), "夜班稽查结果.xlsx")
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            # 确保输出所有需要的列
-            required_columns = ['单位', '部门', '部门CXO-2', '工号', '姓名', '刷卡日期', '刷卡时间', '刷卡机', '班别', 
-                              '加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数', 
-                              '请假开始时间', '请假结束时间', '请假时数', '异常', '异常描述', 
-                              '外出时间', '进入时间', '外出时长', '连续进入时间1', '连续进入时间2', '实际加班时长']
-            
-            # 确保所有列都存在
-            for col in required_columns:
-                if col not in result_df.columns:
-                    result_df[col] = None
-            
-            # 按照要求的列顺序排列
-            result_df = result_df[required_columns]
-            
-            result_df.to_excel(writer, index=False, sheet_name='夜班异常')
-            # 获取工作簿和工作表
-            workbook = writer.book
-            worksheet = writer.sheets['夜班异常']
-
-            # 合并相同班次的异常描述单元格
-            from openpyxl.utils import get_column_letter
-
-            # 获取异常描述列的索引
-            desc_col_idx = result_df.columns.get_loc('异常描述') + 1  # Excel列从1开始
-
-            # 按姓名和班次日期分组，合并单元格
-            current_name = None
-            current_shift_date = None
-            start_row = 2  # Excel数据从第2行开始（第1行是表头）
-
-            for i, row in enumerate(result_df.itertuples(), start=2):
-                name = getattr(row, '姓名')
-                dt = parse_datetime(getattr(row, '刷卡日期'), getattr(row, '刷卡时间'))
-
-                # 确定班次日期（以12点为分界）
-                if dt and dt.time() >= datetime.time(12, 0):
-                    shift_date = dt.date()
-                else:
-                    shift_date = dt.date() - datetime.timedelta(days=1) if dt else None
-
-                if name != current_name or shift_date != current_shift_date:
-                    # 如果是新的员工或班次，结束上一个合并区域
-                    if current_name is not None and i > start_row:
-                        cell_range = f"{get_column_letter(desc_col_idx)}{start_row}:{get_column_letter(desc_col_idx)}{i - 1}"
-                        worksheet.merge_cells(cell_range)
-
-                    # 开始新的合并区域
-                    current_name = name
-                    current_shift_date = shift_date
-                    start_row = i
-
-            # 处理最后一组
-            if current_name is not None and start_row < i:
-                cell_range = f"{get_column_letter(desc_col_idx)}{start_row}:{get_column_letter(desc_col_idx)}{i}"
-                worksheet.merge_cells(cell_range)
+        save_night_result(result_df, output_path)
 
         print(f"处理完成，结果已保存至: {output_path}")
         print(f"共发现 {len(result_df)} 条异常记录")
+        return make_manifest("夜班稽核", outputs={"夜班稽查结果": output_path},
+                             rows={"夜班稽查结果": len(result_df)}, elapsed=time.time() - start_time)
     except Exception as e:
         print(f"处理文件时出错: {str(e)}")
+        return None
 
 if __name__ == "__main__":
     try:
-        # 自动获取文件
-        file_path = get_matched_file()
-        
-        # 使用线程池处理
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(process_in_thread, file_path)
-            future.result()  # 等待线程完成
+        # 使用命令行指定的班别匹配结果文件，未指定时自动获取
+        file_path = sys.argv[1] if len(sys.argv) > 1 else get_matched_file()
+        manifest = process_file(file_path)
+        if manifest:
+            emit_manifest(manifest)
             
     except Exception as e:
         print(f"程序运行出错：{str(e)}")
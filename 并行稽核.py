@@ -0,0 +1,110 @@
+import os
+import sys
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+
+# 默认并行进程数，None表示使用全部CPU核心
+DEFAULT_WORKERS = None
+
+# 每个进程至少处理的记录数，数据量较小时启动进程的开销大于并行带来的收益
+MIN_ROWS_PER_WORKER = 20000
+
+
+def get_worker_count(workers=None):
+    """确定并行进程数
+
+    打包后的程序（PyInstaller）中子进程会重新启动整个程序，固定为1，即串行执行
+    """
+    if getattr(sys, 'frozen', False):
+        return 1
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def partition_by_name(df, chunk_count):
+    """按姓名把数据切分为记录数大致均衡的若干块
+
+    同一员工的记录在同一块中，块之间按姓名排序，依次拼接各块的稽核结果即为串行执行时的顺序。
+    姓名为空的记录两种稽核都不处理，不分配到任何块
+    """
+    counts = df['姓名'].value_counts(sort=False).sort_index()
+    if counts.empty:
+        return []
+
+    # 按累计记录数的中点把员工分配到各块
+    cumulative = counts.cumsum()
+    midpoints = (cumulative - counts / 2) / cumulative.iloc[-1]
+    chunk_ids = np.minimum((midpoints * chunk_count).astype(int), chunk_count - 1)
+    row_chunks = df['姓名'].map(pd.Series(chunk_ids.to_numpy(), index=counts.index))
+
+    chunks = []
+    for chunk_id in range(chunk_count):
+        chunk = df[(row_chunks == chunk_id).to_numpy()]
+        if not chunk.empty:
+            chunks.append(chunk)
+    return chunks
+
+
+def encode_frame(df):
+    """把DataFrame转换为紧凑的数组，便于在进程之间传递
+
+    文本等object列转换为整数编码和取值表，其余列直接使用numpy数组
+    """
+    columns = []
+    for col in df.columns:
+        values = df[col]
+        if values.dtype == object:
+            codes, uniques = pd.factorize(values)
+            columns.append((col, codes.astype(np.int32), np.asarray(uniques, dtype=object)))
+        else:
+            columns.append((col, values.to_numpy(), None))
+    return columns
+
+
+def decode_frame(columns):
+    """由 encode_frame 的结果还原DataFrame，空值还原为NaN"""
+    data = {}
+    for col, values, uniques in columns:
+        if uniques is not None:
+            decoded = np.empty(len(values), dtype=object)
+            decoded[:] = np.nan
+            valid = values >= 0
+            decoded[valid] = uniques[values[valid]]
+            values = decoded
+        data[col] = values
+    return pd.DataFrame(data, columns=[col for col, _, _ in columns])
+
+
+def _run_encoded(audit_func, columns):
+    """子进程中执行：还原数据块、执行稽核并编码结果"""
+    result_df = audit_func(decode_frame(columns))
+    if result_df is None or result_df.empty:
+        return None
+    return encode_frame(result_df)
+
+
+def run_by_name(df, audit_func, workers=None):
+    """按姓名分块并行执行稽核，返回各块的稽核结果列表（按姓名顺序，不含空结果）
+
+    audit_func 接收一个数据块并返回稽核结果DataFrame，必须是模块级函数以便子进程调用。
+    进程数为1或数据量较小时直接在当前进程中串行执行
+    """
+    workers = get_worker_count(workers)
+    chunk_count = min(workers, max(1, len(df) // MIN_ROWS_PER_WORKER))
+
+    if chunk_count == 1:
+        result_df = audit_func(df)
+        return [] if result_df is None or result_df.empty else [result_df]
+
+    chunks = partition_by_name(df, chunk_count)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        futures = [executor.submit(_run_encoded, audit_func, encode_frame(chunk)) for chunk in chunks]
+        results = [future.result() for future in futures]
+
+    return [decode_frame(columns) for columns in results if columns is not None]
@@ -1,6 +1,10 @@
 import os
+import sys
+import time
 import pandas as pd
 
+from 步骤调度 import make_manifest, emit_manifest
+
 def get_files():
     """获取考勤数据文件夹中的合并结果文件"""
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,20 +21,27 @@ def get_files():
 
     return os.path.join(attendance_dir, merged_file)
 
-def process_files():
-    """查找合并结果文件并重命名为核对版数据.xlsx"""
+def process_files(merged_file=None):
+    """把合并结果文件重命名为核对版数据.xlsx，成功时返回结果清单，失败时返回None
+
+    merged_file 为空时在考勤数据文件夹中查找合并结果文件
+    """
     try:
-        merged_file = get_files()
+        start_time = time.time()
+        if merged_file is None:
+            merged_file = get_files()
         output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "考勤数据")
         output_file = os.path.join(output_dir, "核对版数据.xlsx")
         
         os.rename(merged_file, output_file)
         print(f"文件已重命名为: {output_file}")
-        return True
+        return make_manifest("异常数据稽核", outputs={"核对版数据": output_file}, elapsed=time.time() - start_time)
         
     except Exception as e:
         print(f"重命名文件时出错: {str(e)}")
-        return False
+        return None
 
 if __name__ == "__main__":
-    process_files()
+    manifest = process_files(sys.argv[1] if len(sys.argv) > 1 else None)
+    if manifest:
+        emit_manifest(manifest)
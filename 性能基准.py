@@ -0,0 +1,330 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import 班别分类
+import 白班稽核1_1
+import 夜班稽核
+import 内容优化
+from 列类型 import categorize_columns
+from 流式读取 import restore_object_columns
+from 区间索引 import INTERVAL_COLUMNS, row_leave_intervals
+
+
+def build_shift_match_data(person_count=100, seed=1):
+    """在内存中生成一个月的班别分类输入：刷卡明细、上下班打卡明细、职务性质、加班流程表和请假流程表
+
+    包含白领员工、没有姓名的刷卡记录、缺少班别的日期（需要前向填充）和整月没有班别的员工，
+    以及同一人同一天的多张加班单、多条请假和跨天的请假
+    """
+    rng = random.Random(seed)
+    start_day = date(2025, 3, 1)
+    swipes, shifts, overtimes, leaves = [], [], [], []
+    job_nature = {}
+
+    for person in range(person_count):
+        name = f"员工{person:05d}"
+        job_nature[name] = "白领" if person % 10 == 3 else "普工"
+        no_shift = person % 25 == 7
+        for d in range(30):
+            day = start_day + timedelta(days=d)
+            if not no_shift and rng.random() < 0.85:
+                shifts.append({'姓名': name, '出勤日期': day.isoformat(),
+                               '班别': rng.choice(["白班", "夜班", "休息白班"])})
+                if rng.random() < 0.05:
+                    # 同一天有两条打卡明细
+                    shifts.append({'姓名': name, '出勤日期': day.isoformat(), '班别': "连班半小时白班"})
+            for _ in range(rng.choice([0, 1, 1, 2])):
+                overtimes.append({'姓名': name, '出勤日期': day.isoformat(),
+                                  '加班单开始日期': day.isoformat(), '加班单开始时间': rng.choice(['17:00', '18:00']),
+                                  '加班单结束日期': day.isoformat(), '加班单结束时间': '20:00',
+                                  '加班单时数': rng.choice([2, 3, 3.5])})
+            for _ in range(rng.choice([0, 0, 0, 1, 2])):
+                end_day = day + timedelta(days=rng.choice([0, 0, 2]))
+                leaves.append({'姓名': name, '请假开始日期': day.isoformat(),
+                               '请假开始时间': rng.choice(['08:00', '13:00']), '请假结束日期': end_day.isoformat(),
+                               '请假结束时间': rng.choice(['12:00', '17:00']), '请假时数': rng.choice([2, 4, 8])})
+            for minutes in sorted(rng.sample(range(7 * 60, 21 * 60), rng.choice([0, 2, 4]))):
+                swipes.append({'单位': '某工厂', '部门': '制造一部', '部门CXO-2': '制造', '工号': f"E{person:05d}",
+                               '姓名': name, '刷卡日期': day.isoformat(),
+                               '刷卡时间': f"{minutes // 60:02d}:{minutes % 60:02d}:00",
+                               '刷卡机': rng.choice(['进', '出']), '来源': '门禁'})
+    for record in rng.sample(swipes, 20):
+        swipes.append(dict(record, 姓名=None))
+
+    card_detail = pd.DataFrame(swipes)
+    card_detail['刷卡日期'] = pd.to_datetime(card_detail['刷卡日期']).dt.date
+    attendance = pd.DataFrame(shifts)
+    attendance['出勤日期'] = pd.to_datetime(attendance['出勤日期']).dt.date
+    overtime = pd.DataFrame(overtimes)
+    overtime['出勤日期'] = pd.to_datetime(overtime['出勤日期']).dt.date
+    leave = pd.DataFrame(leaves)
+    leave['请假开始日期'] = pd.to_datetime(leave['请假开始日期']).dt.date
+    leave['请假结束日期'] = pd.to_datetime(leave['请假结束日期']).dt.date
+    return card_detail, attendance, job_nature, overtime, leave
+
+
+def benchmark_match_shifts(person_count=100):
+    """对比班别分类逐条实现与连接实现的耗时，并核对两者的班别匹配结果一致"""
+    card_detail, attendance, job_nature, overtime, leave = build_shift_match_data(person_count)
+    print(f"班别分类基准：{len(card_detail)} 条刷卡记录，{len(overtime)} 张加班单，{len(leave)} 条请假")
+
+    start_time = time.time()
+    rowwise_df = 班别分类.enrich_card_detail_rowwise(card_detail.copy(), attendance.copy(), job_nature,
+                                                 overtime.copy(), leave.copy())
+    rowwise_time = time.time() - start_time
+    print(f"  逐条匹配: {rowwise_time:.2f}秒")
+
+    # 与 match_shifts 相同，刷卡明细的文本列为分类类型，结果还原为普通列
+    start_time = time.time()
+    joined_df = 班别分类.enrich_card_detail(categorize_columns(card_detail.copy()), attendance.copy(), job_nature,
+                                        overtime.copy(), leave.copy())
+    joined_df = restore_object_columns(joined_df)
+    joined_time = time.time() - start_time
+    print(f"  连接匹配: {joined_time:.2f}秒")
+
+    pd.testing.assert_frame_equal(rowwise_df, joined_df, check_dtype=False)
+    print(f"  结果一致，{len(joined_df)} 条记录，提速 {rowwise_time / max(joined_time, 1e-6):.1f} 倍")
+
+
+def build_day_shift_data(swipe_count=100000, seed=1):
+    """在内存中生成班别匹配结果格式的白班刷卡数据，用于性能基准
+
+    每人每天包含上班进入、若干次外出返回、下班外出，部分日期带加班单和请假单，
+    覆盖迟到、外出超时、连续进入、早退、加班不足等规则
+    """
+    rng = random.Random(seed)
+    records = []
+    start_day = date(2025, 3, 1)
+    person = 0
+
+    def swipe_time(day, minutes):
+        minutes = max(0, min(minutes, 24 * 60 - 1))
+        return datetime.combine(day, datetime.min.time()) + timedelta(minutes=minutes, seconds=rng.randint(0, 59))
+
+    while len(records) < swipe_count:
+        name = f"员工{person:05d}"
+        emp_no = f"E{person:05d}"
+        person += 1
+        for d in range(30):
+            day = start_day + timedelta(days=d)
+            shift = rng.choice(["白班", "白班", "白班", "休息白班", "连班半小时白班"])
+            has_overtime = rng.random() < 0.3
+            has_leave = rng.random() < 0.1
+            base = {
+                '单位': '某工厂', '部门': '制造一部', '部门CXO-2': '制造', '工号': emp_no,
+                '姓名': name, '刷卡日期': day.isoformat(), '班别': shift,
+                '加班单开始日期': None, '加班单开始时间': None, '加班单结束日期': None,
+                '加班单结束时间': None, '加班单时数': None,
+                '请假开始时间': None, '请假结束时间': None, '请假时数': None,
+            }
+            if has_overtime:
+                base.update({'加班单开始日期': day.isoformat(), '加班单开始时间': '17:00',
+                             '加班单结束日期': day.isoformat(), '加班单结束时间': '20:00',
+                             '加班单时数': rng.choice([2, 3, 3.5])})
+            if has_leave:
+                base.update({'请假开始时间': '08:00', '请假结束时间': rng.choice(['10:00', '12:00', '17:00']),
+                             '请假时数': 2})
+
+            swipes = [(7 * 60 + 50 + rng.randint(-15, 14), '进')]
+            if rng.random() < 0.2:
+                swipes.append((7 * 60 + 55 + rng.randint(-3, 3), '进'))
+            for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+                out_minutes = 10 * 60 + rng.randint(0, 300)
+                swipes.append((out_minutes, '出'))
+                if rng.random() < 0.9:
+                    swipes.append((out_minutes + rng.choice([1, 5, 10, 20, 40, 90]), '进'))
+            if has_overtime:
+                swipes.append((16 * 60 + 40 if rng.random() < 0.5 else 16 * 60 + 45 + rng.randint(-10, 10), '出'))
+                if rng.random() < 0.7:
+                    swipes.append((16 * 60 + 55 + rng.randint(-5, 4), '进'))
+                swipes.append((20 * 60 + 5 + rng.randint(-30, 30), '出'))
+            else:
+                swipes.append((16 * 60 + 45 + rng.randint(-30, 20), '出'))
+
+            for minutes, machine in swipes:
+                record = dict(base)
+                record['刷卡时间'] = swipe_time(day, minutes)
+                record['刷卡机'] = machine
+                records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def build_day_shift_leaves(matched, seed=1):
+    """白班刷卡数据的请假区间表：记录上的请假，另给部分员工加上同一天的第二条请假和跨天的请假
+
+    第二条请假为当天13:00~15:00，与上午的请假不相连；跨天请假从某天12:00到两天后的10:00
+    """
+    rng = random.Random(seed)
+    intervals = [row_leave_intervals(matched)]
+    extra = []
+    for name, dates in matched.groupby('姓名')['刷卡日期'].unique().items():
+        if rng.random() < 0.3:
+            day = pd.Timestamp(rng.choice(list(dates)))
+            extra.append((name, day + pd.Timedelta(hours=8), day + pd.Timedelta(hours=10)))
+            extra.append((name, day + pd.Timedelta(hours=13), day + pd.Timedelta(hours=15)))
+        if rng.random() < 0.2:
+            day = pd.Timestamp(rng.choice(list(dates)))
+            extra.append((name, day + pd.Timedelta(hours=12), day + pd.Timedelta(days=2, hours=10)))
+    intervals.append(pd.DataFrame(extra, columns=INTERVAL_COLUMNS))
+    return pd.concat(intervals, ignore_index=True)
+
+
+def benchmark_day_shift(swipe_count=100000):
+    """对比白班稽核逐条实现与按列实现的耗时，并核对两者结果一致
+
+    请假区间包含同一天的两条请假和跨天的请假（见 build_day_shift_leaves），两种实现都按员工的全部请假判断
+    """
+    matched = build_day_shift_data(swipe_count)
+    leaves = build_day_shift_leaves(matched)
+    print(f"白班稽核基准：{len(matched)} 条刷卡记录，{len(leaves)} 条请假")
+
+    start_time = time.time()
+    df = 白班稽核1_1.prepare_attendance_data(matched)
+    print(f"  数据准备: {time.time() - start_time:.2f}秒")
+
+    start_time = time.time()
+    rowwise_df = 白班稽核1_1.audit_day_shift_rowwise(df, leaves)
+    rowwise_time = time.time() - start_time
+    print(f"  逐条检测: {rowwise_time:.2f}秒")
+
+    start_time = time.time()
+    columnar_df = 白班稽核1_1.audit_day_shift(df, leaves)
+    columnar_time = time.time() - start_time
+    print(f"  按列检测: {columnar_time:.2f}秒")
+
+    rowwise_df = 白班稽核1_1.format_result(rowwise_df).reset_index(drop=True)
+    columnar_df = 白班稽核1_1.format_result(columnar_df).reset_index(drop=True)
+    pd.testing.assert_frame_equal(rowwise_df, columnar_df, check_dtype=False)
+    print(f"  结果一致，异常记录 {len(columnar_df)} 条，提速 {rowwise_time / max(columnar_time, 1e-6):.1f} 倍")
+
+
+def build_night_shift_data(swipe_count, seed=1):
+    """在内存中生成班别匹配结果格式的夜班刷卡数据，每个班次都有异常
+
+    每个班次4条记录：20:01后首次进入、工作时间外出超过15分钟后返回、次日4:00后下班，
+    夜班稽核会把全部记录作为异常记录输出
+    """
+    rng = random.Random(seed)
+    records = []
+    start_day = date(2025, 3, 1)
+    person = 0
+
+    while len(records) < swipe_count:
+        name = f"员工{person:05d}"
+        emp_no = f"E{person:05d}"
+        person += 1
+        for d in range(30):
+            day = start_day + timedelta(days=d)
+            next_day = day + timedelta(days=1)
+            base = {
+                '单位': '某工厂', '部门': '制造一部', '部门CXO-2': '制造', '工号': emp_no,
+                '姓名': name, '班别': '夜班', '来源': '门禁',
+                '加班单开始日期': None, '加班单开始时间': None, '加班单结束日期': None,
+                '加班单结束时间': None, '加班单时数': None,
+                '请假开始时间': None, '请假结束时间': None, '请假时数': None,
+            }
+            out_minutes = 22 * 60 + rng.randint(0, 60)
+            swipes = [
+                (day, 20 * 60 + rng.randint(5, 30), '进'),
+                (day, out_minutes, '出'),
+                (day, out_minutes + rng.randint(20, 60), '进'),
+                (next_day, 4 * 60 + rng.randint(5, 30), '出'),
+            ]
+            for swipe_day, minutes, machine in swipes:
+                record = dict(base)
+                record['刷卡日期'] = swipe_day.isoformat()
+                record['刷卡时间'] = f"{minutes // 60:02d}:{minutes % 60:02d}:{rng.randint(0, 59):02d}"
+                record['刷卡机'] = machine
+                records.append(record)
+            if len(records) >= swipe_count:
+                break
+
+    return pd.DataFrame(records)
+
+
+def benchmark_night_shift_result(sizes=(1000, 10000, 50000, 200000)):
+    """夜班稽核异常记录收集的耗时随异常记录数的变化，每条记录的耗时应基本不变"""
+    print("夜班稽核基准：异常记录数与耗时")
+    for size in sizes:
+        df = build_night_shift_data(size)
+        start_time = time.time()
+        result_df = 夜班稽核.check_night_shift_anomalies(df)
+        run_time = time.time() - start_time
+        print(f"  {len(result_df):>7} 条异常记录: {run_time:.2f}秒，每条 {run_time / len(result_df) * 1e6:.0f}微秒")
+
+
+def benchmark_report_writer(swipe_count=100000):
+    """对比白班稽查结果“写出-重新加载-合并-再保存”与一次写出的耗时"""
+    df = 白班稽核1_1.prepare_attendance_data(build_day_shift_data(swipe_count))
+    result_df = 白班稽核1_1.format_result(白班稽核1_1.audit_day_shift(df)).reset_index(drop=True)
+    print(f"稽核结果写出基准：{len(result_df)} 条异常记录")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_file = os.path.join(temp_dir, "白班稽查结果.xlsx")
+
+        start_time = time.time()
+        result_df.to_excel(output_file, index=False)
+        wb = load_workbook(output_file)
+        ws = wb.active
+        desc_col = result_df.columns.get_loc('异常描述') + 1
+        for start, end in 白班稽核1_1.get_merge_ranges(result_df):
+            ws.merge_cells(start_row=start + 2, start_column=desc_col, end_row=end + 2, end_column=desc_col)
+        wb.save(output_file)
+        reload_time = time.time() - start_time
+        print(f"  写出后重新加载合并: {reload_time:.2f}秒")
+
+        start_time = time.time()
+        白班稽核1_1.save_result_to_excel(result_df, output_file)
+        single_pass_time = time.time() - start_time
+        print(f"  一次写出: {single_pass_time:.2f}秒，提速 {reload_time / max(single_pass_time, 1e-6):.1f} 倍")
+
+
+def benchmark_content_optimize(row_count=10000):
+    """对比内容优化原实现与一次写出的耗时，并核对两者写出的数据一致
+
+    原实现逐个合并单元格，耗时随记录数平方增长，默认记录数较小
+    """
+    df = 白班稽核1_1.prepare_attendance_data(build_day_shift_data(row_count * 2))
+    df = 白班稽核1_1.format_result(白班稽核1_1.audit_day_shift(df)).head(row_count)
+    df = df.sort_values(['姓名', '刷卡日期'])
+    print(f"内容优化基准：{len(df)} 条核对版记录")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        reload_file = os.path.join(temp_dir, "原实现.xlsx")
+        start_time = time.time()
+        内容优化.optimize_excel_reload(df, reload_file)
+        reload_time = time.time() - start_time
+        print(f"  写出后重新加载逐格设置: {reload_time:.2f}秒")
+
+        single_pass_file = os.path.join(temp_dir, "一次写出.xlsx")
+        start_time = time.time()
+        内容优化.write_optimized_report(df, single_pass_file, 内容优化.build_anomaly_report(df.sort_values('姓名')))
+        single_pass_time = time.time() - start_time
+        print(f"  一次写出: {single_pass_time:.2f}秒")
+
+        reload_sheets = pd.read_excel(reload_file, sheet_name=None)
+        single_pass_sheets = pd.read_excel(single_pass_file, sheet_name=None)
+        for name in reload_sheets:
+            pd.testing.assert_frame_equal(reload_sheets[name], single_pass_sheets[name])
+        print(f"  结果一致，提速 {reload_time / max(single_pass_time, 1e-6):.1f} 倍")
+
+
+def main():
+    swipe_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    benchmark_match_shifts()
+    benchmark_day_shift(swipe_count)
+    benchmark_night_shift_result()
+    benchmark_report_writer(swipe_count)
+    benchmark_content_optimize()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+
+
+# 表头样式与 DataFrame.to_excel 相同
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'),
+                       top=Side(style='thin'), bottom=Side(style='thin'))
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+def consecutive_groups(*keys):
+    """连续且各键都相同的行为一组，返回各组的(起始行数组, 结束行数组)，行号从0开始"""
+    row_count = len(keys[0]) if keys else 0
+    if row_count == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    changed = np.zeros(row_count - 1, dtype=bool)
+    for key in keys:
+        key = np.asarray(key)
+        changed |= key[1:] != key[:-1]
+    starts = np.r_[0, np.flatnonzero(changed) + 1]
+    ends = np.r_[starts[1:] - 1, row_count - 1]
+    return starts, ends
+
+
+def _cell_value(value):
+    """与 DataFrame.to_excel 一致地转换单个取值：数值和日期原样写入，时长按天数写入，其余转换为文本"""
+    if isinstance(value, (str, bool, int, float, datetime, date)):
+        return value
+    if isinstance(value, (np.bool_, np.integer, np.floating)):
+        return value.item()
+    if isinstance(value, timedelta):
+        return value.total_seconds() / 86400
+    return str(value)
+
+
+def excel_values(series):
+    """把一列转换为写入单元格的Python值，空值为None"""
+    values = series.tolist()
+    if series.dtype == object or series.dtype.kind == 'm':
+        values = [_cell_value(value) for value in values]
+    for i in np.flatnonzero(series.isna().to_numpy()).tolist():
+        values[i] = None
+    return values
+
+
+def write_report(df, output_file, sheet_name='Sheet1', merge_ranges=(), merge_column='异常描述'):
+    """一次写出稽核结果并合并异常描述单元格
+
+    以只写模式逐行写出，合并区域预先按DataFrame计算，写出后不再重新加载和保存。
+    merge_ranges 为[(起始行, 结束行)]，行号从0开始且不含表头；
+    与openpyxl合并单元格时一样，合并区域中除首行外的单元格写为空
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+
+    columns = [excel_values(df[col]) for col in df.columns]
+    merge_col = None
+    if merge_ranges and merge_column in df.columns:
+        merge_col = df.columns.get_loc(merge_column)
+        merged_values = columns[merge_col]
+        for start, end in merge_ranges:
+            merged_values[start + 1:end + 1] = [None] * (end - start)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+
+    header = []
+    for column in df.columns:
+        cell = WriteOnlyCell(ws, value=column)
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        header.append(cell)
+    ws.append(header)
+
+    for row in zip(*columns):
+        ws.append(row)
+
+    if merge_col is not None:
+        # Excel数据从第2行开始（第1行是表头）
+        # 各合并区域互不重叠，直接构造区域集合；逐个 merged_cells.add 会与已有区域逐一比较
+        letter = get_column_letter(merge_col + 1)
+        ws.merged_cells = MultiCellRange([CellRange(f"{letter}{start + 2}:{letter}{end + 2}")
+                                          for start, end in merge_ranges])
+
+    wb.save(output_file)
@@ -0,0 +1,176 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+
+# 空值或无法解析的时间
+MISSING = -1
+
+SECONDS_PER_MINUTE = 60
+SECONDS_PER_HOUR = 60 * SECONDS_PER_MINUTE
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+
+
+def clock(hour, minute=0, second=0):
+    """时:分:秒转换为从0点起算的秒数"""
+    return hour * SECONDS_PER_HOUR + minute * SECONDS_PER_MINUTE + second
+
+
+def parse_time(time_val):
+    """解析时间值为datetime.time对象"""
+    if pd.isna(time_val):
+        return None
+
+    if isinstance(time_val, datetime.datetime):
+        return time_val.time()
+    elif isinstance(time_val, datetime.time):
+        return time_val
+    elif isinstance(time_val, str):
+        try:
+            return datetime.datetime.strptime(time_val, '%H:%M:%S').time()
+        except ValueError:
+            try:
+                return datetime.datetime.strptime(time_val, '%H:%M').time()
+            except ValueError:
+                return None
+    return None
+
+
+def parse_clock_texts(values):
+    """把刷卡时间文本批量解析为日期时间，结果与 pd.to_datetime(values, errors='coerce') 相同，空值为NaT
+
+    pd.to_datetime 无法从“时:分:秒”文本推断统一格式，会用dateutil逐个解析（日期部分为当天）。
+    这里两位数字的“时:分:秒”“时:分”按固定格式批量解析，其他写法的取值再逐个解析。
+    取值不全是文本或能推断出统一格式时返回None，由调用方按原方式解析
+    """
+    values = pd.Series(values)
+    present = values.notna()
+    texts = values[present]
+    if texts.empty or not texts.map(type).eq(str).all() or guess_datetime_format(texts.iloc[0]) is not None:
+        return None
+
+    clock_values = pd.Series(pd.NaT, index=texts.index, dtype='datetime64[ns]')
+    for pattern, fmt in ((r'\d{2}:\d{2}:\d{2}', '%H:%M:%S'), (r'\d{2}:\d{2}', '%H:%M')):
+        todo = texts.str.fullmatch(pattern).to_numpy()
+        clock_values[todo] = pd.to_datetime(texts[todo], format=fmt, errors='coerce')
+    parsed = pd.Timestamp.now().normalize() + (clock_values - clock_values.dt.normalize())
+
+    retry = parsed.isna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(texts[retry], errors='coerce', format='mixed')
+
+    result = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    result[present] = parsed
+    return result
+
+
+def to_datetime_values(values):
+    """批量解析日期或时间列，空值、数字和无法解析的取值为NaT
+
+    “时:分:秒”文本按固定格式批量解析；其他取值先按推断出的统一格式解析，
+    格式不统一导致解析失败的取值再逐个解析，结果与逐个调用 pd.to_datetime(value, errors='coerce') 相同
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    parsed = parse_clock_texts(values)
+    if parsed is not None:
+        return parsed
+    is_number = values.map(lambda v: isinstance(v, (int, float)))
+    values = values.where(~is_number)
+    parsed = pd.to_datetime(values, errors='coerce')
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], errors='coerce', format='mixed')
+    return parsed
+
+
+def to_time(value):
+    """用 pd.to_datetime 把取值转换为datetime.time对象，空值和无法解析的取值返回None"""
+    if value is None or pd.isna(value):
+        return None
+    try:
+        dt = pd.to_datetime(value, errors='coerce')
+        if pd.isna(dt):
+            return None
+        return dt.time()
+    except Exception:
+        return None
+
+
+def time_seconds(value):
+    """datetime.time转换为从0点起算的秒数，None返回MISSING"""
+    if value is None:
+        return MISSING
+    return clock(value.hour, value.minute, value.second)
+
+
+def map_unique(values, func):
+    """对每个不同的取值只调用一次 func，按编码展开为与 values 等长的object数组，空值的结果为 func(None)"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    mapped = np.empty(len(uniques) + 1, dtype=object)
+    mapped[:-1] = [func(value) for value in uniques]
+    # 空值的编码为-1，对应末尾的结果
+    mapped[-1] = func(None)
+    return mapped[codes]
+
+
+def to_time_values(values, parser=to_time):
+    """把一列时间转换为datetime.time对象数组（object），空值和无法解析的取值为None"""
+    return map_unique(values, parser)
+
+
+def to_seconds(values, parser=parse_time):
+    """把一列时间转换为从0点起算的秒数（int32），空值和无法解析的取值为MISSING
+
+    日期时间类型的列直接按列计算，其余各列的每个不同取值只用 parser 解析一次
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        seconds = (values - values.dt.normalize()) // pd.Timedelta(seconds=1)
+        return seconds.fillna(MISSING).to_numpy().astype(np.int32)
+    seconds = map_unique(values, lambda value: time_seconds(parser(value)))
+    return seconds.astype(np.int32)
+
+
+def to_timestamps(values):
+    """把日期时间列转换为从1970-01-01起算的秒数（int64），NaT为MISSING"""
+    values = pd.Series(values)
+    stamps = values.to_numpy(dtype='datetime64[ns]').astype('datetime64[s]').astype(np.int64)
+    return np.where(values.notna().to_numpy(), stamps, MISSING)
+
+
+def time_of_day(timestamps):
+    """时间戳对应的从0点起算的秒数（int32）"""
+    return (np.asarray(timestamps) % SECONDS_PER_DAY).astype(np.int32)
+
+
+def day_start(timestamps):
+    """时间戳所在日期0点的时间戳"""
+    timestamps = np.asarray(timestamps)
+    return timestamps - timestamps % SECONDS_PER_DAY
+
+
+def seconds_text(seconds):
+    """从0点起算的秒数转换为“时:分:秒”文本"""
+    seconds = int(seconds)
+    return f"{seconds // SECONDS_PER_HOUR:02d}:{seconds // SECONDS_PER_MINUTE % 60:02d}:{seconds % 60:02d}"
+
+
+def minute_text(seconds):
+    """从0点起算的秒数转换为“时:分”文本"""
+    return seconds_text(seconds)[:5]
+
+
+def covered_by_leave(start, end, leave_start, leave_end):
+    """时间段[start, end]是否被请假时间段覆盖，按分钟比较（秒数忽略），任一时间为MISSING时不覆盖
+
+    参数为从0点起算的秒数，可以是整数或等长的数组
+    """
+    start, end = np.asarray(start), np.asarray(end)
+    leave_start, leave_end = np.asarray(leave_start), np.asarray(leave_end)
+    valid = (start >= 0) & (end >= 0) & (leave_start >= 0) & (leave_end >= 0)
+    return (valid & (leave_start // SECONDS_PER_MINUTE <= start // SECONDS_PER_MINUTE)
+            & (leave_end // SECONDS_PER_MINUTE >= end // SECONDS_PER_MINUTE))
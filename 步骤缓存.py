@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import glob
+import shutil
+import pickle
+import hashlib
+import logging
+from datetime import datetime
+
+from 表格缓存 import get_program_dir, file_hash
+
+
+# 步骤缓存格式版本，记录或结果的结构变化时修改，使旧缓存失效
+STEP_CACHE_VERSION = 1
+
+# 步骤缓存文件夹，放在考勤数据文件夹中，与各步骤的输出文件在一起
+STEP_CACHE_DIR_NAME = "步骤缓存"
+
+# 历史记录文件夹，运行完成后考勤数据文件夹中的文件按运行时间移入其中
+HISTORY_DIR_NAME = "历史记录"
+
+# 保留最近几次运行的文件
+KEEP_RUNS = 3
+
+_code_version = None
+
+
+def code_version():
+    """程序代码版本：全部源代码文件内容的哈希值，打包后为可执行文件的大小和修改时间
+
+    任何代码修改都使全部步骤缓存失效，避免遗漏步骤间接依赖的模块
+    """
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        if getattr(sys, 'frozen', False):
+            stat = os.stat(sys.executable)
+            digest.update(f"{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8'))
+        else:
+            for path in sorted(glob.glob(os.path.join(get_program_dir(), '*.py'))):
+                digest.update(os.path.basename(path).encode('utf-8'))
+                digest.update(file_hash(path).encode('utf-8'))
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def _write_atomic(path, data):
+    """先写入临时文件再改名，读取方不会读到写了一半的文件"""
+    temp_file = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, path)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+class StepCache:
+    """make式的步骤缓存：每个步骤在缓存文件夹中保存一份记录（步骤名.json）和结果（步骤名.pkl）
+
+    记录包含步骤输入文件的哈希值、依赖步骤的缓存键、代码版本和参数，缓存键为记录的哈希值。
+    重新运行时缓存键与记录一致的步骤直接读取保存的结果，不再执行；每个步骤只保留最近一次的结果
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, step, ext):
+        return os.path.join(self.cache_dir, step + ext)
+
+    def make_key(self, step, inputs=None, params=None, depends_on=None):
+        """计算步骤的缓存键，返回(缓存键, 记录)
+
+        Args:
+            step: 步骤名称
+            inputs: 步骤读取的文件，{名称: 文件路径}，文件不存在时为None
+            params: 影响步骤结果的参数，{参数名: 取值}，取值按 repr 记录
+            depends_on: 依赖步骤的缓存键，{步骤名: 缓存键}
+        """
+        record = {
+            "version": STEP_CACHE_VERSION,
+            "step": step,
+            "code": code_version(),
+            "inputs": {name: file_hash(path) if path else None for name, path in (inputs or {}).items()},
+            "params": {name: repr(value) for name, value in (params or {}).items()},
+            "depends_on": dict(depends_on or {}),
+        }
+        key = hashlib.sha256(json.dumps(record, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        return key, record
+
+    def load(self, step, key):
+        """读取缓存键一致的步骤结果，返回(是否命中, 结果)"""
+        try:
+            with open(self._path(step, '.json'), 'r', encoding='utf-8') as f:
+                if json.load(f).get("key") != key:
+                    return False, None
+            with open(self._path(step, '.pkl'), 'rb') as f:
+                return True, pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:
+            logging.warning(f"读取步骤缓存失败: {step}, 错误: {str(e)}")
+            return False, None
+
+    def save(self, step, key, record, result):
+        """保存步骤结果和记录，先写结果再写记录，中途失败时旧记录与新结果不会被当作一致"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            json_file = self._path(step, '.json')
+            if os.path.exists(json_file):
+                os.remove(json_file)
+            _write_atomic(self._path(step, '.pkl'), pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+            record = dict(record, key=key, saved_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            _write_atomic(json_file, json.dumps(record, ensure_ascii=False, indent=2).encode('utf-8'))
+        except Exception as e:
+            logging.warning(f"保存步骤缓存失败: {step}, 错误: {str(e)}")
+
+
+def archive_run_files(data_dir, keep_runs=KEEP_RUNS):
+    """考勤数据文件夹的保留策略，代替运行完成后删除整个文件夹
+
+    文件夹中本次运行的文件（输入表格和各步骤输出）移入 历史记录/运行时间，只保留最近 keep_runs 次运行的文件；
+    步骤缓存文件夹保留，下次输入相同时直接使用。返回本次文件移入的文件夹，没有文件时返回None
+    """
+    run_dir = None
+    files = [name for name in os.listdir(data_dir) if os.path.isfile(os.path.join(data_dir, name))]
+    history_dir = os.path.join(data_dir, HISTORY_DIR_NAME)
+    if files:
+        run_dir = os.path.join(history_dir, datetime.now().strftime('%Y%m%d_%H%M%S'))
+        os.makedirs(run_dir, exist_ok=True)
+        for name in files:
+            shutil.move(os.path.join(data_dir, name), os.path.join(run_dir, name))
+
+    # 文件夹名为运行时间，按名称排序即按时间排序
+    if os.path.isdir(history_dir):
+        runs = sorted(name for name in os.listdir(history_dir) if os.path.isdir(os.path.join(history_dir, name)))
+        for name in runs[:max(0, len(runs) - keep_runs)]:
+            shutil.rmtree(os.path.join(history_dir, name), ignore_errors=True)
+    return run_dir
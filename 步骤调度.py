@@ -0,0 +1,92 @@
+import json
+import logging
+import concurrent.futures
+
+
+# 子进程模式下，步骤脚本在标准输出中打印一行以此开头的JSON结果清单
+MANIFEST_PREFIX = "STEP_MANIFEST:"
+
+
+def make_manifest(step, outputs=None, rows=None, elapsed=None):
+    """生成步骤结果清单
+
+    Args:
+        step: 步骤名称
+        outputs: 输出文件，{结果名称: 文件路径}，没有输出时为空
+        rows: 各输出的记录数，{结果名称: 记录数}
+        elapsed: 步骤耗时（秒）
+    """
+    return {
+        "step": step,
+        "outputs": dict(outputs or {}),
+        "rows": dict(rows or {}),
+        "elapsed": round(elapsed, 3) if elapsed is not None else None,
+    }
+
+
+def emit_manifest(manifest):
+    """在标准输出中打印结果清单，供流程界面读取"""
+    print(MANIFEST_PREFIX + json.dumps(manifest, ensure_ascii=True), flush=True)
+
+
+def parse_manifest(output):
+    """从步骤脚本的标准输出中取出结果清单，没有时返回None"""
+    for line in reversed((output or "").splitlines()):
+        if line.startswith(MANIFEST_PREFIX):
+            return json.loads(line[len(MANIFEST_PREFIX):])
+    return None
+
+
+class StepFailed(Exception):
+    """步骤执行失败，调度器不再启动新的步骤"""
+
+
+class StepScheduler:
+    """按依赖关系执行流程步骤的调度器
+
+    每个步骤在其依赖的步骤全部完成后立即开始，相互独立的步骤（如白班稽核和夜班稽核）
+    在线程池中并发执行。步骤函数接收依赖步骤结果组成的字典，返回值作为该步骤的结果；
+    抛出异常表示步骤失败，此后不再启动新的步骤，已启动的步骤会执行完毕。
+    """
+
+    def __init__(self):
+        self.steps = {}
+
+    def add_step(self, name, func, depends_on=()):
+        """添加步骤，依赖的步骤必须已经添加"""
+        for dependency in depends_on:
+            if dependency not in self.steps:
+                raise ValueError(f"步骤 {name} 依赖的步骤 {dependency} 不存在")
+        self.steps[name] = (func, tuple(depends_on))
+
+    def run(self):
+        """执行全部步骤，返回(是否全部成功, {步骤名: 结果})"""
+        results = {}
+        pending = dict(self.steps)
+        running = {}
+        failed = False
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.steps))) as executor:
+            while pending or running:
+                # 启动依赖已全部完成的步骤
+                if not failed:
+                    for name, (func, depends_on) in list(pending.items()):
+                        if all(dependency in results for dependency in depends_on):
+                            inputs = {dependency: results[dependency] for dependency in depends_on}
+                            running[executor.submit(func, inputs)] = name
+                            del pending[name]
+
+                if not running:
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        if not isinstance(e, StepFailed):
+                            logging.error(f"步骤执行异常: {name}, 错误: {str(e)}")
+                        failed = True
+
+        return not failed and not pending, results
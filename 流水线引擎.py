@@ -0,0 +1,412 @@
+import os
+import time
+import logging
+import threading
+from datetime import date, datetime, time as dt_time
+
+import numpy as np
+import pandas as pd
+
+# 步骤模块只在这里导入一次，各步骤之间直接传递DataFrame
+import 班别分类
+import 白班稽核1_1
+import 夜班稽核
+import 合并Excel文件
+import 内容优化
+import 考勤日汇总
+import 阈值重算
+import 增量稽核
+import 考勤库
+import 步骤缓存
+from 步骤调度 import StepScheduler, StepFailed, make_manifest
+from 稽核阈值 import DEFAULT_THRESHOLDS
+
+
+# 可选择额外保存的中间结果
+ARTIFACT_FILES = {
+    "班别匹配结果": "班别匹配结果.xlsx",
+    "白班稽查结果": "白班稽查结果.xlsx",
+    "夜班稽查结果": "夜班稽查结果.xlsx",
+    "合并结果": "合并结果.xlsx",
+    "考勤日汇总": 考勤日汇总.FACTS_FILE,
+}
+
+# 最终结果在内容优化结果清单中的名称
+FINAL_RESULT_NAME = "考勤稽核数据核对版"
+
+
+def _excel_cell_value(value):
+    """单个取值写入Excel再读回后的形态"""
+    if isinstance(value, str) and value == '':
+        return np.nan
+    if isinstance(value, dt_time):
+        return str(value)
+    return value
+
+
+def as_excel_values(df, merge_ranges=None):
+    """返回与“写入Excel再读回”一致的数据形态
+
+    子进程模式下每一步都从上一步的xlsx读取数据：空字符串会变成空值，
+    时间对象会变成字符串，日期对象会变成datetime64，合并单元格只有首行保留异常描述。
+    进程内传递时按同样规则转换，保证两种模式结果一致。
+    """
+    df = df.reset_index(drop=True)
+    if merge_ranges:
+        desc_col = df.columns.get_loc('异常描述')
+        df['异常描述'] = df['异常描述'].astype(object)
+        for start, end in merge_ranges:
+            df.iloc[start + 1:end + 1, desc_col] = np.nan
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        df[col] = df[col].map(_excel_cell_value)
+        values = df[col].dropna()
+        if len(values) and values.map(lambda v: isinstance(v, date) and not isinstance(v, datetime)).all():
+            df[col] = pd.to_datetime(df[col])
+    return df.infer_objects()
+
+
+class PipelineEngine:
+    """进程内考勤处理流水线
+
+    依次执行班别分类、白班稽核、夜班稽核、合并文件、异常数据稽核和内容优化，
+    中间结果保存在内存中，只写出最终结果和 save_artifacts 中指定的中间结果。
+    刷卡记录、每日考勤汇总、请假、加班单和稽核结果同时写入考勤库（考勤库.AttendanceStore），
+    考勤数据文件夹中的文件移入历史记录并被清理后仍可以查询和导出。
+    各步骤的结果保存在步骤缓存中（步骤缓存.StepCache），输入、代码和参数都未变化的步骤重新运行时直接使用，
+    某一步失败后再次运行即从失败的步骤继续。
+    """
+
+    def __init__(self, data_dir, save_artifacts=(), status_callback=None, workers=None, thresholds=None,
+                 incremental=False, store_file=None, memoize=True):
+        """
+        Args:
+            data_dir: 考勤数据目录
+            save_artifacts: 需要额外写出的中间结果名称，见 ARTIFACT_FILES
+            status_callback: 步骤状态回调，参数为(步骤序号, 状态)，序号与界面步骤一致
+            workers: 白班、夜班稽核的并行进程数，None表示使用全部CPU核心，打包后的程序固定串行
+            thresholds: 白班、夜班稽核使用的阈值（稽核阈值.AuditThresholds），None表示使用默认阈值
+            incremental: 增量稽核，只重新检测与上次运行相比输入有变化的员工日，其余沿用上次的结果
+            store_file: 考勤库文件，None表示使用程序所在目录下的 考勤库.DB_FILE_NAME
+            memoize: 使用步骤缓存（考勤数据目录下的 步骤缓存.STEP_CACHE_DIR_NAME 文件夹）
+        """
+        self.data_dir = data_dir
+        self.workers = workers
+        self.thresholds = thresholds
+        self.incremental = incremental
+        self.save_artifacts = set(save_artifacts)
+        self.status_callback = status_callback
+        self.artifacts = {}
+        self.manifests = {}
+        # 请假流程表中全部请假的起止时刻，白班、夜班稽核共用
+        self.leaves = None
+        # 加班流程表中全部加班单的起止时刻和时数，白班、夜班稽核共用
+        self.overtimes = None
+        # 每日考勤汇总，白班、夜班稽核和内容优化共用
+        self.facts = None
+        # 增量稽核时各员工日的输入指纹，白班、夜班稽核共用，首次需要时建立
+        self.person_days = None
+        self.person_days_lock = threading.Lock()
+        # 按不同阈值重新稽核的缓存数据，首次调用 reaudit 时建立
+        self.reaudit_data = None
+        self.store_file = store_file
+        # 考勤库及本次运行的批次号，考勤库不可用时为None
+        self.store = None
+        self.run_id = None
+        self.step_cache = 步骤缓存.StepCache(os.path.join(data_dir, 步骤缓存.STEP_CACHE_DIR_NAME)) if memoize else None
+        # 本次运行各步骤的缓存键，计入依赖它的步骤的缓存键
+        self.step_keys = {}
+        # 本次运行中使用了缓存结果的步骤
+        self.cached_steps = set()
+        self.final_result_file = None
+
+    def set_status(self, step_index, status):
+        if self.status_callback:
+            self.status_callback(step_index, status)
+
+    def run_step(self, step_index, step_name, func, artifact=None):
+        """执行单个步骤并记录耗时，失败时抛出 StepFailed
+
+        步骤的结果清单（输出文件、记录数、耗时）保存在 manifests 中，
+        artifact 为该步骤产生的中间结果名称，见 ARTIFACT_FILES
+        """
+        self.set_status(step_index, "执行中")
+        logging.info(f"开始执行: {step_name}")
+        start_time = time.time()
+        try:
+            result = func()
+        except Exception as e:
+            run_time = time.time() - start_time
+            logging.error(f"执行异常: {step_name}, 错误: {str(e)}, 耗时: {run_time:.2f}秒")
+            self.set_status(step_index, "失败")
+            raise StepFailed(step_name) from e
+
+        run_time = time.time() - start_time
+        outputs = {}
+        rows = {}
+        if artifact and result is not None:
+            if artifact in self.save_artifacts:
+                outputs[artifact] = os.path.join(self.data_dir, ARTIFACT_FILES[artifact])
+            rows[artifact] = len(result)
+        elif isinstance(result, dict):
+            outputs = result["outputs"]
+            rows = result["rows"]
+        self.manifests[step_name] = make_manifest(step_name, outputs=outputs, rows=rows, elapsed=run_time)
+        
+        logging.info(f"执行成功: {step_name}, 耗时: {run_time:.2f}秒, 记录数: {rows}")
+        self.set_status(step_index, "已缓存" if step_name in self.cached_steps else "完成")
+        return result
+
+    def save_artifact(self, name, save_func):
+        """按需写出中间结果"""
+        if name not in self.save_artifacts:
+            return
+        output_file = os.path.join(self.data_dir, ARTIFACT_FILES[name])
+        save_func(output_file)
+        logging.info(f"已保存中间结果: {ARTIFACT_FILES[name]}")
+
+    def cached(self, step_name, func, inputs=None, params=None, depends_on=()):
+        """按步骤缓存执行 func：缓存键与上次的记录一致时直接返回保存的结果，否则执行 func 并保存结果
+
+        inputs、params 见 步骤缓存.StepCache.make_key，depends_on 为依赖的步骤名，其缓存键计入本步骤的缓存键；
+        不使用步骤缓存或无法计算缓存键时直接执行 func
+        """
+        if self.step_cache is None:
+            return func()
+        try:
+            key, record = self.step_cache.make_key(step_name, inputs, params,
+                                                   {name: self.step_keys[name] for name in depends_on})
+        except Exception as e:
+            logging.warning(f"计算步骤缓存键失败: {step_name}, 错误: {str(e)}")
+            return func()
+        self.step_keys[step_name] = key
+
+        hit, result = self.step_cache.load(step_name, key)
+        if hit:
+            logging.info(f"输入、代码和参数均未变化, 使用步骤缓存: {step_name}")
+            self.cached_steps.add(step_name)
+            return result
+        result = func()
+        self.step_cache.save(step_name, key, record, result)
+        return result
+
+    def audit_params(self):
+        """影响白班、夜班稽核结果的参数"""
+        return {"thresholds": self.thresholds or DEFAULT_THRESHOLDS}
+
+    def open_store(self):
+        """打开考勤库并开始本次运行的批次，考勤库不可用时只记录警告，流程照常执行"""
+        try:
+            self.store = 考勤库.AttendanceStore(self.store_file)
+            self.run_id = self.store.begin_run(self.data_dir)
+        except Exception as e:
+            logging.warning(f"打开考勤库失败, 本次结果不写入考勤库, 错误: {str(e)}")
+            self.store = None
+
+    def write_store(self, name, write_func):
+        """把一份结果写入考勤库，写入失败只记录警告"""
+        if self.store is None:
+            return
+        start_time = time.time()
+        try:
+            write_func(self.store)
+            logging.info(f"已写入考勤库: {name}, 耗时: {time.time() - start_time:.2f}秒")
+        except Exception as e:
+            logging.warning(f"写入考勤库失败: {name}, 错误: {str(e)}")
+
+    def close_store(self, status):
+        if self.store is None:
+            return
+        try:
+            self.store.finish_run(self.run_id, status)
+        except Exception as e:
+            logging.warning(f"更新考勤库批次状态失败, 错误: {str(e)}")
+        try:
+            self.store.prune_runs()
+        except Exception as e:
+            logging.warning(f"删除考勤库旧批次失败, 错误: {str(e)}")
+
+    def read_and_match(self, card_detail_file, attendance_file):
+        """读取考勤数据文件夹中的表格并匹配班别，返回(班别匹配结果, 请假区间表, 加班单区间表, 每日考勤汇总)"""
+        matched = 班别分类.match_shifts(card_detail_file, attendance_file)
+        leaves = 班别分类.load_leave_intervals()
+        overtimes = 班别分类.load_overtime_intervals()
+        self.save_artifact("班别匹配结果", lambda path: matched.to_excel(path, index=False))
+        matched = as_excel_values(matched)
+
+        # 每日考勤汇总由稽核使用的同一份数据生成，写入考勤库，需要时再导出为Excel
+        facts = 考勤日汇总.build_daily_facts(matched, overtimes)
+        return matched, leaves, overtimes, facts
+
+    def match_shifts(self):
+        card_detail_file, attendance_file = 班别分类.get_files_from_attendance_folder()
+        attendance_dir = 班别分类.get_attendance_dir()
+        inputs = {"刷卡明细": card_detail_file, "上下班打卡明细": attendance_file}
+        for keyword in ("考勤报表", "加班流程表", "请假流程表"):
+            inputs[keyword] = 班别分类.find_latest_file(attendance_dir, keyword)
+        matched, self.leaves, self.overtimes, self.facts = self.cached(
+            "班别分类", lambda: self.read_and_match(card_detail_file, attendance_file), inputs=inputs)
+        if "班别分类" in self.cached_steps:
+            self.save_artifact("班别匹配结果", lambda path: matched.to_excel(path, index=False))
+
+        self.save_artifact("考勤日汇总", lambda path: 考勤日汇总.save_daily_facts(self.facts, path))
+        self.write_store("刷卡记录", lambda store: store.write_matched(self.run_id, matched, self.leaves,
+                                                                   self.overtimes))
+        self.write_store("每日考勤汇总", lambda store: store.write_facts(self.run_id, self.facts))
+        return matched
+
+    def get_person_days(self, matched):
+        """增量稽核使用的员工日指纹，白班、夜班稽核并发调用时只建立一次"""
+        with self.person_days_lock:
+            if self.person_days is None:
+                self.person_days = 增量稽核.PersonDays(matched, self.leaves, self.overtimes)
+        return self.person_days
+
+    def detect_day_shift(self, matched):
+        if self.incremental:
+            return 增量稽核.audit_day_shift(matched, workers=self.workers, leaves=self.leaves,
+                                        overtimes=self.overtimes, facts=self.facts, thresholds=self.thresholds,
+                                        person_days=self.get_person_days(matched))
+        return 白班稽核1_1.process_attendance_data(matched, workers=self.workers, leaves=self.leaves,
+                                                overtimes=self.overtimes, facts=self.facts,
+                                                thresholds=self.thresholds)
+
+    def detect_night_shift(self, matched):
+        if self.incremental:
+            return 增量稽核.audit_night_shift(matched, workers=self.workers, leaves=self.leaves,
+                                          overtimes=self.overtimes, facts=self.facts, thresholds=self.thresholds,
+                                          person_days=self.get_person_days(matched))
+        return 夜班稽核.build_night_result(matched.copy(), workers=self.workers, leaves=self.leaves,
+                                       overtimes=self.overtimes, facts=self.facts, thresholds=self.thresholds)
+
+    def audit_day_shift(self, matched):
+        result_df = self.cached("白班稽核", lambda: self.detect_day_shift(matched), params=self.audit_params(),
+                                depends_on=["班别分类"])
+        if result_df is None or result_df.empty:
+            return None
+        self.write_store("白班稽核结果", lambda store: store.write_anomalies(self.run_id, "白班", result_df))
+        self.save_artifact("白班稽查结果", lambda path: 白班稽核1_1.save_result_to_excel(result_df, path))
+        return as_excel_values(result_df, 白班稽核1_1.get_merge_ranges(result_df))
+
+    def audit_night_shift(self, matched):
+        result_df = self.cached("夜班稽核", lambda: self.detect_night_shift(matched), params=self.audit_params(),
+                                depends_on=["班别分类"])
+        if result_df.empty:
+            return None
+        self.write_store("夜班稽核结果", lambda store: store.write_anomalies(self.run_id, "夜班", result_df))
+        self.save_artifact("夜班稽查结果", lambda path: 夜班稽核.save_night_result(result_df, path))
+        return as_excel_values(result_df, 夜班稽核.get_merge_ranges(result_df))
+
+    def merge_results(self, night_df, day_df):
+        merged_df, merge_ranges = self.cached("合并文件", lambda: 合并Excel文件.merge_frames(night_df, day_df),
+                                              depends_on=["白班稽核", "夜班稽核"])
+        self.save_artifact("合并结果", lambda path: 合并Excel文件.save_merged_result(merged_df, path, merge_ranges))
+        return as_excel_values(merged_df, merge_ranges)
+
+    def write_final_result(self, checked_df):
+        """写出最终结果，返回(结果清单, 最终结果文件内容)"""
+        manifest = 内容优化.optimize_excel(checked_df, self.facts)
+        if not manifest:
+            raise RuntimeError("内容优化失败")
+        with open(manifest["outputs"][FINAL_RESULT_NAME], 'rb') as f:
+            return manifest, f.read()
+
+    def optimize(self, checked_df):
+        # 步骤缓存保存最终结果文件的内容，使用缓存时重新写出文件
+        manifest, content = self.cached("内容优化", lambda: self.write_final_result(checked_df),
+                                        depends_on=["班别分类", "白班稽核", "夜班稽核"])
+        if "内容优化" in self.cached_steps:
+            with open(manifest["outputs"][FINAL_RESULT_NAME], 'wb') as f:
+                f.write(content)
+        return manifest
+
+    def match_step(self, inputs):
+        matched = self.run_step(1, "班别分类", self.match_shifts, artifact="班别匹配结果")
+        self.artifacts["班别匹配结果"] = matched
+        return matched
+
+    def day_shift_step(self, inputs):
+        day_df = self.run_step(2, "白班稽核", lambda: self.audit_day_shift(inputs["班别分类"]), artifact="白班稽查结果")
+        if day_df is None:
+            logging.warning("未发现白班异常数据")
+        self.artifacts["白班稽查结果"] = day_df
+        return day_df
+
+    def night_shift_step(self, inputs):
+        night_df = self.run_step(3, "夜班稽核", lambda: self.audit_night_shift(inputs["班别分类"]), artifact="夜班稽查结果")
+        if night_df is None:
+            logging.warning("未发现夜班异常数据")
+        self.artifacts["夜班稽查结果"] = night_df
+        return night_df
+
+    def merge_step(self, inputs):
+        day_df = inputs["白班稽核"]
+        night_df = inputs["夜班稽核"]
+        if day_df is not None and night_df is not None:
+            merged_df = self.run_step(4, "合并文件", lambda: self.merge_results(night_df, day_df), artifact="合并结果")
+        else:
+            logging.info("跳过合并步骤，因为没有足够的异常数据")
+            self.set_status(4, "跳过")
+            merged_df = day_df if day_df is not None else night_df
+        self.artifacts["合并结果"] = merged_df
+        return merged_df
+
+    def check_step(self, inputs):
+        merged_df = inputs["合并文件"]
+        if merged_df is None:
+            logging.info("跳过异常数据稽核步骤，因为没有异常数据")
+            self.set_status(5, "跳过")
+            return None
+
+        # 异常数据稽核只是把合并结果作为核对版数据，进程内无需重命名文件
+        self.set_status(5, "完成")
+        self.artifacts["核对版数据"] = merged_df
+        return merged_df
+
+    def optimize_step(self, inputs):
+        checked_df = inputs["异常数据稽核"]
+        if checked_df is None:
+            logging.info("跳过内容优化步骤，因为没有异常数据")
+            self.set_status(6, "跳过")
+            return None
+        manifest = self.run_step(6, "内容优化", lambda: self.optimize(checked_df))
+        return manifest["outputs"][FINAL_RESULT_NAME]
+
+    def reaudit(self, thresholds=None):
+        """按另一组阈值重新统计白班、夜班异常，不读取任何Excel文件，返回 阈值重算.ReauditData.count 的结果
+
+        使用本次运行保存在内存中的班别匹配结果、请假、加班单和每日考勤汇总，须在 run 之后调用
+        """
+        matched = self.artifacts.get("班别匹配结果")
+        if matched is None:
+            raise RuntimeError("尚未执行班别分类，无法重新稽核")
+        if self.reaudit_data is None:
+            self.reaudit_data = 阈值重算.ReauditData(matched, self.leaves, self.overtimes, self.facts)
+        return self.reaudit_data.count(thresholds)
+
+    def build_scheduler(self):
+        """按数据依赖关系组织步骤：白班稽核和夜班稽核都只依赖班别分类，并发执行"""
+        scheduler = StepScheduler()
+        scheduler.add_step("班别分类", self.match_step)
+        scheduler.add_step("白班稽核", self.day_shift_step, depends_on=["班别分类"])
+        scheduler.add_step("夜班稽核", self.night_shift_step, depends_on=["班别分类"])
+        scheduler.add_step("合并文件", self.merge_step, depends_on=["白班稽核", "夜班稽核"])
+        scheduler.add_step("异常数据稽核", self.check_step, depends_on=["合并文件"])
+        scheduler.add_step("内容优化", self.optimize_step, depends_on=["异常数据稽核"])
+        return scheduler
+
+    def run(self):
+        """执行步骤2~7，流程正常结束返回True，某一步失败导致流程终止返回False
+
+        最终结果文件路径保存在 final_result_file 中，没有异常数据时为None
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.open_store()
+
+        completed, results = self.build_scheduler().run()
+        self.close_store("完成" if completed else "失败")
+        if not completed:
+            return False
+        self.final_result_file = results["内容优化"]
+        return True
@@ -1,131 +1,289 @@
 import pandas as pd
+import numpy as np
 import os
 import time
 from datetime import datetime
 
-def process_data(card_detail_file, attendance_file):
-    """处理数据并生成新的Excel文件"""
-    try:
-        # 读取刷卡明细表，从第7行开始（索引为6）
-        card_detail = pd.read_excel(card_detail_file, header=6)
-        
-        # 读取上下班打卡明细，从第7行开始（索引为6）
-        attendance = pd.read_excel(attendance_file, header=6)
-        
-        # 新增：从考勤数据文件夹获取考勤报表文件
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        attendance_dir = os.path.join(script_dir, "考勤数据")
-        report_files = [f for f in os.listdir(attendance_dir) if "考勤报表" in f]
-        if report_files:
-            report_file = max(report_files, key=lambda f: os.path.getmtime(os.path.join(attendance_dir, f)))
-            report = pd.read_excel(os.path.join(attendance_dir, report_file), header=6)  # 修改为header=6
-            # 获取员工职务性质映射
-            job_nature = dict(zip(report['姓名'], report['职务性质']))
-        else:
-            job_nature = {}
-
-        # 新增：从考勤数据文件夹获取加班流程表文件
-        overtime_files = [f for f in os.listdir(attendance_dir) if "加班流程表" in f]
-        if overtime_files:
-            overtime_file = max(overtime_files, key=lambda f: os.path.getmtime(os.path.join(attendance_dir, f)))
-            overtime = pd.read_excel(os.path.join(attendance_dir, overtime_file), header=6)
-            # 确保日期列是日期类型
-            overtime['出勤日期'] = pd.to_datetime(overtime['出勤日期']).dt.date
-            # 创建加班信息字典
-            overtime_dict = {}
-            for _, row in overtime.iterrows():
-                key = (row['姓名'], row['出勤日期'])
-                overtime_dict[key] = {
-                    '加班单开始日期': row.get('加班单开始日期', ''),
-                    '加班单开始时间': row.get('加班单开始时间', ''),
-                    '加班单结束日期': row.get('加班单结束日期', ''),
-                    '加班单结束时间': row.get('加班单结束时间', ''),
-                    '加班单时数': row.get('加班单时数', '')
-                }
-        else:
-            overtime_dict = {}
-            
-        # 新增：从考勤数据文件夹获取请假流程表文件
-        leave_files = [f for f in os.listdir(attendance_dir) if "请假流程表" in f]
-        if leave_files:
-            leave_file = max(leave_files, key=lambda f: os.path.getmtime(os.path.join(attendance_dir, f)))
-            leave = pd.read_excel(os.path.join(attendance_dir, leave_file), header=6)
-            # 确保日期列是日期类型
-            if '请假开始日期' in leave.columns:
-                leave['请假开始日期'] = pd.to_datetime(leave['请假开始日期']).dt.date
-            if '请假结束日期' in leave.columns:
-                leave['请假结束日期'] = pd.to_datetime(leave['请假结束日期']).dt.date
-            
-            # 创建请假信息字典
-            leave_dict = {}
-            for _, row in leave.iterrows():
-                # 使用姓名和请假开始日期作为键
-                if '姓名' in row and '请假开始日期' in row:
-                    key = (row['姓名'], row['请假开始日期'])
-                    leave_dict[key] = {
-                        '请假开始时间': row.get('请假开始时间', ''),
-                        '请假结束时间': row.get('请假结束时间', ''),
-                        '请假时数': row.get('请假时数', '')
-                    }
+from 步骤调度 import make_manifest, emit_manifest
+from 表格缓存 import read_excel_cached
+from 流式读取 import restore_object_columns
+from 列类型 import CATEGORY_COLUMNS
+from 区间索引 import leave_intervals, overtime_intervals
+
+# 加班流程表、请假流程表中需要匹配到刷卡明细的列
+OVERTIME_COLUMNS = ['加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数']
+LEAVE_COLUMNS = ['请假开始时间', '请假结束时间', '请假时数']
+
+
+def attach_by_name_date(card_detail, info, date_col, columns, valid_mask=None):
+    """按(姓名, 日期)把info中的列左连接到刷卡明细
+
+    info 中每个(姓名, 日期)只能有一行；未匹配的行保留原值，原来没有该列时为空字符串。
+    valid_mask 为False的行不参与匹配。
+    """
+    keys = card_detail[['姓名', '刷卡日期']].reset_index(drop=True)
+    info = info.rename(columns={date_col: '刷卡日期'})
+    merged = keys.merge(info, on=['姓名', '刷卡日期'], how='left', indicator=True)
+    matched = (merged['_merge'] == 'both').to_numpy()
+    if valid_mask is not None:
+        matched &= valid_mask
+
+    for col in columns:
+        if col in card_detail.columns:
+            original = card_detail[col].to_numpy(dtype=object)
         else:
-            leave_dict = {}
+            original = np.full(len(card_detail), '', dtype=object)
+        card_detail[col] = np.where(matched, merged[col].to_numpy(dtype=object), original)
+
+
+def get_attendance_dir():
+    """考勤数据文件夹：程序所在目录下的“考勤数据”"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "考勤数据")
+
+
+def find_latest_file(attendance_dir, keyword):
+    """考勤数据文件夹中文件名包含 keyword 的最新文件，没有时返回None"""
+    files = [f for f in os.listdir(attendance_dir) if keyword in f]
+    if not files:
+        return None
+    return os.path.join(attendance_dir, max(files, key=lambda f: os.path.getmtime(os.path.join(attendance_dir, f))))
+
+
+def read_leave_table(attendance_dir=None):
+    """读取请假流程表，请假开始、结束日期转换为日期类型，没有请假流程表时返回None"""
+    attendance_dir = attendance_dir or get_attendance_dir()
+    leave_file = find_latest_file(attendance_dir, "请假流程表")
+    if leave_file is None:
+        return None
+    leave = read_excel_cached(leave_file, header=6)
+    # 确保日期列是日期类型
+    if '请假开始日期' in leave.columns:
+        leave['请假开始日期'] = pd.to_datetime(leave['请假开始日期']).dt.date
+    if '请假结束日期' in leave.columns:
+        leave['请假结束日期'] = pd.to_datetime(leave['请假结束日期']).dt.date
+    return leave
+
+
+def read_overtime_table(attendance_dir=None):
+    """读取加班流程表，出勤日期转换为日期类型，没有加班流程表时返回None"""
+    attendance_dir = attendance_dir or get_attendance_dir()
+    overtime_file = find_latest_file(attendance_dir, "加班流程表")
+    if overtime_file is None:
+        return None
+    overtime = read_excel_cached(overtime_file, header=6)
+    # 确保日期列是日期类型
+    overtime['出勤日期'] = pd.to_datetime(overtime['出勤日期']).dt.date
+    return overtime
+
+
+def load_overtime_intervals(attendance_dir=None):
+    """加班流程表中全部加班单的起止时刻和时数，供白班、夜班稽核核算加班，没有加班流程表或读取失败时返回None
+
+    同一人同一天的多张加班单和跨零点的加班单都保留，稽核时按员工建立加班单索引
+    """
+    try:
+        overtime = read_overtime_table(attendance_dir)
+    except Exception as e:
+        print(f"读取加班流程表出错：{str(e)}")
+        return None
+    if overtime is None:
+        return None
+    return overtime_intervals(overtime)
+
+
+def load_leave_intervals(attendance_dir=None):
+    """请假流程表中全部请假的起止时刻，供白班、夜班稽核判断请假覆盖，没有请假流程表或读取失败时返回None
+
+    同一人同一天的多条请假和跨天的请假都保留，稽核时按员工建立区间索引
+    """
+    try:
+        leave = read_leave_table(attendance_dir)
+    except Exception as e:
+        print(f"读取请假流程表出错：{str(e)}")
+        return None
+    if leave is None:
+        return None
+    return leave_intervals(leave)
+
+
+def enrich_card_detail(card_detail, attendance, job_nature, overtime=None, leave=None):
+    """按(姓名, 日期)把班别、加班单和请假信息连接到刷卡明细，剔除白领员工，返回新的刷卡明细
 
-        # 确保日期列是日期类型
-        card_detail['刷卡日期'] = pd.to_datetime(card_detail['刷卡日期']).dt.date
-        attendance['出勤日期'] = pd.to_datetime(attendance['出勤日期']).dt.date
+    Args:
+        card_detail: 刷卡明细，刷卡日期为日期类型
+        attendance: 上下班打卡明细，出勤日期为日期类型
+        job_nature: 员工职务性质，{姓名: 职务性质}
+        overtime: 加班流程表（见 read_overtime_table），没有时为None
+        leave: 请假流程表（见 read_leave_table），没有时为None
+    """
+    overtime_info = None
+    if overtime is not None:
+        for col in OVERTIME_COLUMNS:
+            if col not in overtime.columns:
+                overtime[col] = ''
+        # 记录上只显示一张加班单，同一人同一天有多张时显示最后一张；稽核按加班单索引核算全部加班单
+        overtime_info = overtime.drop_duplicates(['姓名', '出勤日期'], keep='last')[['姓名', '出勤日期'] + OVERTIME_COLUMNS]
+        
+    leave_info = None
+    if leave is not None:
+        # 使用姓名和请假开始日期匹配，同一人同一天有多条请假时以最后一条为准
+        if '姓名' in leave.columns and '请假开始日期' in leave.columns:
+            for col in LEAVE_COLUMNS:
+                if col not in leave.columns:
+                    leave[col] = ''
+            leave_info = leave.drop_duplicates(['姓名', '请假开始日期'], keep='last')[['姓名', '请假开始日期'] + LEAVE_COLUMNS]
 
-        # 创建一个字典，键为(姓名, 出勤日期)，值为班别
-        shift_dict = dict(zip(zip(attendance['姓名'], attendance['出勤日期']), attendance['班别']))
+    # 同一人同一天有多条打卡明细时以最后一条的班别为准
+    shift_info = attendance.drop_duplicates(['姓名', '出勤日期'], keep='last')[['姓名', '出勤日期', '班别']]
 
-        # 为刷卡明细表添加班别列
-        card_detail['班别'] = None
+    # 为刷卡明细表添加班别列
+    card_detail['班别'] = None
 
-        # 按姓名和刷卡日期排序
-        card_detail = card_detail.sort_values(by=['姓名', '刷卡日期'])
+    # 按姓名和刷卡日期排序
+    card_detail = card_detail.sort_values(by=['姓名', '刷卡日期'])
 
-        # 为每个人填充班别信息
-        for name in card_detail['姓名'].unique():
-            person_data = card_detail[card_detail['姓名'] == name].copy()
+    # 新增：检查职务性质，剔除白领员工
+    white_collar = [name for name, nature in job_nature.items() if not pd.isna(name) and "白领" in str(nature)]
+    card_detail = card_detail[~card_detail['姓名'].isin(white_collar)].copy()
 
-            # 新增：检查职务性质，如果是白领则跳过该员工
-            if name in job_nature and "白领" in str(job_nature[name]):
-                card_detail = card_detail[card_detail['姓名'] != name]
-                continue
+    # 姓名为空的行不参与匹配
+    has_name = card_detail['姓名'].notna().to_numpy()
 
-            # 为每一行填充班别
-            for idx, row in person_data.iterrows():
-                key = (row['姓名'], row['刷卡日期'])
-                if key in shift_dict:
-                    card_detail.at[idx, '班别'] = shift_dict[key]
+    # 填充班别信息
+    attach_by_name_date(card_detail, shift_info, '出勤日期', ['班别'], has_name)
 
-        # 前向填充空的班别值（使用前一天的班别）
-        card_detail['班别'] = card_detail.groupby('姓名')['班别'].ffill()
+    # 前向填充空的班别值（使用前一天的班别）
+    card_detail['班别'] = card_detail.groupby('姓名', observed=True)['班别'].ffill()
 
-        # 为刷卡明细表添加加班信息列
-        for col in ['加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数']:
+    # 填充加班信息
+    if overtime_info is not None:
+        attach_by_name_date(card_detail, overtime_info, '出勤日期', OVERTIME_COLUMNS, has_name)
+    else:
+        for col in OVERTIME_COLUMNS:
             if col not in card_detail.columns:
                 card_detail[col] = ''
-                
-        # 为刷卡明细表添加请假信息列
-        for col in ['请假开始时间', '请假结束时间', '请假时数']:
+
+    # 填充请假信息 - 通过姓名和刷卡日期匹配请假开始日期
+    if leave_info is not None:
+        has_date = card_detail['刷卡日期'].notna().to_numpy()
+        attach_by_name_date(card_detail, leave_info, '请假开始日期', LEAVE_COLUMNS, has_name & has_date)
+    else:
+        for col in LEAVE_COLUMNS:
             if col not in card_detail.columns:
                 card_detail[col] = ''
 
-        # 填充加班信息
-        for idx, row in card_detail.iterrows():
+    return card_detail
+
+
+def enrich_card_detail_rowwise(card_detail, attendance, job_nature, overtime=None, leave=None):
+    """enrich_card_detail 的逐条实现（原实现），按员工筛选、逐行查字典，保留用于核对结果（见 性能基准.py）"""
+    # 创建加班信息字典
+    overtime_dict = {}
+    if overtime is not None:
+        for _, row in overtime.iterrows():
+            key = (row['姓名'], row['出勤日期'])
+            overtime_dict[key] = {col: row.get(col, '') for col in OVERTIME_COLUMNS}
+
+    # 创建请假信息字典，使用姓名和请假开始日期作为键
+    leave_dict = {}
+    if leave is not None:
+        for _, row in leave.iterrows():
+            if '姓名' in row and '请假开始日期' in row:
+                key = (row['姓名'], row['请假开始日期'])
+                leave_dict[key] = {col: row.get(col, '') for col in LEAVE_COLUMNS}
+
+    # 创建一个字典，键为(姓名, 出勤日期)，值为班别
+    shift_dict = dict(zip(zip(attendance['姓名'], attendance['出勤日期']), attendance['班别']))
+
+    # 为刷卡明细表添加班别列
+    card_detail['班别'] = None
+
+    # 按姓名和刷卡日期排序
+    card_detail = card_detail.sort_values(by=['姓名', '刷卡日期'])
+
+    # 为每个人填充班别信息
+    for name in card_detail['姓名'].unique():
+        person_data = card_detail[card_detail['姓名'] == name].copy()
+
+        # 检查职务性质，如果是白领则跳过该员工
+        if name in job_nature and "白领" in str(job_nature[name]):
+            card_detail = card_detail[card_detail['姓名'] != name]
+            continue
+
+        # 为每一行填充班别
+        for idx, row in person_data.iterrows():
             key = (row['姓名'], row['刷卡日期'])
-            if key in overtime_dict:
-                for col in ['加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数']:
-                    card_detail.at[idx, col] = overtime_dict[key][col]
-            
-            # 填充请假信息 - 通过姓名和刷卡日期匹配请假开始日期
-            # 查找该员工在该日期是否有请假记录
-            for leave_key, leave_info in leave_dict.items():
-                leave_name, leave_date = leave_key
-                if leave_name == row['姓名'] and leave_date == row['刷卡日期']:
-                    for col in ['请假开始时间', '请假结束时间', '请假时数']:
-                        card_detail.at[idx, col] = leave_info[col]
-                    break
+            if key in shift_dict:
+                card_detail.at[idx, '班别'] = shift_dict[key]
+
+    # 前向填充空的班别值（使用前一天的班别）
+    card_detail['班别'] = card_detail.groupby('姓名')['班别'].ffill()
+
+    # 为刷卡明细表添加加班信息列、请假信息列
+    for col in OVERTIME_COLUMNS + LEAVE_COLUMNS:
+        if col not in card_detail.columns:
+            card_detail[col] = ''
+
+    for idx, row in card_detail.iterrows():
+        # 填充加班信息
+        key = (row['姓名'], row['刷卡日期'])
+        if key in overtime_dict:
+            for col in OVERTIME_COLUMNS:
+                card_detail.at[idx, col] = overtime_dict[key][col]
+
+        # 填充请假信息 - 通过姓名和刷卡日期匹配请假开始日期
+        for leave_key, leave_info in leave_dict.items():
+            leave_name, leave_date = leave_key
+            if leave_name == row['姓名'] and leave_date == row['刷卡日期']:
+                for col in LEAVE_COLUMNS:
+                    card_detail.at[idx, col] = leave_info[col]
+                break
+
+    return card_detail
+
+
+def match_shifts(card_detail_file, attendance_file):
+    """匹配班别、加班和请假信息，返回班别匹配结果DataFrame
+
+    输入表格通过解析缓存流式读取，内容未变化的文件不再重新解析Excel。
+    刷卡明细的姓名、部门、刷卡机等文本列读取为分类类型，返回前还原为普通列
+    """
+    # 读取刷卡明细表，从第7行开始（索引为6）
+    card_detail = read_excel_cached(card_detail_file, header=6, categories=CATEGORY_COLUMNS,
+                                    date_columns=('刷卡日期',))
+    
+    # 读取上下班打卡明细，从第7行开始（索引为6）
+    attendance = read_excel_cached(attendance_file, header=6)
+    
+    # 新增：从考勤数据文件夹获取考勤报表文件
+    attendance_dir = get_attendance_dir()
+    report_files = [f for f in os.listdir(attendance_dir) if "考勤报表" in f]
+    if report_files:
+        report_file = max(report_files, key=lambda f: os.path.getmtime(os.path.join(attendance_dir, f)))
+        report = read_excel_cached(os.path.join(attendance_dir, report_file), header=6)  # 修改为header=6
+        # 获取员工职务性质映射
+        job_nature = dict(zip(report['姓名'], report['职务性质']))
+    else:
+        job_nature = {}
+
+    # 新增：从考勤数据文件夹获取加班流程表、请假流程表文件
+    overtime = read_overtime_table(attendance_dir)
+    leave = read_leave_table(attendance_dir)
+
+    # 确保日期列是日期类型
+    card_detail['刷卡日期'] = pd.to_datetime(card_detail['刷卡日期']).dt.date
+    attendance['出勤日期'] = pd.to_datetime(attendance['出勤日期']).dt.date
+
+    card_detail = enrich_card_detail(card_detail, attendance, job_nature, overtime, leave)
+
+    return restore_object_columns(card_detail)
+
+
+def process_data(card_detail_file, attendance_file):
+    """处理数据并生成新的Excel文件，成功时返回结果清单，失败时返回None"""
+    try:
+        start_time = time.time()
+        card_detail = match_shifts(card_detail_file, attendance_file)
 
         # 获取当前时间作为文件名的一部分
         current_time = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -140,10 +298,11 @@ def process_data(card_detail_file, attendance_file):
         # 保存结果
         card_detail.to_excel(output_file, index=False)
 
-        return True
+        return make_manifest("班别分类", outputs={"班别匹配结果": output_file},
+                             rows={"班别匹配结果": len(card_detail)}, elapsed=time.time() - start_time)
     except Exception as e:
         print(f"处理数据时出错：{str(e)}")
-        return False
+        return None
 
 def get_files_from_attendance_folder():
     """从考勤数据文件夹获取刷卡明细和打卡明细文件"""
@@ -174,8 +333,10 @@ def get_files_from_attendance_folder():
 if __name__ == "__main__":
     try:
         card_detail_file, attendance_file = get_files_from_attendance_folder()
-        if process_data(card_detail_file, attendance_file):
+        manifest = process_data(card_detail_file, attendance_file)
+        if manifest:
             print("处理完成")
+            emit_manifest(manifest)
         else:
             print("处理失败")
     except Exception as e:
@@ -1,8 +1,23 @@
 import pandas as pd
+import numpy as np
 import os
-from datetime import datetime, timedelta, time
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
+import sys
+import time as time_module
+from functools import partial
+from datetime import datetime, timedelta
+
+import 并行稽核
+import 班别分类
+from 步骤调度 import make_manifest, emit_manifest
+from 流式读取 import read_excel_streaming, restore_object_columns
+from 报表写出 import write_report
+from 列类型 import categorize_columns, row_flags
+from 时间换算 import (SECONDS_PER_DAY, SECONDS_PER_HOUR, SECONDS_PER_MINUTE, day_start, minute_text,
+                  parse_clock_texts, time_seconds, to_seconds, to_time_values, to_timestamps)
+from 在场时段 import build_sessions
+from 区间索引 import absence_index, interval_covers, leave_index, row_leave_intervals
+from 考勤日汇总 import DAY_SHIFT, build_daily_facts, shift_facts
+from 稽核阈值 import DEFAULT_THRESHOLDS
 
 
 def get_matched_file():
@@ -24,26 +39,6 @@ def get_matched_file():
     return os.path.join(attendance_dir, matched_file)
 
 
-def parse_time(time_val):
-    """解析时间值为datetime.time对象"""
-    if pd.isna(time_val):
-        return None
-        
-    if isinstance(time_val, datetime):
-        return time_val.time()
-    elif isinstance(time_val, time):
-        return time_val
-    elif isinstance(time_val, str):
-        try:
-            return datetime.strptime(time_val, '%H:%M:%S').time()
-        except ValueError:
-            try:
-                return datetime.strptime(time_val, '%H:%M').time()
-            except ValueError:
-                return None
-    return None
-
-
 def time_diff_minutes(time1, time2):
     """计算两个时间之间的分钟差"""
     if time1 and time2:
@@ -52,38 +47,41 @@ def time_diff_minutes(time1, time2):
     return 0
 
 
-def is_time_covered_by_leave(out_time, in_time, leave_start, leave_end):
-    """检查外出时间段是否被请假时间段覆盖"""
-    if pd.isna(leave_start) or pd.isna(leave_end):
-        return False
-    
-    # 转换为time对象以便比较
-    out_time = parse_time(out_time)
-    in_time = parse_time(in_time)
-    leave_start = parse_time(leave_start)
-    leave_end = parse_time(leave_end)
-    
-    if not out_time or not in_time or not leave_start or not leave_end:
-        return False
-    
-    # 检查外出时间段是否完全被请假时间段覆盖
-    # 将time对象转换为分钟数进行比较
-    def time_to_minutes(t):
-        return t.hour * 60 + t.minute
-    
-    out_minutes = time_to_minutes(out_time)
-    in_minutes = time_to_minutes(in_time)
-    leave_start_minutes = time_to_minutes(leave_start)
-    leave_end_minutes = time_to_minutes(leave_end)
+def absent_seconds(records, date, start_dt, end_dt):
+    """时间段[start_dt, end_dt]内外出不在场的秒数：每次外出到其后第一次进入，没有再进入时到时间段结束"""
+    in_times = [datetime.combine(date, r['时间']) for r in records if '进' in str(r['刷卡机'])]
+    absences = []
+    for r in records:
+        if '出' not in str(r['刷卡机']):
+            continue
+        out_dt = datetime.combine(date, r['时间'])
+        back_dt = min((t for t in in_times if t >= out_dt), default=end_dt)
+        absences.append((max(out_dt, start_dt), min(back_dt, end_dt)))
     
-    return leave_start_minutes <= out_minutes and leave_end_minutes >= in_minutes
+    # 连续多次外出的不在场时间有重叠，合并后计算
+    total = 0
+    covered_until = start_dt
+    for absent_start, absent_end in sorted(absences):
+        absent_start = max(absent_start, covered_until)
+        if absent_end > absent_start:
+            total += (absent_end - absent_start).total_seconds()
+            covered_until = absent_end
+    return total
 
 
-def process_attendance_data(file_path):
-    """处理考勤数据并检测异常"""
+def prepare_attendance_data(file_path):
+    """读取班别匹配结果并统一日期、时间列的格式
+
+    file_path 可以是班别匹配结果文件路径，也可以是流水线中直接传入的DataFrame。
+    姓名、班别、刷卡机等文本列转换为分类类型
+    """
     # 读取数据
     try:
-        df = pd.read_excel(file_path)
+        if isinstance(file_path, pd.DataFrame):
+            df = file_path.copy()
+        else:
+            df = read_excel_streaming(file_path)
+        categorize_columns(df)
         
         # 检查必要的列是否存在
         required_columns = ['姓名', '刷卡日期', '班别', '刷卡时间', '刷卡机']
@@ -99,7 +97,9 @@ def process_attendance_data(file_path):
                 df[col] = ''
         
         # 转换日期和时间格式
-        df['刷卡时间'] = pd.to_datetime(df['刷卡时间'], errors='coerce')
+        # “时:分:秒”文本按固定格式批量解析，其他格式再逐个推断
+        swipe_time = parse_clock_texts(df['刷卡时间'])
+        df['刷卡时间'] = swipe_time if swipe_time is not None else pd.to_datetime(df['刷卡时间'], errors='coerce')
         df['刷卡日期'] = pd.to_datetime(df['刷卡日期'], errors='coerce')
         
         # 提取时间部分
@@ -108,29 +108,439 @@ def process_attendance_data(file_path):
         # 确保加班和请假时间列的格式正确
         for col in ['加班单开始时间', '加班单结束时间', '请假开始时间', '请假结束时间']:
             if col in df.columns:
-                # 先处理NaN值
-                df[col] = df[col].apply(lambda x: None if pd.isna(x) else x)
-                # 然后转换非NaN值为time对象
-                def safe_convert_to_time(x):
-                    if x is None:
-                        return None
-                    try:
-                        dt = pd.to_datetime(x, errors='coerce')
-                        if pd.isna(dt):
-                            return None
-                        return dt.time()
-                    except:
-                        return None
-                df[col] = df[col].apply(safe_convert_to_time)
+                # 每个不同的取值只转换一次，空值和无法解析的取值为None
+                df[col] = to_time_values(df[col])
         
     except Exception as e:
         print(f"读取文件出错: {str(e)}")
         return None
     
+    return df
+
+
+# 白班的时间界限（秒，从0点起算），即默认阈值，逐条检测的原实现使用
+WORK_START = DEFAULT_THRESHOLDS.day_start
+WORK_END = DEFAULT_THRESHOLDS.day_end
+
+# 白班稽核结果的输出列
+OUTPUT_COLUMNS = ['单位', '部门', '部门CXO-2', '工号', '姓名', '刷卡日期', '刷卡时间', '刷卡机', '班别',
+                  '加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数',
+                  '请假开始时间', '请假结束时间', '请假时数', '异常', '异常描述', '外出时间', '进入时间', '外出时长', 
+                  '连续进入时间1', '连续进入时间2', '实际加班时长']
+
+
+def format_result(result_df):
+    """整理白班稽核结果的列顺序和日期时间格式，分类类型的列还原为普通列"""
+    # 确保实际加班时长列始终存在
+    if '实际加班时长' not in result_df.columns:
+        result_df['实际加班时长'] = ''
+    
+    # 确保所有需要的列都存在
+    for col in OUTPUT_COLUMNS:
+        if col not in result_df.columns:
+            result_df[col] = ''
+    
+    # 按指定顺序排列列
+    result_df = result_df[OUTPUT_COLUMNS].copy()
+    
+    # 修改日期和时间格式
+    result_df['刷卡日期'] = pd.to_datetime(result_df['刷卡日期']).dt.strftime('%Y-%m-%d')
+    result_df['刷卡时间'] = pd.to_datetime(result_df['刷卡时间']).dt.strftime('%H:%M:%S')
+    
+    return restore_object_columns(result_df)
+
+
+def _group_any(mask, starts):
+    """按连续分组判断是否存在满足条件的记录"""
+    return np.add.reduceat(mask.astype(np.int64), starts) > 0
+
+
+def _group_min(values, mask, starts, missing):
+    """按连续分组取满足条件的最小值，没有满足条件的记录时返回missing"""
+    return np.minimum.reduceat(np.where(mask, values, missing), starts)
+
+
+def _last_per_group(groups, rows):
+    """同一组多次命中时保留最后一次，返回{组号: 行号}"""
+    return dict(zip(groups.tolist(), rows.tolist()))
+
+
+class DayShiftData:
+    """白班稽核中与阈值无关的数据，建立一次后可以按不同阈值多次检测（见 detect_day_anomalies）
+
+    记录按(姓名, 刷卡日期, 刷卡时间)排序，同一组的记录在数组中连续存放，组内统计用reduceat计算；
+    首次进入、最后外出、加班单和加班在场时长读取每日考勤汇总（见 考勤日汇总.build_daily_facts），
+    外出与进入的配对、外出时长、有进无出和重复打卡取自一次建立的出入时段表（见 在场时段.build_sessions）
+    """
+
+    def __init__(self, df, leaves=None, overtimes=None, facts=None):
+        """df 为排好序的白班记录（见 prepare_day_shift），其余参数见 audit_day_shift"""
+        self.df = df
+        self.group_ids = df.groupby(['姓名', '刷卡日期'], sort=False, observed=True).ngroup().to_numpy()
+        self.starts = np.flatnonzero(np.r_[True, self.group_ids[1:] != self.group_ids[:-1]])
+        self.group_count = len(self.starts)
+        
+        # 行级数组
+        swipe_time = df['刷卡时间']
+        valid_time = swipe_time.notna().to_numpy()
+        self.t = to_seconds(swipe_time)
+        flags = row_flags(df, 'is_in', 'is_out', 'is_rest_day')
+        self.is_in = flags['is_in'] & valid_time
+        self.is_out = flags['is_out'] & valid_time
+        
+        # 组级数组
+        self.is_rest_day = _group_any(flags['is_rest_day'], self.starts)
+        
+        # 请假信息：员工的全部请假组成区间索引，按绝对时刻批量查询，同一天多条请假、跨天请假都参与判断
+        self.leave_idx = leave_index(row_leave_intervals(df) if leaves is None else leaves)
+        self.group_names = df['姓名'].to_numpy(dtype=object)[self.starts]
+        group_dates = df['刷卡日期'].to_numpy()[self.starts]
+        self.day_stamps = day_start(to_timestamps(group_dates))
+        self.has_leave = self.leave_idx.overlaps(self.group_names, self.day_stamps,
+                                                 self.day_stamps + SECONDS_PER_DAY - 1)
+        
+        # 每日考勤汇总中各组的统计
+        if facts is None:
+            facts = build_daily_facts(df, overtimes, shifts=(DAY_SHIFT,))
+        group_facts = shift_facts(facts, DAY_SHIFT, self.group_names, group_dates)
+        
+        # 加班信息：当天开始的全部加班单，开始时间取最早的一张，结束时间取最晚的一张，加班单时数为合计，
+        # 换算为从当天0点起算的秒数（跨零点的加班单结束时间大于一天）
+        self.has_overtime = group_facts['加班单数'].fillna(0).to_numpy() > 0
+        form_starts = to_timestamps(group_facts['加班开始'])
+        form_ends = to_timestamps(group_facts['加班结束'])
+        self.overtime_hours = group_facts['加班单时数'].fillna(0).to_numpy(dtype=float)
+        self.overtime_start_sec = np.where(self.has_overtime, form_starts - self.day_stamps, -1)
+        self.overtime_end_sec = np.where(self.has_overtime, form_ends - self.day_stamps, -1)
+        # 从加班单开始时间到加班结束后当天的第一条外出（跨零点的加班单为次日）扣除其间外出时间的小时数
+        self.on_site_overtime = group_facts['加班在场小时'].to_numpy(dtype=float)
+        
+        # 出入时段表：按(姓名, 刷卡日期)建立一次，各规则的进出配对、外出时长、有进无出和重复打卡都由它得到
+        self.sessions = build_sessions(self.group_ids, self.t, self.is_in, self.is_out)
+        
+        # 员工每次外出到再次进入之间不在场（可以跨天），按员工建立的出入时段表得到，实际加班时长扣除这些时间
+        row_stamps = np.where(valid_time, self.day_stamps[self.group_ids] + self.t, -1)
+        person_sessions = build_sessions(pd.factorize(df['姓名'])[0], row_stamps, self.is_in, self.is_out)
+        self.absence_idx = absence_index(df['姓名'].to_numpy(dtype=object), row_stamps, self.is_out,
+                                         person_sessions['next_in'].to_numpy())
+        
+        # 各组的首次进入、最后外出
+        first_in_stamps = to_timestamps(group_facts['首次进入'])
+        last_out_stamps = to_timestamps(group_facts['最后外出'])
+        self.first_in_sec = np.where(first_in_stamps >= 0, first_in_stamps - self.day_stamps, SECONDS_PER_DAY)
+        self.last_out_sec = np.where(last_out_stamps >= 0, last_out_stamps - self.day_stamps, -1)
+        
+        # 时间文本与原实现一致，使用datetime.time的字符串形式
+        self.time_values = df['时间'].to_numpy()
+
+    def leave_covers(self, groups, start, end):
+        """当天的时间段[start, end]（从0点起算的秒数）是否被该员工的请假覆盖（按分钟比较）"""
+        return self.leave_idx.covers(self.group_names[groups], self.day_stamps[groups] + start,
+                                     self.day_stamps[groups] + end)
+
+    def on_site_hours(self, groups, start, end):
+        """当天的时间段[start, end]（从0点起算的秒数）内实际在场的小时数"""
+        start, end = self.day_stamps[groups] + start, self.day_stamps[groups] + end
+        absent = self.absence_idx.overlap_seconds(self.group_names[groups], start, end)
+        return (end - start - absent) / SECONDS_PER_HOUR
+
+    def time_text(self, rows):
+        return [str(v) for v in self.time_values[rows]]
+
+
+def prepare_day_shift(df, leaves=None, overtimes=None, facts=None):
+    """筛选白班记录并建立 DayShiftData，没有白班记录时返回None
+
+    df 为 prepare_attendance_data 的结果，当天任一班别含“白班”的(姓名, 刷卡日期)整组保留
+    """
+    df = df[df['姓名'].notna() & df['刷卡日期'].notna()]
+    
+    # 筛选白班记录：当天任一班别含“白班”的整组保留
+    is_day_shift = pd.Series(row_flags(df, 'is_day')['is_day'], index=df.index)
+    df = df[is_day_shift.groupby([df['姓名'], df['刷卡日期']], observed=True).transform('any')]
+    if df.empty:
+        return None
+    
+    # 按姓名、日期、时间排序，同一组的记录连续存放
+    df = df.sort_values(['姓名', '刷卡日期', '刷卡时间'], kind='stable').reset_index(drop=True)
+    return DayShiftData(df, leaves, overtimes, facts)
+
+
+def detect_day_anomalies(data, thresholds=None):
+    """按阈值检测白班异常，规则和异常描述与逐条检测的原实现一致
+
+    data 为 DayShiftData，thresholds 为 稽核阈值.AuditThresholds，为None时使用默认阈值。
+    返回(异常描述事件表, 附加列信息)：事件表每行为(group 组号, rule 规则顺序, order 组内顺序, text 描述)，
+    已按顺序排列；附加列信息为外出、连续进入和实际加班时长对应的组和记录
+    """
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    work_start, work_end = thresholds.day_start, thresholds.day_end
+    t, is_in, is_out = data.t, data.is_in, data.is_out
+    group_ids, starts, group_count = data.group_ids, data.starts, data.group_count
+    partner, duration, repeat, repeat_gap, unmatched = (
+        data.sessions[c].to_numpy() for c in ('partner', 'duration', 'repeat', 'repeat_gap', 'unmatched'))
+    has_overtime, overtime_end_sec = data.has_overtime, data.overtime_end_sec
+    first_in_sec, last_out_sec = data.first_in_sec, data.last_out_sec
+    has_in = first_in_sec < SECONDS_PER_DAY
+    has_out = last_out_sec >= 0
+    leave_covers, time_text = data.leave_covers, data.time_text
+    
+    # 异常描述事件：(组号, 规则顺序, 组内顺序, 描述)，最后按顺序拼接
+    event_groups, event_rules, event_orders = ([np.zeros(0, dtype=np.int64)] for _ in range(3))
+    event_texts = [np.zeros(0, dtype=object)]
+    
+    def add_events(groups, rule, orders, texts):
+        if len(groups) == 0:
+            return
+        event_groups.append(np.asarray(groups, dtype=np.int64))
+        event_rules.append(np.full(len(groups), rule, dtype=np.int64))
+        event_orders.append(np.asarray(orders, dtype=np.int64))
+        event_texts.append(np.asarray(texts, dtype=object))
+    
+    all_groups = np.arange(group_count)
+    
+    # 1. 上班进入判定（08:00前），迟到可被请假覆盖
+    has_before_work_in = _group_any(is_in & (t < work_start), starts)
+    has_exact_start_time = _group_any(is_in & (t == work_start), starts)
+    late_covered_by_leave = has_in & leave_covers(all_groups, work_start, first_in_sec)
+    late = ~(has_before_work_in | has_exact_start_time) & ~late_covered_by_leave
+    late_groups = np.flatnonzero(late)
+    add_events(late_groups, 1, np.zeros(len(late_groups)), [f"迟到，未在{minute_text(work_start)}前进入"] * len(late_groups))
+    
+    # 2. 工作时间（08:00~16:40）异常判定
+    in_work_time = (t >= work_start) & (t <= work_end)
+    work_in_rows = np.flatnonzero(is_in & in_work_time)
+    work_out_rows = np.flatnonzero(is_out & in_work_time)
+    
+    # 2.1 外出与进入情况：每条外出找之后第一条工作时间内的进入，
+    # 即出入时段表中当天与之配对的进入在16:40前（含）
+    out_partner = partner[work_out_rows]
+    paired = (out_partner >= 0) & (t[np.maximum(out_partner, 0)] <= work_end)
+    out_groups = group_ids[work_out_rows]
+    
+    # 有外出无进入，16:40整的外出为正常下班
+    unreturned = work_out_rows[~paired & (t[work_out_rows] != work_end)]
+    unreturned_groups = group_ids[unreturned]
+    unreturned_leave = data.has_leave[unreturned_groups]
+    not_covered = ~leave_covers(unreturned_groups, t[unreturned], work_end)
+    flagged = unreturned[unreturned_leave & not_covered]
+    add_events(group_ids[flagged], 2, flagged, [f"外出未返回且无请假覆盖(外出时间:{v})" for v in time_text(flagged)])
+    flagged = unreturned[~unreturned_leave]
+    add_events(group_ids[flagged], 2, flagged, [f"外出未返回且无请假(外出时间:{v})" for v in time_text(flagged)])
+    
+    # 外出时长超过15分钟且未被请假覆盖
+    pair_out = work_out_rows[paired]
+    pair_in = out_partner[paired]
+    out_duration = duration[pair_out] / SECONDS_PER_MINUTE
+    long_out = (out_duration > thresholds.outing_minutes) & ~leave_covers(out_groups[paired], t[pair_out], t[pair_in])
+    long_out_rows, long_in_rows, long_duration = pair_out[long_out], pair_in[long_out], out_duration[long_out]
+    out_texts, in_texts = time_text(long_out_rows), time_text(long_in_rows)
+    duration_texts = [f"{v:.0f}" for v in long_duration]
+    add_events(group_ids[long_out_rows], 3, long_out_rows,
+               [f"外出时长超{thresholds.outing_minutes}分钟(外出时间:{o},进入时间:{i},外出时长:{d}分钟)"
+                for o, i, d in zip(out_texts, in_texts, duration_texts)])
+    outing_info = _last_per_group(group_ids[long_out_rows], np.arange(len(long_out_rows)))
+    
+    # 2.2 有进入无外出（工作时间内）：不是当天第一条工作时间内的进入，且之前没有外出
+    in_groups = group_ids[work_in_rows]
+    first_work_in = np.r_[True, in_groups[1:] != in_groups[:-1]] if len(work_in_rows) else np.zeros(0, dtype=bool)
+    first_work_out_sec = _group_min(t, is_out & in_work_time, starts, SECONDS_PER_DAY)
+    has_prev_out = first_work_out_sec[in_groups] < t[work_in_rows]
+    leave_covered = leave_covers(in_groups, work_start, t[work_in_rows])
+    after_overtime = has_overtime[in_groups] & (overtime_end_sec[in_groups] >= 0) & (t[work_in_rows] >= overtime_end_sec[in_groups])
+    flagged = work_in_rows[~has_prev_out & ~first_work_in & ~leave_covered & ~after_overtime]
+    add_events(group_ids[flagged], 4, flagged, [f"有进入无对应外出(进入时间:{v})" for v in time_text(flagged)])
+    
+    # 2.3 检查全天的进出记录连续性：出入时段表中有进无出的进入与其后的下一次进入，
+    # 两次进入的间隔不超过重复打卡间隔时为重复打卡，不算
+    prev_in = np.flatnonzero(is_in & unmatched & (repeat >= 0))
+    cur_in = repeat[prev_in]
+    pair_groups = group_ids[cur_in]
+    both_before_work = (t[prev_in] < work_start) & (t[cur_in] < work_start)
+    after_overtime = has_overtime[pair_groups] & (overtime_end_sec[pair_groups] >= 0) & (t[prev_in] >= overtime_end_sec[pair_groups])
+    leave_covered = leave_covers(pair_groups, t[prev_in], t[cur_in])
+    consecutive = (~both_before_work & (repeat_gap[prev_in] > thresholds.duplicate_window) & ~after_overtime
+                   & ~leave_covered)
+    prev_in, cur_in = prev_in[consecutive], cur_in[consecutive]
+    add_events(group_ids[cur_in], 5, cur_in,
+               [f"连续进入无中间外出(进入时间:{p}和{c})" for p, c in zip(time_text(prev_in), time_text(cur_in))])
+    consecutive_info = _last_per_group(group_ids[cur_in], np.arange(len(cur_in)))
+    
+    # 3. 下班判定（16:40后）
+    overtime_text = np.array([str(v) for v in data.overtime_hours], dtype=object)
+    actual_hours = {}
+    
+    def add_overtime_shortage(groups, hours):
+        """实际加班时长少于加班单时数"""
+        short = hours < data.overtime_hours[groups]
+        groups, hours = groups[short], hours[short]
+        hour_texts = [f"{v:.2f}" for v in hours]
+        return groups, hour_texts
+    
+    # 3.1 有加班单：休息白班全天工作时间视为加班，标准时间打卡（8:00进、16:40出）视为正常
+    is_rest_day = data.is_rest_day
+    is_standard_time = (first_in_sec == work_start) & (last_out_sec == work_end)
+    rest_groups = np.flatnonzero(has_overtime & is_rest_day & has_in & has_out & ~is_standard_time)
+    rest_end = np.where(last_out_sec[rest_groups] < first_in_sec[rest_groups],
+                        last_out_sec[rest_groups] + SECONDS_PER_DAY, last_out_sec[rest_groups])
+    groups, hour_texts = add_overtime_shortage(rest_groups, data.on_site_hours(rest_groups, first_in_sec[rest_groups], rest_end))
+    add_events(groups, 6, np.zeros(len(groups)),
+               [f"实际加班时长少于加班单时数(实际:{h}小时,加班单:{overtime_text[g]}小时)" for g, h in zip(groups, hour_texts)])
+    actual_hours.update(zip(groups.tolist(), hour_texts))
+    
+    # 加班进入判定和加班时长核算，需要加班单开始、结束时间都存在
+    has_overtime_window = has_overtime & (data.overtime_start_sec >= 0) & (overtime_end_sec >= 0)
+    row_overtime_start = data.overtime_start_sec[group_ids]
+    has_out_at_work_end = _group_any(is_out & (t == work_end), starts)
+    check_overtime_in = has_overtime_window & has_out_at_work_end
+    
+    # 16:40到加班开始时间之间外出的，需要在加班开始前返回
+    out_before_overtime = is_out & (t > work_end) & (t < row_overtime_start) & check_overtime_in[group_ids]
+    has_out_before_overtime = _group_any(out_before_overtime, starts)
+    out_rows = np.flatnonzero(out_before_overtime)
+    out_partner = partner[out_rows]
+    has_corresponding_in = (out_partner >= 0) & (t[np.maximum(out_partner, 0)] <= row_overtime_start[out_rows])
+    flagged = out_rows[~has_corresponding_in]
+    add_events(group_ids[flagged], 7, flagged, [f"加班前外出未返回(外出时间:{v})" for v in time_text(flagged)])
+    
+    # 16:40后没有外出的，需要在加班开始前有进入记录（休息白班标准时间打卡除外）
+    has_in_before_overtime = _group_any(is_in & (t > work_end) & (t <= row_overtime_start), starts)
+    flagged = np.flatnonzero(check_overtime_in & ~has_out_before_overtime & ~has_in_before_overtime
+                             & ~(is_rest_day & has_in & has_out & is_standard_time))
+    add_events(flagged, 7, np.zeros(len(flagged)), ["加班开始前未进入"] * len(flagged))
+    
+    # 实际加班时长：每日考勤汇总中的加班在场小时，加班结束后当天没有外出时为空
+    end_groups = np.flatnonzero(has_overtime_window & ~np.isnan(data.on_site_overtime))
+    groups, hour_texts = add_overtime_shortage(end_groups, data.on_site_overtime[end_groups])
+    add_events(groups, 8, np.zeros(len(groups)),
+               [f"实际加班时长少于加班单时数(实际:{h}小时,加班单:{overtime_text[g]}小时)" for g, h in zip(groups, hour_texts)])
+    actual_hours.update(zip(groups.tolist(), hour_texts))
+    
+    # 3.2 无加班单：16:40前有外出、之后没有外出且没有16:40整的外出，视为早退
+    has_out_before_end = _group_any(is_out & (t < work_end), starts)
+    has_out_from_end = _group_any(is_out & (t >= work_end), starts)
+    early_groups = np.flatnonzero(~has_overtime & has_out_before_end & ~has_out_from_end)
+    early_leave_covered = leave_covers(early_groups, last_out_sec[early_groups], work_end)
+    early_groups = early_groups[~early_leave_covered]
+    early_mask = np.zeros(group_count, dtype=bool)
+    early_mask[early_groups] = True
+    last_out_rows = np.flatnonzero(is_out & early_mask[group_ids] & (t == last_out_sec[group_ids]))
+    _, first_index = np.unique(group_ids[last_out_rows], return_index=True)
+    last_out_rows = last_out_rows[first_index]
+    add_events(early_groups, 9, np.zeros(len(early_groups)),
+               [f"早退，最后一次出卡时间为{v}" for v in time_text(last_out_rows)])
+    
+    events = pd.DataFrame({
+        'group': np.concatenate(event_groups),
+        'rule': np.concatenate(event_rules),
+        'order': np.concatenate(event_orders),
+        'text': np.concatenate(event_texts),
+    }).sort_values(['group', 'rule', 'order'], kind='stable')
+    details = {
+        'outing': (outing_info, long_out_rows, long_in_rows, duration_texts),
+        'consecutive': (consecutive_info, prev_in, cur_in),
+        'actual_hours': actual_hours,
+    }
+    return events, details
+
+
+def audit_day_shift(df, leaves=None, overtimes=None, facts=None, thresholds=None):
+    """按列批量检测白班异常
+
+    与阈值无关的准备见 DayShiftData，按阈值检测见 detect_day_anomalies。
+    返回未整理格式的异常记录，没有异常时返回None。
+    leaves 为请假区间表（见 区间索引.leave_intervals），为None时由各记录上的请假时间得到；
+    overtimes 为加班单区间表（见 区间索引.overtime_intervals），为None时由各记录上的加班单得到；
+    facts 为每日考勤汇总，为None时由 df 和 overtimes 生成；
+    thresholds 为 稽核阈值.AuditThresholds，为None时使用默认阈值
+    """
+    data = prepare_day_shift(df, leaves, overtimes, facts)
+    if data is None:
+        return None
+    events, details = detect_day_anomalies(data, thresholds)
+    if events.empty:
+        print("未发现异常数据")
+        return None
+    
+    # 按组拼接异常描述
+    descriptions = events.groupby('group', sort=False)['text'].agg('，'.join)
+    
+    # 有异常的组输出全部记录
+    group_ids, time_values = data.group_ids, data.time_values
+    anomaly_rows = np.isin(group_ids, descriptions.index.to_numpy())
+    result_df = data.df[anomaly_rows].copy()
+    result_groups = group_ids[anomaly_rows]
+    result_df['异常'] = '是'
+    result_df['异常描述'] = descriptions.reindex(result_groups).to_numpy()
+    
+    # 补充外出、连续进入和实际加班时长信息
+    def group_values(info, values):
+        return [values[info[g]] if g in info else np.nan for g in result_groups.tolist()]
+    
+    outing_info, long_out_rows, long_in_rows, duration_texts = details['outing']
+    if outing_info:
+        out_time_values, in_time_values = time_values[long_out_rows], time_values[long_in_rows]
+        result_df['外出时间'] = group_values(outing_info, out_time_values)
+        result_df['进入时间'] = group_values(outing_info, in_time_values)
+        result_df['外出时长'] = group_values(outing_info, [f"{d}分钟" for d in duration_texts])
+    consecutive_info, prev_in, cur_in = details['consecutive']
+    if consecutive_info:
+        result_df['连续进入时间1'] = group_values(consecutive_info, time_values[prev_in])
+        result_df['连续进入时间2'] = group_values(consecutive_info, time_values[cur_in])
+    actual_hours = details['actual_hours']
+    if actual_hours:
+        result_df['实际加班时长'] = [f"{actual_hours[g]}小时" if g in actual_hours else np.nan for g in result_groups.tolist()]
+    
+    return result_df
+
+
+def audit_day_shift_chunk(df, leaves=None, overtimes=None, facts=None, thresholds=None):
+    """对一部分员工的班别匹配结果执行数据准备和白班异常检测，用于按姓名分块并行执行"""
+    df = prepare_attendance_data(df)
+    if df is None:
+        return None
+    return audit_day_shift(df, leaves, overtimes, facts, thresholds)
+
+
+def process_attendance_data(file_path, workers=1, leaves=None, overtimes=None, facts=None, thresholds=None):
+    """处理考勤数据并检测异常
+
+    file_path 可以是班别匹配结果文件路径，也可以是流水线中直接传入的DataFrame。
+    workers 为并行进程数，None表示使用全部CPU核心，大于1时按姓名分块在多个进程中检测。
+    leaves 为请假流程表的请假区间表，为None时使用班别匹配结果各记录上的请假时间；
+    overtimes 为加班流程表的加班单区间表，为None时使用班别匹配结果各记录上的加班单；
+    facts 为每日考勤汇总（见 考勤日汇总.build_daily_facts），为None时各分块由自己的记录生成；
+    thresholds 为 稽核阈值.AuditThresholds，为None时使用默认阈值
+    """
+    if isinstance(file_path, pd.DataFrame):
+        df = file_path
+    else:
+        try:
+            df = read_excel_streaming(file_path)
+        except Exception as e:
+            print(f"读取文件出错: {str(e)}")
+            return None
+    
+    results = 并行稽核.run_by_name(df, partial(audit_day_shift_chunk, leaves=leaves, overtimes=overtimes,
+                                               facts=facts, thresholds=thresholds), workers)
+    if not results:
+        return None
+    return format_result(pd.concat(results, ignore_index=True))
+
+
+def audit_day_shift_rowwise(df, leaves=None):
+    """逐组逐条记录检测白班异常（原实现）
+
+    规则与 audit_day_shift 在默认阈值下相同，保留作为对照实现，用于结果核对和性能基准。
+    请假覆盖与 audit_day_shift 一样按员工的全部请假区间判断，leaves 为请假区间表，为None时取自各记录上的请假
+    """
     # 定义白班的时间界限
     work_start_time = datetime.strptime('08:00', '%H:%M').time()
     work_end_time = datetime.strptime('16:40', '%H:%M').time()
     
+    # 员工的全部请假区间，同一天多条请假、跨天请假都参与判断
+    leave_idx = leave_index(row_leave_intervals(df) if leaves is None else leaves)
+    
     # 按姓名和日期分组处理数据
     result_records = []
     grouped = df.groupby(['姓名', '刷卡日期'])
@@ -140,6 +550,17 @@ def process_attendance_data(file_path):
         if not any('白班' in str(shift) for shift in group['班别'].unique()):
             continue
         
+        # 当天的请假：当天0点起的时间段是否被该员工的某个请假区间覆盖
+        leave_starts, leave_ends = leave_idx.intervals_of(name)
+        day_stamp = int(to_timestamps([date])[0])
+        has_leave = any(start < day_stamp + SECONDS_PER_DAY and end >= day_stamp
+                        for start, end in zip(leave_starts, leave_ends))
+        
+        def leave_covers(start_time, end_time):
+            start, end = time_seconds(start_time), time_seconds(end_time)
+            return start >= 0 and end >= 0 and interval_covers(leave_starts, leave_ends, day_stamp + start,
+                                                               day_stamp + end)
+        
         # 按时间排序
         group = group.sort_values('刷卡时间')
         
@@ -163,14 +584,8 @@ def process_attendance_data(file_path):
         has_exact_start_time = any(r['时间'] == work_start_time for r in in_records)
         
         before_work_in_records = [r for r in in_records if r['时间'] < work_start_time]
-        # 检查迟到是否被请假覆盖
-        leave_start = records[0].get('请假开始时间')
-        leave_end = records[0].get('请假结束时间')
-        late_covered_by_leave = False
-        if leave_start is not None and leave_end is not None and not pd.isna(leave_start) and not pd.isna(leave_end):
-            # 如果有进入记录，检查是否被请假覆盖
-            if in_records:
-                late_covered_by_leave = is_time_covered_by_leave(work_start_time, in_records[0]['时间'], leave_start, leave_end)
+        # 检查迟到是否被请假覆盖（有进入记录时）
+        late_covered_by_leave = bool(in_records) and leave_covers(work_start_time, in_records[0]['时间'])
         
         # 判断迟到情况：
         # 1. 没有8:00前的进入记录
@@ -225,12 +640,9 @@ def process_attendance_data(file_path):
                 # 如果不是正常下班（包括标准白班的16:40出），则进行异常判断
                 if not (is_rest_day_end_time or is_standard_end_time):
                     # 检查是否有请假记录覆盖
-                    leave_start = records[0].get('请假开始时间')
-                    leave_end = records[0].get('请假结束时间')
-                    
-                    if leave_start is not None and leave_end is not None and not pd.isna(leave_start) and not pd.isna(leave_end):
+                    if has_leave:
                         # 有请假记录，检查是否覆盖外出时间
-                        if not is_time_covered_by_leave(out_record['时间'], work_end_time, leave_start, leave_end):
+                        if not leave_covers(out_record['时间'], work_end_time):
                             has_anomaly = True
                             anomaly_desc.append(f"外出未返回且无请假覆盖(外出时间:{out_record['时间']})")
                     else:
@@ -254,10 +666,7 @@ def process_attendance_data(file_path):
                 continue
                 
             # 外出时长>15分钟，检查是否有请假记录覆盖
-            leave_start = records[0].get('请假开始时间')
-            leave_end = records[0].get('请假结束时间')
-            
-            if leave_start is None or leave_end is None or pd.isna(leave_start) or pd.isna(leave_end) or not is_time_covered_by_leave(out_record['时间'], in_record['时间'], leave_start, leave_end):
+            if not leave_covers(out_record['时间'], in_record['时间']):
                 has_anomaly = True
                 anomaly_desc.append(f"外出时长超15分钟(外出时间:{out_record['时间']},进入时间:{in_record['时间']},外出时长:{out_duration_minutes:.0f}分钟)")
                 # 添加外出相关信息
@@ -266,18 +675,17 @@ def process_attendance_data(file_path):
                     r['进入时间'] = in_record['时间']
                     r['外出时长'] = f"{out_duration_minutes:.0f}分钟"
         
+        # 获取加班信息（2.2和2.3都要用到，需在本组内先取得）
+        has_overtime = any(r.get('加班单开始时间') is not None and not pd.isna(r.get('加班单开始时间')) for r in records)
+        overtime_end_time = next((r.get('加班单结束时间') for r in records if r.get('加班单结束时间') is not None and not pd.isna(r.get('加班单结束时间'))), None)
+        
         # 2.2 有进入无外出（工作时间内）
         for in_record in work_time_in_records:
             # 找到该进记录前的最后一条出记录
             prev_out_records = [r for r in work_time_out_records if r['时间'] < in_record['时间']]
             
-            # 检查是否有请假记录覆盖
-            leave_start = records[0].get('请假开始时间')
-            leave_end = records[0].get('请假结束时间')
-            leave_covered = False
-            if leave_start is not None and leave_end is not None and not pd.isna(leave_start) and not pd.isna(leave_end):
-                # 检查请假是否覆盖进入时间
-                leave_covered = is_time_covered_by_leave(work_start_time, in_record['时间'], leave_start, leave_end)
+            # 检查请假是否覆盖进入时间
+            leave_covered = leave_covers(work_start_time, in_record['时间'])
             
             # 检查是否是加班结束后的进入记录
             is_after_overtime = False
@@ -297,10 +705,6 @@ def process_attendance_data(file_path):
         # 按时间排序所有进入记录
         sorted_in_records = sorted(in_records, key=lambda r: r['时间'])
         
-        # 获取加班信息
-        has_overtime = any(r.get('加班单开始时间') is not None and not pd.isna(r.get('加班单开始时间')) for r in records)
-        overtime_end_time = next((r.get('加班单结束时间') for r in records if r.get('加班单结束时间') is not None and not pd.isna(r.get('加班单结束时间'))), None)
-        
         # 对每个进入记录（除了第一个），检查之前是否有对应的出记录
         for i in range(1, len(sorted_in_records)):
             current_in = sorted_in_records[i]
@@ -320,12 +724,7 @@ def process_attendance_data(file_path):
                 is_after_overtime = prev_in['时间'] >= overtime_end_time
             
             # 检查请假是否覆盖连续进入时间
-            leave_start = records[0].get('请假开始时间')
-            leave_end = records[0].get('请假结束时间')
-            leave_covered = False
-            if leave_start is not None and leave_end is not None and not pd.isna(leave_start) and not pd.isna(leave_end):
-                # 检查请假是否覆盖连续进入时间
-                leave_covered = is_time_covered_by_leave(prev_in['时间'], current_in['时间'], leave_start, leave_end)
+            leave_covered = leave_covers(prev_in['时间'], current_in['时间'])
             
             # 如果满足以下任一条件，则不标记为异常：
             # 1. 两个连续进入记录之间有出记录
@@ -387,7 +786,8 @@ def process_attendance_data(file_path):
                         if last_out_time < first_in_time:
                             last_out_time += timedelta(days=1)
                         
-                        actual_overtime_hours = (last_out_time - first_in_time).total_seconds() / 3600
+                        actual_overtime_hours = ((last_out_time - first_in_time).total_seconds()
+                                                 - absent_seconds(records, date, first_in_time, last_out_time)) / 3600
                         
                         # 只有当实际加班时长小于加班单时数时才添加实际加班时长信息并标记为异常
                         if actual_overtime_hours < float(overtime_hours):
@@ -452,7 +852,9 @@ def process_attendance_data(file_path):
                     if overtime_end_dt < overtime_start_dt:
                         overtime_end_dt += timedelta(days=1)
                     
-                    actual_overtime_hours = (overtime_end_dt - overtime_start_dt).total_seconds() / 3600
+                    # 扣除加班期间外出的时间
+                    actual_overtime_hours = ((overtime_end_dt - overtime_start_dt).total_seconds()
+                                             - absent_seconds(records, date, overtime_start_dt, overtime_end_dt)) / 3600
                     
                     # 只有当实际加班时长小于加班单时数时才添加实际加班时长信息
                     if actual_overtime_hours < float(overtime_hours):
@@ -495,15 +897,9 @@ def process_attendance_data(file_path):
                 # 检查是否有16:40后的出记录
                 after_end_out_records = [r for r in out_records if r['时间'] >= work_end_time]
                 if not after_end_out_records:
-                    # 检查是否有请假记录覆盖早退时间
-                    leave_start = records[0].get('请假开始时间')
-                    leave_end = records[0].get('请假结束时间')
-                    last_out_time = max(before_end_out_records, key=lambda r: r['时间'])['时间']
-                    
                     # 检查早退是否被请假覆盖
-                    early_leave_covered = False
-                    if leave_start is not None and leave_end is not None and not pd.isna(leave_start) and not pd.isna(leave_end):
-                        early_leave_covered = is_time_covered_by_leave(last_out_time, work_end_time, leave_start, leave_end)
+                    last_out_time = max(before_end_out_records, key=lambda r: r['时间'])['时间']
+                    early_leave_covered = leave_covers(last_out_time, work_end_time)
                     
                     if not early_leave_covered:
                         has_anomaly = True
@@ -522,94 +918,65 @@ def process_attendance_data(file_path):
     
     # 创建结果DataFrame
     if result_records:
-        result_df = pd.DataFrame(result_records)
-        
-        # 确保所有需要的列都存在
-        output_columns = ['单位', '部门', '部门CXO-2', '工号', '姓名', '刷卡日期', '刷卡时间', '刷卡机', '班别',
-                         '加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数',
-                         '请假开始时间', '请假结束时间', '请假时数', '异常', '异常描述', '外出时间', '进入时间', '外出时长', 
-                         '连续进入时间1', '连续进入时间2', '实际加班时长']
-        
-        # 确保实际加班时长列始终存在
-        if '实际加班时长' not in result_df.columns:
-            result_df['实际加班时长'] = ''
-        
-        # 确保所有需要的列都存在
-        for col in output_columns:
-            if col not in result_df.columns:
-                result_df[col] = ''
-        
-        # 按指定顺序排列列
-        result_df = result_df[output_columns]
-        
-        # 修改日期和时间格式
-        result_df['刷卡日期'] = pd.to_datetime(result_df['刷卡日期']).dt.strftime('%Y-%m-%d')
-        result_df['刷卡时间'] = pd.to_datetime(result_df['刷卡时间']).dt.strftime('%H:%M:%S')
-        
-        return result_df
+        return pd.DataFrame(result_records)
     else:
         print("未发现异常数据")
         return None
 
 
+def process_attendance_data_rowwise(file_path):
+    """使用逐条检测的原实现处理考勤数据"""
+    df = prepare_attendance_data(file_path)
+    if df is None:
+        return None
+    
+    result_df = audit_day_shift_rowwise(df)
+    if result_df is None:
+        return None
+    return format_result(result_df)
+
+
+def get_merge_ranges(result_df):
+    """计算需要合并异常描述单元格的行范围
+
+    按姓名和刷卡日期分组，返回[(起始行, 结束行)]，行号从0开始且不含表头
+    """
+    group_keys = result_df['姓名'].astype(str) + '_' + result_df['刷卡日期'].astype(str)
+    bounds = pd.Series(np.arange(len(result_df))).groupby(group_keys.to_numpy(), sort=False).agg(['first', 'last'])
+    bounds = bounds[bounds['first'] != bounds['last']]
+    return list(zip(bounds['first'].tolist(), bounds['last'].tolist()))
+
+
 def save_result_to_excel(result_df, output_file):
-    """保存结果到Excel文件并格式化"""
+    """保存结果到Excel文件，合并相同员工当天的异常描述单元格"""
     if result_df is None or result_df.empty:
         print("没有异常数据需要保存")
         return
     
-    # 保存到Excel
-    result_df.to_excel(output_file, index=False)
-    
-    # 使用openpyxl合并相同员工当天的异常描述单元格
-    wb = load_workbook(output_file)
-    ws = wb.active
-    
-    # 获取列名到列索引的映射
-    column_indices = {}
-    for i, column in enumerate(ws[1]):
-        column_indices[column.value] = i + 1  # Excel列从1开始
-    
-    # 按姓名和日期分组
-    groups = {}
-    for i, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-        name_idx = column_indices.get('姓名', 0) - 1
-        date_idx = column_indices.get('刷卡日期', 0) - 1
-        
-        if name_idx >= 0 and date_idx >= 0 and len(row) > max(name_idx, date_idx):
-            name = row[name_idx]
-            date_str = row[date_idx]
-            group_key = f"{name}_{date_str}"
-            
-            if group_key not in groups:
-                groups[group_key] = {'start': i, 'end': i}
-            else:
-                groups[group_key]['end'] = i
-    
-    # 合并异常描述单元格
-    desc_col_idx = column_indices.get('异常描述')
-    if desc_col_idx:
-        for group_key, range_info in groups.items():
-            start_row = range_info['start']
-            end_row = range_info['end']
-            
-            if start_row != end_row:
-                ws.merge_cells(start_row=start_row, start_column=desc_col_idx, 
-                              end_row=end_row, end_column=desc_col_idx)
-    
-    # 保存修改后的Excel文件
-    wb.save(output_file)
+    write_report(result_df, output_file, merge_ranges=get_merge_ranges(result_df))
     print(f"异常数据已保存到: {output_file}")
 
 
-def main():
+def main(file_path=None):
+    """稽核班别匹配结果中的白班记录并保存结果，打印结果清单
+
+    file_path 为班别匹配结果文件，为空时从考勤数据文件夹中查找
+    """
     try:
+        start_time = time_module.time()
+        
         # 获取班别匹配结果文件
-        file_path = get_matched_file()
+        if file_path is None:
+            file_path = get_matched_file()
         print(f"处理文件: {file_path}")
+        outputs = {}
+        rows = {}
         
-        # 处理考勤数据
-        result_df = process_attendance_data(file_path)
+        # 处理考勤数据，按姓名分块并行检测，请假、加班流程表与班别匹配结果在同一文件夹中
+        data_dir = os.path.dirname(os.path.abspath(file_path))
+        leaves = 班别分类.load_leave_intervals(data_dir)
+        overtimes = 班别分类.load_overtime_intervals(data_dir)
+        result_df = process_attendance_data(file_path, workers=None, leaves=leaves, overtimes=overtimes)
         
         # 保存结果
         if result_df is not None and not result_df.empty:
@@ -622,12 +989,16 @@ def main():
             # 保存结果
             output_file = os.path.join(attendance_dir, "白班稽查结果.xlsx")
             save_result_to_excel(result_df, output_file)
+            outputs["白班稽查结果"] = output_file
+            rows["白班稽查结果"] = len(result_df)
         else:
             print("未发现需要保存的异常数据")
+        
+        emit_manifest(make_manifest("白班稽核", outputs=outputs, rows=rows, elapsed=time_module.time() - start_time))
             
     except Exception as e:
         print(f"程序运行出错: {str(e)}")
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,52 @@
+import copy
+
+from 时间换算 import clock
+from 在场时段 import REPEAT_WINDOW
+
+
+class AuditThresholds:
+    """白班、夜班稽核使用的阈值
+
+    时刻为从0点起算的秒数，时长为分钟（重复打卡间隔为秒），默认值即原来写在各规则中的数值。
+    稽核函数的 thresholds 参数为None时使用 DEFAULT_THRESHOLDS
+    """
+
+    def __init__(self, day_start=clock(8), day_end=clock(16, 40), night_start=clock(20), night_end=clock(4),
+                 night_late_after=clock(20, 1), outing_minutes=15, duplicate_window=REPEAT_WINDOW,
+                 night_overtime_minutes=180):
+        """
+        Args:
+            day_start、day_end: 白班上班、下班时间
+            night_start、night_end: 夜班上班、下班时间
+            night_late_after: 夜班首次进入晚于该时间为迟到
+            outing_minutes: 工作时间内外出超过该分钟数为外出超时
+            duplicate_window: 该秒数内的多次打卡视为重复打卡：白班不算连续进入，夜班合并为一次
+            night_overtime_minutes: 夜班无加班单的加班少于该分钟数为加班不足
+        """
+        self.day_start = day_start
+        self.day_end = day_end
+        self.night_start = night_start
+        self.night_end = night_end
+        self.night_late_after = night_late_after
+        self.outing_minutes = outing_minutes
+        self.duplicate_window = duplicate_window
+        self.night_overtime_minutes = night_overtime_minutes
+
+    def replace(self, **changes):
+        """返回修改了部分阈值的副本，用于比较不同阈值下的稽核结果"""
+        for name in changes:
+            if not hasattr(self, name):
+                raise TypeError(f"未知的阈值: {name}")
+        thresholds = copy.copy(self)
+        thresholds.__dict__.update(changes)
+        return thresholds
+
+    def __eq__(self, other):
+        return isinstance(other, AuditThresholds) and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={value}" for name, value in self.__dict__.items())
+        return f"AuditThresholds({values})"
+
+
+DEFAULT_THRESHOLDS = AuditThresholds()
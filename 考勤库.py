@@ -0,0 +1,252 @@
+import os
+import sqlite3
+import logging
+from datetime import date, datetime, time as dt_time
+
+import numpy as np
+import pandas as pd
+
+from 表格缓存 import get_program_dir
+from 报表写出 import write_report
+from 列类型 import row_flags
+from 时间换算 import map_unique, to_datetime_values
+from 考勤日汇总 import FACT_COLUMNS, get_shift_dates, get_swipe_datetimes
+
+
+# 考勤库文件，放在程序所在目录（放在考勤数据文件夹外面的原因见 表格缓存.get_cache_dir）
+DB_FILE_NAME = "考勤库.db"
+
+# 表结构版本，保存在 PRAGMA user_version 中
+SCHEMA_VERSION = 1
+
+# 保留最近几个批次的数据，更早的批次在每次处理结束后删除（见 AttendanceStore.prune_runs）
+KEEP_RUNS = 3
+
+# 刷卡记录（班别匹配结果）的列
+SWIPE_COLUMNS = ['单位', '部门', '部门CXO-2', '工号', '姓名', '刷卡日期', '刷卡时间', '刷卡机', '来源', '班别',
+                 '加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数',
+                 '请假开始时间', '请假结束时间', '请假时数']
+
+# 稽核发现的异常记录的列，与白班、夜班稽查结果的输出列相同，班次为“白班”或“夜班”
+ANOMALY_COLUMNS = ['班次', '单位', '部门', '部门CXO-2', '工号', '姓名', '刷卡日期', '刷卡时间', '刷卡机', '班别',
+                   '加班单开始日期', '加班单开始时间', '加班单结束日期', '加班单结束时间', '加班单时数',
+                   '请假开始时间', '请假结束时间', '请假时数', '异常', '异常描述',
+                   '外出时间', '进入时间', '外出时长', '连续进入时间1', '连续进入时间2', '实际加班时长']
+
+# 各表的数据列，每张表另有 run_id（所属的处理批次）和 shift_date（班次日期）两列，
+# 并按(工号, shift_date)和 run_id 建立索引
+TABLES = {
+    'swipes': SWIPE_COLUMNS,
+    'shifts': [col for col in FACT_COLUMNS if col != '班次日期'],
+    'leaves': ['工号', '姓名', '开始时间', '结束时间'],
+    'overtimes': ['工号', '姓名', '开始时间', '结束时间', '加班单时数'],
+    'anomalies': ANOMALY_COLUMNS,
+}
+
+
+def get_db_file():
+    """考勤库文件路径"""
+    return os.path.join(get_program_dir(), DB_FILE_NAME)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql_value(value):
+    """单个取值转换为SQLite可以保存的类型：日期时间为文本，numpy数值为Python数值，空值为None"""
+    if value is None or (not isinstance(value, (str, bytes)) and np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        if value.hour == value.minute == value.second == 0:
+            return value.strftime('%Y-%m-%d')
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, dt_time):
+        return value.strftime('%H:%M:%S')
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+
+def _sql_column(values):
+    """一列取值转换为可以批量写入的列表，每个不同的取值只转换一次"""
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        valid = values.notna()
+        has_time = (values[valid] != values[valid].dt.normalize()).any()
+        texts = values.dt.strftime('%Y-%m-%d %H:%M:%S' if has_time else '%Y-%m-%d')
+        return texts.astype(object).where(valid, None).tolist()
+    if values.dtype == object:
+        return map_unique(values, _sql_value).tolist()
+    return values.astype(object).where(values.notna(), None).map(_sql_value).tolist()
+
+
+def _date_texts(values):
+    """日期列转换为“年-月-日”文本，空值为None"""
+    dates = pd.Series(values).reset_index(drop=True)
+    return dates.dt.strftime('%Y-%m-%d').astype(object).where(dates.notna(), None).tolist()
+
+
+def swipe_shift_dates(df):
+    """各条刷卡记录的班次日期：夜班记录以12点为分界，其余记录为刷卡日期"""
+    is_night = row_flags(df, 'is_night')['is_night']
+    swipe_dates = to_datetime_values(df['刷卡日期']).dt.normalize().reset_index(drop=True)
+    if is_night.any():
+        night_dates = get_shift_dates(get_swipe_datetimes(df)).reset_index(drop=True)
+        swipe_dates = swipe_dates.where(~is_night, night_dates)
+    return swipe_dates
+
+
+def _employee_numbers(names, matched):
+    """按姓名从刷卡记录中查找工号，请假、加班单等只有姓名的表使用"""
+    if matched is None or '工号' not in matched.columns:
+        return [None] * len(names)
+    known = matched[matched['姓名'].notna().to_numpy()].drop_duplicates('姓名')
+    numbers = pd.Series(known['工号'].to_numpy(dtype=object), index=known['姓名'].to_numpy(dtype=object))
+    return numbers.reindex(pd.Series(names, dtype=object)).to_numpy(dtype=object)
+
+
+class AttendanceStore:
+    """本地SQLite考勤库：每次处理为一个批次，保存刷卡记录、每日考勤汇总（班次）、请假、加班单和异常记录
+
+    各步骤的结果在步骤结束时整表批量写入（executemany），处理结束后仍可以按工号、班次日期查询历史数据；
+    Excel只作为导出格式（见 export_excel）。每次读写都使用独立的连接，白班、夜班稽核可以在不同线程中写入
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file or get_db_file()
+        self._execute(self._create_schema)
+
+    def _execute(self, func):
+        """在一个事务中执行 func(conn)，成功时提交，出错时回滚"""
+        conn = sqlite3.connect(self.db_file, timeout=60)
+        try:
+            with conn:
+                return func(conn)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "data_dir TEXT, started_at TEXT, finished_at TEXT, status TEXT)")
+        for table, columns in TABLES.items():
+            column_defs = ', '.join(_quote(col) for col in columns)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (run_id INTEGER NOT NULL, shift_date TEXT, "
+                         f"{column_defs})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_employee_date ON {table} (\"工号\", shift_date)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_run ON {table} (run_id)")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def begin_run(self, data_dir):
+        """开始一个处理批次，返回批次号"""
+        started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return self._execute(lambda conn: conn.execute(
+            "INSERT INTO runs (data_dir, started_at, status) VALUES (?, ?, ?)",
+            (data_dir, started_at, "执行中")).lastrowid)
+
+    def finish_run(self, run_id, status):
+        """记录批次的结束时间和状态（完成、失败）"""
+        finished_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._execute(lambda conn: conn.execute("UPDATE runs SET finished_at = ?, status = ? WHERE run_id = ?",
+                                                (finished_at, status, run_id)))
+
+    def prune_runs(self, keep_runs=KEEP_RUNS):
+        """删除最近 keep_runs 个批次之前的批次及其数据，最近一个完成的批次总是保留，返回删除的批次数
+
+        有批次被删除时执行VACUUM收回文件空间，考勤库文件不会随处理次数无限增长
+        """
+        def delete_old_runs(conn):
+            kept = {row[0] for row in conn.execute("SELECT run_id FROM runs ORDER BY run_id DESC LIMIT ?",
+                                                   (keep_runs,))}
+            kept.add(conn.execute("SELECT MAX(run_id) FROM runs WHERE status = ?", ("完成",)).fetchone()[0])
+            old_runs = [(row[0],) for row in conn.execute("SELECT run_id FROM runs") if row[0] not in kept]
+            for table in TABLES:
+                conn.executemany(f"DELETE FROM {table} WHERE run_id = ?", old_runs)
+            conn.executemany("DELETE FROM runs WHERE run_id = ?", old_runs)
+            return len(old_runs)
+
+        removed = self._execute(delete_old_runs)
+        if removed:
+            # VACUUM不能在事务中执行，使用自动提交的连接
+            conn = sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+            logging.info(f"已删除考勤库中较早的批次: {removed} 个")
+        return removed
+
+    def insert(self, table, run_id, df, shift_dates):
+        """把 df 中该表的各列批量写入，df 中没有的列写入空值，shift_dates 为各行的班次日期"""
+        columns = TABLES[table]
+        data = [[run_id] * len(df), _date_texts(shift_dates)]
+        for col in columns:
+            data.append(_sql_column(df[col]) if col in df.columns else [None] * len(df))
+        placeholders = ', '.join(['?'] * (len(columns) + 2))
+        column_list = ', '.join(['run_id', 'shift_date'] + [_quote(col) for col in columns])
+        sql = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})"
+        self._execute(lambda conn: conn.executemany(sql, zip(*data)))
+        return len(df)
+
+    def write_matched(self, run_id, matched, leaves=None, overtimes=None):
+        """写入班别匹配结果的刷卡记录，以及请假流程表、加班流程表的请假和加班单区间"""
+        self.insert('swipes', run_id, matched, swipe_shift_dates(matched))
+        for table, intervals in (('leaves', leaves), ('overtimes', overtimes)):
+            if intervals is None or len(intervals) == 0:
+                continue
+            intervals = intervals.reset_index(drop=True).assign(
+                工号=_employee_numbers(intervals['姓名'], matched))
+            self.insert(table, run_id, intervals, pd.to_datetime(intervals['开始时间']).dt.normalize())
+
+    def write_facts(self, run_id, facts):
+        """写入每日考勤汇总，每个(姓名, 班次日期, 班次)一行"""
+        self.insert('shifts', run_id, facts, pd.to_datetime(facts['班次日期']))
+
+    def write_anomalies(self, run_id, shift, result_df):
+        """写入白班或夜班稽核结果（整理格式后），shift 为“白班”或“夜班”"""
+        if result_df is None or result_df.empty:
+            return 0
+        result_df = result_df.assign(班次=shift)
+        if shift == '夜班':
+            shift_dates = get_shift_dates(get_swipe_datetimes(result_df))
+        else:
+            shift_dates = to_datetime_values(result_df['刷卡日期']).dt.normalize()
+        return self.insert('anomalies', run_id, result_df, shift_dates)
+
+    def latest_run(self, status="完成"):
+        """最近一个状态为 status 的批次号，没有时返回None"""
+        row = self._execute(lambda conn: conn.execute(
+            "SELECT MAX(run_id) FROM runs WHERE status = ?", (status,)).fetchone())
+        return row[0] if row else None
+
+    def read(self, table, run_id=None, employee=None, start_date=None, end_date=None):
+        """读取某批次（默认为最近完成的批次）的一张表，可以按工号和班次日期范围筛选"""
+        run_id = run_id if run_id is not None else self.latest_run()
+        conditions, params = ["run_id = ?"], [run_id]
+        if employee is not None:
+            conditions.append('"工号" = ?')
+            params.append(employee)
+        if start_date is not None:
+            conditions.append("shift_date >= ?")
+            params.append(pd.Timestamp(start_date).strftime('%Y-%m-%d'))
+        if end_date is not None:
+            conditions.append("shift_date <= ?")
+            params.append(pd.Timestamp(end_date).strftime('%Y-%m-%d'))
+        columns = ', '.join(['shift_date'] + [_quote(col) for col in TABLES[table]])
+        sql = f"SELECT {columns} FROM {table} WHERE {' AND '.join(conditions)} ORDER BY rowid"
+        return self._execute(lambda conn: pd.read_sql_query(sql, conn, params=params))
+
+    def export_excel(self, table, output_file, run_id=None, **filters):
+        """把一张表（筛选条件同 read）导出为Excel文件，返回导出的行数"""
+        df = self.read(table, run_id, **filters)
+        write_report(df, output_file, sheet_name=table)
+        logging.info(f"已导出考勤库数据: {table} -> {os.path.basename(output_file)}, 记录数: {len(df)}")
+        return len(df)
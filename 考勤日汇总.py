@@ -0,0 +1,241 @@
+import numpy as np
+import pandas as pd
+
+from 列类型 import row_flags
+from 报表写出 import write_report
+from 时间换算 import (MISSING, SECONDS_PER_DAY, SECONDS_PER_HOUR, SECONDS_PER_MINUTE, clock, day_start,
+                  parse_clock_texts, time_of_day, to_datetime_values, to_seconds, to_timestamps)
+from 在场时段 import build_sessions
+from 区间索引 import absence_index, first_stamp_between, overtime_index, row_overtime_intervals
+
+
+# 班次类型
+DAY_SHIFT = '白班'
+NIGHT_SHIFT = '夜班'
+SHIFT_TYPES = (DAY_SHIFT, NIGHT_SHIFT)
+
+# 白班的标准上班、下班打卡时间（秒，从0点起算），与 白班稽核1_1.WORK_START、WORK_END 相同
+STANDARD_IN = clock(8)
+STANDARD_OUT = clock(16, 40)
+
+# 各班次的加班单时间段从班次日期的该时刻起算，为期一天：白班为0点，夜班为12点
+OVERTIME_WINDOW_START = {DAY_SHIFT: 0, NIGHT_SHIFT: clock(12)}
+
+# 与稽核结果一起写出的每日考勤汇总文件
+FACTS_FILE = "考勤日汇总.xlsx"
+
+# 每日考勤汇总的列，每个(姓名, 班次日期, 班次)一行
+FACT_COLUMNS = ['工号', '姓名', '部门', '班次', '班次日期', '刷卡次数', '首次进入', '最后外出', '08:00进入',
+                '16:40外出', '外出分钟', '加班单数', '加班开始', '加班结束', '加班单时数', '加班在场小时']
+
+
+def get_swipe_datetimes(df):
+    """合并刷卡日期和刷卡时间为一列刷卡时刻，无法解析的记录为NaT"""
+    swipe_date = to_datetime_values(df['刷卡日期'])
+    swipe_time = to_datetime_values(df['刷卡时间'])
+    return swipe_date.dt.normalize() + (swipe_time - swipe_time.dt.normalize())
+
+
+def get_shift_dates(swipe_dt):
+    """确定记录属于哪个夜班班次（以12点为分界），12点前的记录属于前一天的班次"""
+    return (swipe_dt - pd.Timedelta(hours=12)).dt.normalize()
+
+
+def build_night_shift_table(df):
+    """夜班记录预处理：解析刷卡时刻、忽略12:00-18:00的记录并按(姓名, 班次日期, 刷卡时刻)排序
+
+    返回的表中 position 为记录在 df 中的行号
+    """
+    is_night = row_flags(df, 'is_night')['is_night'] & df['姓名'].notna().to_numpy()
+    night = df[is_night]
+    swipe_dt = get_swipe_datetimes(night)
+    time_of_day = swipe_dt - swipe_dt.dt.normalize()
+
+    # 忽略12:00-18:00的打卡记录
+    ignored = (time_of_day >= pd.Timedelta(hours=12)) & (time_of_day <= pd.Timedelta(hours=18))
+    keep = (swipe_dt.notna() & ~ignored).to_numpy()
+
+    table = pd.DataFrame({
+        '姓名': night['姓名'].to_numpy()[keep],
+        'shift_date': get_shift_dates(swipe_dt).to_numpy()[keep],
+        'datetime': swipe_dt.to_numpy()[keep],
+        'position': np.flatnonzero(is_night)[keep],
+    })
+    return table.sort_values(['姓名', 'shift_date', 'datetime'], kind='stable').reset_index(drop=True)
+
+
+def _column_values(df, col, positions=None):
+    """取 df 中某列的取值（object数组），没有该列时为空值"""
+    if col not in df.columns:
+        return np.full(len(df) if positions is None else len(positions), np.nan, dtype=object)
+    values = df[col].to_numpy(dtype=object)
+    return values if positions is None else values[positions]
+
+
+def day_shift_rows(df):
+    """白班稽核检测的记录：当天任一班别含“白班”的(姓名, 刷卡日期)整组，刷卡时间的解析与白班稽核相同
+
+    按(姓名, 刷卡日期, 刷卡时间)排序，刷卡时间无法解析的记录时刻为MISSING、不算进出
+    """
+    swipe_time = parse_clock_texts(df['刷卡时间'])
+    if swipe_time is None:
+        swipe_time = pd.to_datetime(df['刷卡时间'], errors='coerce')
+    swipe_date = pd.to_datetime(df['刷卡日期'], errors='coerce')
+    keep = (df['姓名'].notna() & swipe_date.notna()).to_numpy()
+
+    names = df['姓名'].to_numpy(dtype=object)[keep]
+    dates = swipe_date.to_numpy(dtype='datetime64[ns]')[keep]
+    flags = {name: values[keep] for name, values in row_flags(df, 'is_day', 'is_in', 'is_out').items()}
+    is_day = pd.Series(flags['is_day']).groupby([names, dates]).transform('any').to_numpy()
+
+    swipe_time = swipe_time[keep][is_day]
+    rows = pd.DataFrame({
+        '姓名': names[is_day],
+        '班次日期': dates[is_day],
+        'time': swipe_time.to_numpy(),
+        'position': np.flatnonzero(keep)[is_day],
+        'is_in': flags['is_in'][is_day],
+        'is_out': flags['is_out'][is_day],
+    }).sort_values(['姓名', '班次日期', 'time'], kind='stable').reset_index(drop=True)
+
+    valid_time = rows['time'].notna().to_numpy()
+    stamps = day_start(to_timestamps(rows['班次日期'])) + to_seconds(rows['time'])
+    rows['stamp'] = np.where(valid_time, stamps, MISSING)
+    rows['is_in'] &= valid_time
+    rows['is_out'] &= valid_time
+    return rows.drop(columns='time')
+
+
+def night_shift_rows(df):
+    """夜班稽核检测的记录：班别含“夜班”的记录按班次（以12点为分界）划分，见 build_night_shift_table"""
+    table = build_night_shift_table(df)
+    positions = table['position'].to_numpy()
+    flags = row_flags(df, 'is_in', 'is_out')
+    return pd.DataFrame({
+        '姓名': table['姓名'].to_numpy(dtype=object),
+        '班次日期': table['shift_date'].to_numpy(dtype='datetime64[ns]'),
+        'position': positions,
+        'is_in': flags['is_in'][positions],
+        'is_out': flags['is_out'][positions],
+        'stamp': to_timestamps(table['datetime']),
+    })
+
+
+def _shift_rows(df, shift):
+    """某种班次的记录及逐条汇总用的列，返回(记录表, 员工的不在场区间索引)
+
+    记录按(姓名, 班次日期, 刷卡时刻)排序。出入时段表按员工建立一次：外出到其后第一次进入的时长
+    在同一班次内时计入该班次的外出时长，每次外出到再次进入都是员工的不在场时段
+    """
+    rows = day_shift_rows(df) if shift == DAY_SHIFT else night_shift_rows(df)
+    rows['班次'] = shift
+    rows['工号'] = _column_values(df, '工号', rows['position'].to_numpy())
+    rows['部门'] = _column_values(df, '部门', rows['position'].to_numpy())
+
+    names = rows['姓名'].to_numpy(dtype=object)
+    stamps = rows['stamp'].to_numpy()
+    is_in = rows['is_in'].to_numpy()
+    is_out = rows['is_out'].to_numpy()
+    dates = rows['班次日期'].to_numpy()
+    new_shift = np.ones(len(rows), dtype=bool)
+    new_shift[1:] = (names[1:] != names[:-1]) | (dates[1:] != dates[:-1])
+    shift_ids = np.cumsum(new_shift)
+
+    sessions = build_sessions(pd.factorize(names)[0], stamps, is_in, is_out)
+    partner = sessions['partner'].to_numpy()
+    returned = is_out & (partner >= 0)
+    returned[returned] = shift_ids[partner[returned]] == shift_ids[returned]
+    clocks = time_of_day(stamps)
+
+    rows['in_stamp'] = np.where(is_in, stamps, np.nan)
+    rows['out_stamp'] = np.where(is_out, stamps, np.nan)
+    rows['standard_in'] = is_in & (clocks == STANDARD_IN)
+    rows['standard_out'] = is_out & (clocks == STANDARD_OUT)
+    rows['outside'] = np.where(returned, sessions['duration'].to_numpy(), 0)
+    return rows, absence_index(names, stamps, is_out, sessions['next_in'].to_numpy())
+
+
+def _stamp_datetimes(stamps):
+    """时间戳（秒）转换为日期时间，MISSING为NaT"""
+    stamps = np.asarray(stamps, dtype=np.int64)
+    return pd.to_datetime(np.where(stamps >= 0, stamps, np.nan), unit='s')
+
+
+def build_daily_facts(df, overtimes=None, shifts=SHIFT_TYPES):
+    """由班别匹配结果生成每日考勤汇总，每个(姓名, 班次日期, 班次)一行，列见 FACT_COLUMNS
+
+    白班按刷卡日期、夜班按以12点为分界的班次日期汇总，记录的取舍与白班、夜班稽核相同，
+    两种班次的记录拼接后用一次分组聚合得到刷卡次数、首次进入、最后外出、08:00整进入、
+    16:40整外出和外出时长。加班单为班次时间段内开始的全部加班单，加班在场小时为从加班单开始
+    到其结束后第一次外出（不晚于结束当天）扣除其间外出时间的小时数，没有这样的外出时为空。
+    overtimes 为加班单区间表（见 区间索引.overtime_intervals），为None时由各记录上的加班单得到
+    """
+    parts = {shift: _shift_rows(df, shift) for shift in shifts}
+    rows = pd.concat([part for part, _ in parts.values()], ignore_index=True)
+
+    facts = rows.groupby(['班次', '姓名', '班次日期'], sort=False).agg(**{
+        '工号': ('工号', 'first'),
+        '部门': ('部门', 'first'),
+        '刷卡次数': ('stamp', 'size'),
+        '首次进入': ('in_stamp', 'min'),
+        '最后外出': ('out_stamp', 'max'),
+        '08:00进入': ('standard_in', 'any'),
+        '16:40外出': ('standard_out', 'any'),
+        '外出分钟': ('outside', 'sum'),
+    }).reset_index()
+    facts['首次进入'] = pd.to_datetime(facts['首次进入'], unit='s')
+    facts['最后外出'] = pd.to_datetime(facts['最后外出'], unit='s')
+    facts['外出分钟'] = (facts['外出分钟'] / SECONDS_PER_MINUTE).round(2)
+
+    # 加班单和加班期间的在场时长，按班次类型查询各自的加班单时间段和不在场区间
+    overtime_idx = overtime_index(row_overtime_intervals(df) if overtimes is None else overtimes)
+    form_count = np.zeros(len(facts), dtype=np.int64)
+    form_starts = np.full(len(facts), MISSING, dtype=np.int64)
+    form_ends = np.full(len(facts), MISSING, dtype=np.int64)
+    form_hours = np.zeros(len(facts))
+    on_site_hours = np.full(len(facts), np.nan)
+    for shift, (part, absence_idx) in parts.items():
+        index = np.flatnonzero((facts['班次'] == shift).to_numpy())
+        names = facts['姓名'].to_numpy(dtype=object)[index]
+        window_starts = to_timestamps(facts['班次日期'])[index] + OVERTIME_WINDOW_START[shift]
+        count, starts, ends, hours = overtime_idx.forms_starting(names, window_starts, window_starts + SECONDS_PER_DAY)
+        form_count[index], form_starts[index], form_ends[index], form_hours[index] = count, starts, ends, hours
+
+        has_form = count > 0
+        out_rows = part['is_out'].to_numpy()
+        next_out = first_stamp_between(part['姓名'].to_numpy(dtype=object)[out_rows], part['stamp'].to_numpy()[out_rows],
+                                       names[has_form], ends[has_form], day_start(ends[has_form]) + SECONDS_PER_DAY)
+        found = next_out >= 0
+        index, names, starts = index[has_form][found], names[has_form][found], starts[has_form][found]
+        absent = absence_idx.overlap_seconds(names, starts, next_out[found])
+        on_site_hours[index] = (next_out[found] - starts - absent) / SECONDS_PER_HOUR
+
+    facts['加班单数'] = form_count
+    facts['加班开始'] = _stamp_datetimes(form_starts)
+    facts['加班结束'] = _stamp_datetimes(form_ends)
+    facts['加班单时数'] = form_hours
+    facts['加班在场小时'] = on_site_hours
+    return facts[FACT_COLUMNS]
+
+
+def shift_facts(facts, shift, names, dates):
+    """按(姓名, 班次日期)取某种班次的每日考勤汇总，行与 names、dates 一一对应，汇总中没有的为空值"""
+    part = facts[(facts['班次'] == shift).to_numpy()]
+    part = part.set_index([part['姓名'].to_numpy(dtype=object), part['班次日期'].to_numpy(dtype='datetime64[ns]')])
+    keys = pd.MultiIndex.from_arrays([pd.Series(names, dtype=object).to_numpy(),
+                                      np.asarray(dates, dtype='datetime64[ns]')])
+    return part.reindex(keys).reset_index(drop=True)
+
+
+def save_daily_facts(facts, output_file):
+    """写出每日考勤汇总"""
+    write_report(facts, output_file, sheet_name='考勤日汇总')
+
+
+def read_daily_facts(file_path):
+    """读取写出的每日考勤汇总，文件不存在或读取失败时返回None"""
+    try:
+        return pd.read_excel(file_path)
+    except Exception as e:
+        print(f"读取考勤日汇总出错: {str(e)}")
+        return None
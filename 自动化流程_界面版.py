@@ -1,6 +1,5 @@
 import os
 import sys
-import glob
 import time
 import subprocess
 import logging
@@ -10,6 +9,9 @@ import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 from datetime import datetime
 
+from 步骤调度 import StepScheduler, StepFailed, make_manifest, parse_manifest
+from 步骤缓存 import archive_run_files
+
 # 工作目录
 WORK_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -137,10 +139,24 @@ class AutomationApp:
         self.start_button = ttk.Button(button_frame, text="重新开始", command=self.start_process)
         self.start_button.pack(side=tk.LEFT, padx=5)
         
+        # 创建继续按钮：不重新修复文件，沿用考勤数据中的文件，未变化的步骤使用步骤缓存（仅进程内模式）
+        self.resume_button = ttk.Button(button_frame, text="从失败步骤继续", command=lambda: self.start_process(resume=True))
+        self.resume_button.pack(side=tk.LEFT, padx=5)
+        
         # 创建查看日志按钮
         self.log_button = ttk.Button(button_frame, text="查看完整日志", command=self.view_log)
         self.log_button.pack(side=tk.LEFT, padx=5)
         
+        # 创建运行模式选项：默认进程内执行，勾选后每个步骤使用独立子进程
+        self.subprocess_mode = tk.BooleanVar(value=False)
+        self.mode_check = ttk.Checkbutton(button_frame, text="子进程兼容模式", variable=self.subprocess_mode)
+        self.mode_check.pack(side=tk.LEFT, padx=5)
+        
+        # 创建增量稽核选项：默认检测全部数据，勾选后只重新检测与上次运行相比数据有变化的员工日（仅进程内模式）
+        self.incremental_mode = tk.BooleanVar(value=False)
+        self.incremental_check = ttk.Checkbutton(button_frame, text="增量稽核", variable=self.incremental_mode)
+        self.incremental_check.pack(side=tk.LEFT, padx=5)
+        
         # 创建退出按钮
         self.exit_button = ttk.Button(button_frame, text="退出", command=self.root.destroy)
         self.exit_button.pack(side=tk.RIGHT, padx=5)
@@ -151,26 +167,34 @@ class AutomationApp:
         # 初始化处理线程
         self.process_thread = None
         self.is_running = False
+        self.resume = False
+        self.status_lock = threading.Lock()
+        self.final_result_file = None
     
     def update_step_status(self, step_index, status):
-        """更新步骤状态"""
-        self.steps[step_index]["status"] = status
-        self.steps[step_index]["var"].set(status)
-        
-        # 更新进度条
-        completed_steps = sum(1 for step in self.steps if step["status"] in ["完成", "跳过"])
-        progress = (completed_steps / len(self.steps)) * 100
-        self.progress_var.set(progress)
-        
-        # 更新百分比显示
-        self.progress_percent.set(f"{int(progress)}%")
+        """更新步骤状态，并发执行的步骤会从不同线程调用"""
+        with self.status_lock:
+            self.steps[step_index]["status"] = status
+            self.steps[step_index]["var"].set(status)
+            
+            # 更新进度条：执行中的步骤按半个步骤计算，并发执行的步骤同时推进进度
+            completed_steps = sum(1 for step in self.steps if step["status"] in ["完成", "跳过", "已缓存"])
+            running_steps = sum(1 for step in self.steps if step["status"] == "执行中")
+            progress = ((completed_steps + running_steps * 0.5) / len(self.steps)) * 100
+            self.progress_var.set(progress)
+            
+            # 更新百分比显示
+            self.progress_percent.set(f"{int(progress)}%")
     
-    def run_script(self, script_name):
-        """运行Python脚本"""
+    def run_script(self, script_name, *args):
+        """运行Python脚本，args 为传给脚本的命令行参数
+
+        执行成功时返回脚本打印的结果清单（脚本未打印时为空清单），失败时返回None
+        """
         script_path = os.path.join(WORK_DIR, script_name)
         if not os.path.exists(script_path):
             logging.error(f"脚本不存在: {script_path}")
-            return False
+            return None
         
         # 获取打包后的可执行文件所在目录
         if getattr(sys, 'frozen', False):
@@ -180,7 +204,7 @@ class AutomationApp:
             # 普通Python运行模式
             application_path = WORK_DIR
         
-        cmd = [sys.executable, script_path]
+        cmd = [sys.executable, script_path, *args]
         
         logging.info(f"开始执行: {script_name}")
         start_time = time.time()
@@ -196,6 +220,7 @@ class AutomationApp:
                 stderr=subprocess.PIPE,
                 text=True,
                 encoding='gbk',
+                errors='replace',
                 env=env
             )
             stdout, stderr = process.communicate()
@@ -206,45 +231,165 @@ class AutomationApp:
             if process.returncode != 0:
                 logging.error(f"执行失败: {script_name}")
                 logging.error(f"错误信息: {stderr}")
-                return False
+                return None
             
-            logging.info(f"执行成功: {script_name}, 耗时: {run_time:.2f}秒")
-            return True
+            manifest = parse_manifest(stdout) or make_manifest(script_name)
+            logging.info(f"执行成功: {script_name}, 耗时: {run_time:.2f}秒, 输出: {manifest['outputs']}, 记录数: {manifest['rows']}")
+            return manifest
         except Exception as e:
             end_time = time.time()
             run_time = end_time - start_time
             logging.error(f"执行异常: {script_name}, 错误: {str(e)}, 耗时: {run_time:.2f}秒")
+            return None
+    
+    def run_script_step(self, step_index, step_label, script_name, *args, fatal=True):
+        """以子进程方式执行一个步骤脚本并更新步骤状态，返回脚本的结果清单
+
+        fatal 为True时执行失败抛出 StepFailed，流程终止；否则返回None
+        """
+        self.update_step_status(step_index, "执行中")
+        logging.info(f"步骤{step_index + 1}: 运行{step_label}工具")
+        manifest = self.run_script(script_name, *args)
+        if manifest is None:
+            logging.error(f"{step_label}失败")
+            self.update_step_status(step_index, "失败")
+            if fatal:
+                raise StepFailed(step_label)
+            return None
+        self.update_step_status(step_index, "完成")
+        return manifest
+    
+    def skip_repair(self):
+        """从失败步骤继续时不再修复文件，返回True表示已跳过"""
+        if not self.resume:
             return False
+        logging.info("从失败步骤继续, 跳过文件修复, 使用考勤数据文件夹中已有的文件")
+        self.update_step_status(0, "跳过")
+        return True
+    
+    def repair_step(self, inputs):
+        # 步骤1: 运行EXCEL修复.py，修复失败不影响后续步骤
+        if self.skip_repair():
+            return
+        self.run_script_step(0, "Excel修复", "EXCEL修复.py", fatal=False)
+    
+    def match_step(self, inputs):
+        # 步骤2: 运行班别分类.py
+        manifest = self.run_script_step(1, "班别分类", "班别分类.py")
+        班别分类结果 = manifest["outputs"].get("班别匹配结果")
+        if not 班别分类结果:
+            logging.error("班别分类未生成班别匹配结果，流程终止")
+            messagebox.showerror("错误", "未生成班别分类结果文件，请确认班别分类步骤是否正确完成")
+            raise StepFailed("班别分类")
+        return 班别分类结果
+    
+    def day_shift_step(self, inputs):
+        # 步骤3: 运行白班稽核1_1.py
+        manifest = self.run_script_step(2, "白班稽核", "白班稽核1_1.py", inputs["班别分类"])
+        白班异常文件 = manifest["outputs"].get("白班稽查结果")
+        if not 白班异常文件:
+            logging.warning("白班稽核未生成结果文件，可能没有白班异常")
+        return 白班异常文件
+    
+    def night_shift_step(self, inputs):
+        # 步骤4: 运行夜班稽核.py
+        manifest = self.run_script_step(3, "夜班稽核", "夜班稽核.py", inputs["班别分类"])
+        夜班异常文件 = manifest["outputs"].get("夜班稽查结果")
+        if not 夜班异常文件:
+            logging.warning("夜班稽核未生成结果文件，可能没有夜班异常")
+        return 夜班异常文件
+    
+    def merge_step(self, inputs):
+        白班异常文件 = inputs["白班稽核"]
+        夜班异常文件 = inputs["夜班稽核"]
+        
+        # 步骤5: 运行合并Excel文件.py (如果有两个异常文件)
+        if not (白班异常文件 and 夜班异常文件):
+            logging.info("跳过合并步骤，因为没有足够的异常文件")
+            self.update_step_status(4, "跳过")
+            # 使用可用的异常文件作为最终结果
+            return 白班异常文件 or 夜班异常文件
+        
+        manifest = self.run_script_step(4, "合并Excel文件", "合并Excel文件.py", 夜班异常文件, 白班异常文件)
+        合并结果文件 = manifest["outputs"].get("合并结果")
+        if not 合并结果文件:
+            logging.error("合并Excel文件未生成合并结果，流程终止")
+            raise StepFailed("合并Excel文件")
+        return 合并结果文件
     
-    def find_latest_file(self, pattern, exclude_pattern=None, in_data_dir=False):
-        """查找最新的匹配文件
+    def check_step(self, inputs):
+        # 步骤6: 运行异常数据稽核.py (原考勤核查.py)
+        if not inputs["合并文件"]:
+            logging.info("跳过异常数据稽核和内容优化步骤，因为没有异常文件")
+            self.update_step_status(5, "跳过")
+            return None
         
-        Args:
-            pattern: 文件匹配模式
-            exclude_pattern: 排除的文件模式
-            in_data_dir: 是否在考勤数据目录中查找
-        """
-        # 确定查找目录
-        search_dir = WORK_DIR
-        if in_data_dir:
-            search_dir = os.path.join(WORK_DIR, "考勤数据")
-            
-        # 构建完整的查找路径
-        search_path = os.path.join(search_dir, pattern)
-        files = glob.glob(search_path)
+        manifest = self.run_script_step(5, "异常数据稽核", "异常数据稽核.py", inputs["合并文件"])
+        核对版数据文件 = manifest["outputs"].get("核对版数据")
+        if not 核对版数据文件:
+            logging.error("异常数据稽核未生成核对版数据，无法继续执行内容优化")
+            self.update_step_status(6, "跳过")
+            raise StepFailed("异常数据稽核")
+        return 核对版数据文件
+    
+    def optimize_step(self, inputs):
+        if not inputs["异常数据稽核"]:
+            self.update_step_status(6, "跳过")
+            return None
         
-        # 排除不需要的文件
-        if exclude_pattern:
-            files = [f for f in files if exclude_pattern not in f]
+        # 步骤7: 运行内容优化.py
+        manifest = self.run_script_step(6, "内容优化", "内容优化.py", fatal=False)
+        优化结果文件 = manifest["outputs"].get("考勤稽核数据核对版") if manifest else None
+        if not 优化结果文件:
+            logging.warning("未生成优化结果文件")
+        return 优化结果文件
+    
+    def run_pipeline_subprocess(self):
+        """子进程模式：每个步骤启动独立的Python进程，步骤之间通过脚本输出的结果清单传递结果文件
+
+        步骤按依赖关系调度，白班稽核和夜班稽核并发执行，合并步骤在两者都完成后立即开始。
+        流程正常结束返回True，需要终止时返回False
+        """
+        scheduler = StepScheduler()
+        scheduler.add_step("Excel修复", self.repair_step)
+        scheduler.add_step("班别分类", self.match_step, depends_on=["Excel修复"])
+        scheduler.add_step("白班稽核", self.day_shift_step, depends_on=["班别分类"])
+        scheduler.add_step("夜班稽核", self.night_shift_step, depends_on=["班别分类"])
+        scheduler.add_step("合并文件", self.merge_step, depends_on=["白班稽核", "夜班稽核"])
+        scheduler.add_step("异常数据稽核", self.check_step, depends_on=["合并文件"])
+        scheduler.add_step("内容优化", self.optimize_step, depends_on=["异常数据稽核"])
+        
+        completed, results = scheduler.run()
+        if not completed:
+            return False
         
-        if not files:
-            logging.warning(f"未找到匹配 '{pattern}' 的文件 (在{'考勤数据目录' if in_data_dir else '当前目录'})")
-            return None
+        self.final_result_file = results["内容优化"]
+        return True
+    
+    def run_pipeline_inprocess(self):
+        """进程内模式：步骤模块只导入一次，步骤之间直接传递DataFrame
+
+        文件修复需要选择文件并调用Excel COM，仍以子进程方式执行。
+        输入、代码和参数都未变化的步骤使用步骤缓存，不再重新执行。
+        流程正常结束返回True，需要终止时返回False
+        """
+        # 步骤1: 运行EXCEL修复.py
+        if not self.skip_repair():
+            self.update_step_status(0, "执行中")
+            logging.info("步骤1: 运行Excel修复工具")
+            if self.run_script("EXCEL修复.py") is None:
+                logging.error("Excel修复失败")
+                self.update_step_status(0, "失败")
+            else:
+                self.update_step_status(0, "完成")
         
-        # 按修改时间排序，返回最新的文件
-        latest_file = max(files, key=os.path.getmtime)
-        logging.info(f"找到最新文件: {os.path.basename(latest_file)}")
-        return latest_file
+        # 步骤2~7: 在当前进程内执行
+        from 流水线引擎 import PipelineEngine
+        engine = PipelineEngine(os.path.join(WORK_DIR, "考勤数据"), status_callback=self.update_step_status,
+                                incremental=self.incremental_mode.get())
+        completed = engine.run()
+        self.final_result_file = engine.final_result_file
+        return completed
     
     def process_automation(self):
         """执行自动化处理流程"""
@@ -258,202 +403,12 @@ class AutomationApp:
         logging.info("===== 开始自动化考勤处理流程 =====")
         
         try:
-            # 步骤1: 运行EXCEL修复.py
-            self.update_step_status(0, "执行中")
-            logging.info("步骤1: 运行Excel修复工具")
-            if not self.run_script("EXCEL修复.py"):
-                logging.error("Excel修复失败")
-                self.update_step_status(0, "失败")
-            else:
-                self.update_step_status(0, "完成")
-            
-            # 等待文件系统更新
-            time.sleep(2)
-            
-            # 步骤2: 运行班别分类.py
-            self.update_step_status(1, "执行中")
-            logging.info("步骤2: 运行班别分类工具")
-            if not self.run_script("班别分类.py"):
-                logging.error("班别分类失败")
-                self.update_step_status(1, "失败")
-                return
-            else:
-                self.update_step_status(1, "完成")
-            
-            # 等待文件系统更新
-            time.sleep(2)
-            
-            # 查找班别分类生成的文件 - 在考勤数据目录中查找
-            班别分类结果 = self.find_latest_file("*班别*结果*.xlsx", in_data_dir=True)
-            if not 班别分类结果:
-                # 尝试其他可能的文件名模式
-                班别分类结果 = self.find_latest_file("班别*.xlsx", in_data_dir=True)
-                
-            if not 班别分类结果:
-                logging.error("未找到班别分类结果文件，流程终止")
-                messagebox.showerror("错误", "未找到班别分类结果文件，请确认班别分类步骤是否正确完成")
-                return
-            
-            logging.info(f"找到班别分类结果文件: {os.path.basename(班别分类结果)}")
-            
-            # 步骤3: 运行白班稽核1_1.py
-            self.update_step_status(2, "执行中")
-            logging.info("步骤3: 运行白班稽核工具")
-            if not self.run_script("白班稽核1_1.py"):
-                logging.error("白班稽核失败")
-                self.update_step_status(2, "失败")
-                return
-            else:
-                self.update_step_status(2, "完成")
-            
-            # 等待文件系统更新
-            time.sleep(2)
-            
-            # 查找白班稽核生成的文件 - 使用正确的文件名模式
-            白班异常文件 = self.find_latest_file("*白班稽查结果*.xlsx", in_data_dir=True)
-            if not 白班异常文件:
-                # 尝试其他可能的文件名模式
-                白班异常文件 = self.find_latest_file("*白班*.xlsx", in_data_dir=True)
-                
-            if not 白班异常文件:
-                logging.warning("未找到白班稽核结果文件，可能没有白班异常")
+            if self.subprocess_mode.get():
+                completed = self.run_pipeline_subprocess()
             else:
-                logging.info(f"找到白班稽核结果文件: {os.path.basename(白班异常文件)}")
-            
-            # 步骤4: 运行夜班稽核.py
-            self.update_step_status(3, "执行中")
-            logging.info("步骤4: 运行夜班稽核工具")
-            if not self.run_script("夜班稽核.py"):
-                logging.error("夜班稽核失败")
-                self.update_step_status(3, "失败")
+                completed = self.run_pipeline_inprocess()
+            if not completed:
                 return
-            else:
-                self.update_step_status(3, "完成")
-            
-            # 等待文件系统更新
-            time.sleep(2)
-            
-            # 查找夜班稽核生成的文件 - 使用正确的文件名模式
-            夜班异常文件 = self.find_latest_file("*夜班稽查结果*.xlsx", in_data_dir=True)
-            if not 夜班异常文件:
-                # 尝试其他可能的文件名模式
-                夜班异常文件 = self.find_latest_file("*夜班*.xlsx", in_data_dir=True)
-                
-            if not 夜班异常文件:
-                logging.warning("未找到夜班稽核结果文件，可能没有夜班异常")
-            else:
-                logging.info(f"找到夜班稽核结果文件: {os.path.basename(夜班异常文件)}")
-            
-            # 步骤5: 运行合并Excel文件.py (如果有两个异常文件)
-            if 白班异常文件 and 夜班异常文件:
-                self.update_step_status(4, "执行中")
-                logging.info("步骤5: 运行合并Excel文件工具")
-                if not self.run_script("合并Excel文件.py"):
-                    logging.error("合并Excel文件失败")
-                    self.update_step_status(4, "失败")
-                    return
-                else:
-                    self.update_step_status(4, "完成")
-                
-                # 等待文件系统更新
-                time.sleep(2)
-                
-                # 查找合并结果 - 修正文件查找模式
-                合并结果文件 = self.find_latest_file("*合并结果*.xlsx", in_data_dir=True)
-                if not 合并结果文件:
-                    # 尝试其他可能的文件名模式
-                    合并结果文件 = self.find_latest_file("合并*.xlsx", in_data_dir=True)
-                    
-                if not 合并结果文件:
-                    logging.error("未找到合并结果文件，流程终止")
-                    return
-                
-                logging.info(f"找到合并结果文件: {os.path.basename(合并结果文件)}")
-            else:
-                logging.info("跳过合并步骤，因为没有足够的异常文件")
-                self.update_step_status(4, "跳过")
-                # 使用可用的异常文件作为最终结果
-                合并结果文件 = 白班异常文件 or 夜班异常文件
-            
-            # 步骤6: 运行异常数据稽核.py (原考勤核查.py)
-            if 合并结果文件:
-                self.update_step_status(5, "执行中")
-                logging.info("步骤6: 运行异常数据稽核工具")
-                if not self.run_script("异常数据稽核.py"):
-                    logging.error("异常数据稽核失败")
-                    self.update_step_status(5, "失败")
-                    return
-                else:
-                    self.update_step_status(5, "完成")
-                
-                # 等待文件系统更新
-                time.sleep(2)
-                
-                # 查找核对版数据文件 - 确保在考勤数据目录中查找最新生成的文件
-                核对版数据文件 = self.find_latest_file("*核对版数据*.xlsx", in_data_dir=True)
-                if not 核对版数据文件:
-                    # 尝试其他可能的文件名模式
-                    核对版数据文件 = self.find_latest_file("*核对版*.xlsx", in_data_dir=True)
-                
-                if not 核对版数据文件:
-                    logging.warning("未找到核对版数据文件，尝试继续执行内容优化步骤")
-                    # 尝试查找可能的输入文件
-                    可能的输入文件 = self.find_latest_file("*.xlsx", in_data_dir=True)
-                    if 可能的输入文件:
-                        logging.info(f"将使用找到的最新Excel文件作为内容优化的输入: {os.path.basename(可能的输入文件)}")
-                        核对版数据文件 = 可能的输入文件
-                    else:
-                        logging.error("未找到任何可用的Excel文件，无法继续执行内容优化")
-                        self.update_step_status(6, "跳过")
-                        return
-                else:
-                    logging.info(f"找到核对版数据文件: {os.path.basename(核对版数据文件)}")
-                
-                # 步骤7: 运行内容优化.py
-                self.update_step_status(6, "执行中")
-                logging.info("步骤7: 运行内容优化工具")
-                
-                # 确保考勤数据目录存在
-                data_dir = os.path.join(WORK_DIR, "考勤数据")
-                if not os.path.exists(data_dir):
-                    os.makedirs(data_dir)
-                    logging.info(f"创建考勤数据目录: {data_dir}")
-                
-                # 运行内容优化脚本
-                if not self.run_script("内容优化.py"):
-                    logging.error("内容优化失败")
-                    self.update_step_status(6, "失败")
-                else:
-                    self.update_step_status(6, "完成")
-                    
-                # 等待文件系统更新
-                time.sleep(2)
-                
-                # 查找优化后的文件
-                优化结果文件 = self.find_latest_file("*稽核数据核对版.xlsx", in_data_dir=True)
-                if not 优化结果文件:
-                    # 如果在考勤数据目录中找不到，尝试在当前目录查找
-                    优化结果文件 = self.find_latest_file("*稽核数据核对版.xlsx")
-                    
-                    # 如果找到了，将其移动到考勤数据目录
-                    if 优化结果文件:
-                        import shutil
-                        dest_file = os.path.join(data_dir, os.path.basename(优化结果文件))
-                        try:
-                            shutil.move(优化结果文件, dest_file)
-                            优化结果文件 = dest_file
-                            logging.info(f"已将优化结果文件移动到考勤数据目录: {os.path.basename(dest_file)}")
-                        except Exception as e:
-                            logging.error(f"移动优化结果文件失败: {str(e)}")
-                
-                if 优化结果文件:
-                    logging.info(f"找到优化结果文件: {os.path.basename(优化结果文件)}")
-                else:
-                    logging.warning("未找到优化结果文件")
-            else:
-                logging.info("跳过异常数据稽核和内容优化步骤，因为没有异常文件")
-                self.update_step_status(5, "跳过")
-                self.update_step_status(6, "跳过")
             
             # 计算总运行时间
             end_time = time.time()
@@ -462,14 +417,7 @@ class AutomationApp:
             logging.info(f"总运行时间: {run_time:.2f}秒")
             
             # 复制最终结果文件到脚本目录并清理临时文件
-            final_result_file = None
-            
-            # 查找最终的优化结果文件 - 修正查找模式
-            final_result_file = self.find_latest_file("*稽核数据核对版.xlsx", in_data_dir=True)
-            if not final_result_file:
-                final_result_file = self.find_latest_file("*考勤稽核数据核对版.xlsx", in_data_dir=True)
-            if not final_result_file:
-                final_result_file = self.find_latest_file("*核对版*.xlsx", in_data_dir=True)
+            final_result_file = self.final_result_file
             
             if final_result_file:
                 # 复制文件到脚本目录
@@ -479,23 +427,19 @@ class AutomationApp:
                     shutil.copy2(final_result_file, dest_file)
                     logging.info(f"已将最终结果文件复制到脚本目录: {os.path.basename(dest_file)}")
                     
-                    # 确保文件复制成功后再清理临时文件夹
+                    # 确保文件复制成功后再整理临时文件夹
                     if os.path.exists(dest_file):
-                        # 清理临时文件夹
+                        # 本次运行的文件移入历史记录，只保留最近几次运行，步骤缓存保留供下次使用
                         data_dir = os.path.join(WORK_DIR, "考勤数据")
                         if os.path.exists(data_dir) and os.path.isdir(data_dir):
                             try:
-                                # 删除临时文件夹及其内容
-                                shutil.rmtree(data_dir)
-                                logging.info("已清理考勤数据临时文件夹")
-                                
-                                # 重新创建空文件夹以备下次使用
-                                os.makedirs(data_dir)
-                                logging.info("已重新创建考勤数据目录")
+                                run_dir = archive_run_files(data_dir)
+                                if run_dir:
+                                    logging.info(f"已将本次运行的文件移入: {os.path.relpath(run_dir, WORK_DIR)}")
                             except Exception as e:
-                                logging.warning(f"清理临时文件夹失败: {str(e)}")
+                                logging.warning(f"整理临时文件夹失败: {str(e)}")
                     else:
-                        logging.warning("最终结果文件复制可能不成功，跳过清理临时文件夹")
+                        logging.warning("最终结果文件复制可能不成功，跳过整理临时文件夹")
                 except Exception as e:
                     logging.error(f"复制最终结果文件失败: {str(e)}")
             else:
@@ -509,14 +453,17 @@ class AutomationApp:
             messagebox.showerror("错误", f"处理过程中发生错误: {str(e)}")
         finally:
             self.is_running = False
-            # 启用两个开始按钮
+            # 启用开始和继续按钮
             self.start_button.config(state="normal")
             self.main_start_button.config(state="normal")
+            self.resume_button.config(state="normal")
     
-    def start_process(self):
-        """开始处理流程"""
+    def start_process(self, resume=False):
+        """开始处理流程，resume 为True时从失败步骤继续：不重新修复文件，已完成的步骤使用步骤缓存"""
         if self.is_running:
             return
+        self.resume = resume
+        self.final_result_file = None
         
         # 重置步骤状态
         for i in range(len(self.steps)):
@@ -524,9 +471,10 @@ class AutomationApp:
         
         self.progress_var.set(0)
         self.is_running = True
-        # 禁用两个开始按钮
+        # 禁用开始和继续按钮
         self.start_button.config(state="disabled")
         self.main_start_button.config(state="disabled")
+        self.resume_button.config(state="disabled")
         
         # 在新线程中运行处理流程
         self.process_thread = threading.Thread(target=self.process_automation)
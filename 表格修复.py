@@ -0,0 +1,452 @@
+import os
+import re
+import zlib
+import shutil
+import struct
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook, load_workbook
+
+try:
+    import xlrd
+    HAS_XLRD = True
+except ImportError:
+    HAS_XLRD = False
+
+try:
+    import pyxlsb
+    HAS_PYXLSB = True
+except ImportError:
+    HAS_PYXLSB = False
+
+
+# 文件头：xlsx、xlsb为zip容器，xls为OLE复合文档
+ZIP_MAGIC = b'PK\x03\x04'
+OLE_MAGIC = b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'
+
+# 损坏时可以删除的部件，只影响格式、图形、批注等，不影响单元格数据
+OPTIONAL_PARTS = ('docProps/', 'customXml/', 'xl/calcChain.xml', 'xl/printerSettings/', 'xl/drawings/',
+                  'xl/comments', 'xl/threadedComments/', 'xl/persons/', 'xl/theme/', 'xl/media/',
+                  'xl/externalLinks/', 'xl/queryTables/', 'xl/tables/', 'xl/pivotTables/', 'xl/pivotCache/',
+                  'xl/ctrlProps/', 'xl/activeX/', 'xl/richData/', 'xl/vbaProject.bin')
+
+# XML 1.0 不允许的控制字符，导出程序写入这些字符时openpyxl无法读取
+ILLEGAL_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# 检查XML部件时每次送入解析器的字节数
+XML_CHUNK_SIZE = 1024 * 1024
+
+# xlsb 单元格没有数字格式信息，表头以这些词结尾的列中的数值按Excel日期序列号转换
+XLSB_DATE_HEADER = re.compile(r'(日期|时间)$')
+
+# 校验时读取的行数
+VALIDATE_ROWS = 10
+
+CONTENT_TYPES = {
+    'xl/workbook.xml': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml',
+    'xl/styles.xml': 'application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml',
+    'xl/sharedStrings.xml': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml',
+    'xl/worksheets/': 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml',
+}
+
+
+class RepairError(Exception):
+    """纯Python修复引擎无法修复的文件，可以改用Excel COM修复"""
+
+
+def detect_format(file_path):
+    """按文件头判断格式，返回 'xlsx'、'xlsb'、'xls'，无法识别（HTML、文本等）时返回None"""
+    with open(file_path, 'rb') as f:
+        header = f.read(len(OLE_MAGIC))
+    if header.startswith(OLE_MAGIC):
+        return 'xls'
+    if header.startswith(b'PK'):
+        try:
+            with zipfile.ZipFile(file_path) as zf:
+                names = {_normalize_name(name).lower() for name in zf.namelist()}
+        except zipfile.BadZipFile:
+            # 目录损坏的zip容器，修复时逐个读取本地文件头
+            return 'xlsx'
+        return 'xlsb' if 'xl/workbook.bin' in names else 'xlsx'
+    return None
+
+
+def _normalize_name(name):
+    """部件名统一为“/”分隔、不以“/”开头，部分导出程序使用“\\”分隔，openpyxl无法识别"""
+    return name.replace('\\', '/').lstrip('/')
+
+
+def _scan_local_entries(data):
+    """zip目录损坏或文件被截断时，顺序扫描本地文件头读取各部件，无法解压的部件为None"""
+    parts = {}
+    view = memoryview(data)
+    pos = data.find(ZIP_MAGIC)
+    while pos >= 0 and pos + 30 <= len(data):
+        flags, method, _, _, _, compressed_size = struct.unpack_from('<HHHHII', data, pos + 6)
+        name_len, extra_len = struct.unpack_from('<HH', data, pos + 26)
+        name_bytes = data[pos + 30:pos + 30 + name_len]
+        name = name_bytes.decode('utf-8' if flags & 0x800 else 'cp437', errors='replace')
+        start = pos + 30 + name_len + extra_len
+        next_pos = start
+        content = None
+        try:
+            if method == 8:
+                decompressor = zlib.decompressobj(-15)
+                content = decompressor.decompress(view[start:])
+                if not decompressor.eof:
+                    content = None
+                next_pos = len(data) - len(decompressor.unused_data)
+            elif method == 0 and not (flags & 0x08 and compressed_size == 0):
+                content = data[start:start + compressed_size]
+                next_pos = start + compressed_size
+        except zlib.error:
+            content = None
+        parts[_normalize_name(name)] = content
+        pos = data.find(ZIP_MAGIC, next_pos)
+    return parts
+
+
+def read_zip_parts(file_path, actions):
+    """读取zip容器中的全部部件，返回{部件名: 内容}，无法读取的部件内容为None"""
+    try:
+        parts = {}
+        renamed = 0
+        with zipfile.ZipFile(file_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                name = _normalize_name(info.filename)
+                renamed += name != info.filename
+                try:
+                    parts[name] = zf.read(info)
+                except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                    parts[name] = None
+                    actions.append(f"部件无法解压: {name}, {e}")
+        if renamed:
+            actions.append(f"部件名改为“/”分隔: {renamed} 个部件")
+        return parts
+    except zipfile.BadZipFile as e:
+        actions.append(f"zip目录损坏（{e}），按本地文件头恢复")
+    with open(file_path, 'rb') as f:
+        return _scan_local_entries(f.read())
+
+
+def _is_optional(name):
+    return name.startswith(OPTIONAL_PARTS)
+
+
+class _WellFormedTarget:
+    """XML解析器的空目标：没有 start、end、data 方法，解析时只检查XML是否完整，不建立任何元素"""
+
+    def close(self):
+        return None
+
+
+def _is_well_formed(content):
+    """分块流式解析，检查XML是否完整，很大的工作表XML也不会在内存中建立元素树"""
+    parser = ET.XMLParser(target=_WellFormedTarget())
+    try:
+        for offset in range(0, len(content), XML_CHUNK_SIZE):
+            parser.feed(content[offset:offset + XML_CHUNK_SIZE])
+        parser.close()
+    except ET.ParseError:
+        return False
+    return True
+
+
+def _check_xml(name, content, actions):
+    """检查XML部件是否完整，去掉非法控制字符后可以解析时返回修正后的内容，否则返回None
+
+    完整的部件原样返回；只有解析失败时才把整个部件解码为文本去除非法字符
+    """
+    if _is_well_formed(content):
+        return content
+    text = content.decode('utf-8', errors='replace')
+    cleaned = ILLEGAL_XML_CHARS.sub('', text).encode('utf-8')
+    if not _is_well_formed(cleaned):
+        return None
+    actions.append(f"去除XML非法字符: {name}")
+    return cleaned
+
+
+def _to_xml(root):
+    """序列化XML，根元素的命名空间作为默认命名空间，不产生 ns0: 前缀"""
+    if root.tag.startswith('{'):
+        ET.register_namespace('', root.tag[1:].split('}')[0])
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+def _rels_source_dir(rels_name):
+    """关系文件所属部件的目录，如 xl/_rels/workbook.xml.rels 对应 xl"""
+    return posixpath.dirname(posixpath.dirname(rels_name))
+
+
+def _drop_relationships(parts, dropped):
+    """从各关系文件中删除指向已删除部件的关系"""
+    for name, content in parts.items():
+        if not name.endswith('.rels'):
+            continue
+        root = ET.fromstring(content)
+        removed = False
+        for rel in list(root):
+            if rel.get('TargetMode') == 'External':
+                continue
+            target = rel.get('Target', '')
+            if target.startswith('/'):
+                target = target.lstrip('/')
+            else:
+                target = posixpath.normpath(posixpath.join(_rels_source_dir(name), target))
+            if target in dropped:
+                root.remove(rel)
+                removed = True
+        if removed:
+            parts[name] = _to_xml(root)
+
+
+def _content_types(parts):
+    """[Content_Types].xml 缺失或损坏时按部件名重新生成"""
+    ns = 'http://schemas.openxmlformats.org/package/2006/content-types'
+    root = ET.Element(f'{{{ns}}}Types')
+    ET.SubElement(root, f'{{{ns}}}Default', Extension='rels',
+                  ContentType='application/vnd.openxmlformats-package.relationships+xml')
+    ET.SubElement(root, f'{{{ns}}}Default', Extension='xml', ContentType='application/xml')
+    for name in sorted(parts):
+        for prefix, content_type in CONTENT_TYPES.items():
+            if name == prefix or (prefix.endswith('/') and name.startswith(prefix) and name.endswith('.xml')):
+                ET.SubElement(root, f'{{{ns}}}Override', PartName='/' + name, ContentType=content_type)
+    return _to_xml(root)
+
+
+def _drop_overrides(content, dropped):
+    """删除 [Content_Types].xml 中已删除部件的类型声明"""
+    root = ET.fromstring(content)
+    for override in list(root):
+        if override.get('PartName', '').lstrip('/') in dropped:
+            root.remove(override)
+    return _to_xml(root)
+
+
+def rebuild_xlsx(file_path, output_file):
+    """重建xlsx的zip容器：恢复可以读取的部件，修正或删除损坏的XML部件，返回修复说明列表
+
+    数据部件（工作簿、工作表、共享字符串、样式）无法恢复时抛出 RepairError；
+    没有需要修复的内容时直接复制原文件
+    """
+    actions = []
+    parts = read_zip_parts(file_path, actions)
+    if not parts:
+        raise RepairError("不是有效的zip容器")
+    if 'xl/workbook.bin' in {name.lower() for name in parts}:
+        raise RepairError("损坏的xlsb文件无法按部件修复")
+
+    dropped = set()
+    for name in list(parts):
+        content = parts[name]
+        if content is not None and name.endswith(('.xml', '.rels', '.vml')):
+            content = _check_xml(name, content, actions)
+        if content is None:
+            if name == '[Content_Types].xml' or _is_optional(name):
+                del parts[name]
+                dropped.add(name)
+                actions.append(f"删除损坏的部件: {name}")
+                continue
+            raise RepairError(f"数据部件损坏无法恢复: {name}")
+        parts[name] = content
+
+    if 'xl/workbook.xml' not in parts:
+        raise RepairError("缺少工作簿部件 xl/workbook.xml")
+    if dropped:
+        _drop_relationships(parts, dropped)
+    if '[Content_Types].xml' not in parts:
+        parts['[Content_Types].xml'] = _content_types(parts)
+        actions.append("重新生成 [Content_Types].xml")
+    elif dropped:
+        parts['[Content_Types].xml'] = _drop_overrides(parts['[Content_Types].xml'], dropped)
+
+    if not actions:
+        shutil.copyfile(file_path, output_file)
+        return actions
+
+    with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as zf:
+        # [Content_Types].xml 写在最前面，与Excel保存的文件一致
+        zf.writestr('[Content_Types].xml', parts.pop('[Content_Types].xml'))
+        for name, content in parts.items():
+            zf.writestr(name, content)
+    return actions
+
+
+def _xls_value(cell, datemode):
+    """xlrd单元格的值：日期转换为datetime（只有时刻时为time），空单元格和错误值为None"""
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+        return None
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        value = xlrd.xldate_as_datetime(cell.value, datemode)
+        return value.time() if cell.value < 1 else value
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    return cell.value
+
+
+def convert_xls(file_path, output_file):
+    """用xlrd把.xls转换为.xlsx，保留全部工作表的单元格值，返回修复说明列表"""
+    if not HAS_XLRD:
+        raise RepairError("未安装xlrd，无法转换.xls文件")
+    try:
+        book = xlrd.open_workbook(file_path, on_demand=True)
+    except Exception as e:
+        raise RepairError(f"xlrd无法读取: {e}")
+    wb = Workbook(write_only=True)
+    try:
+        for index in range(book.nsheets):
+            sheet = book.sheet_by_index(index)
+            ws = wb.create_sheet(sheet.name)
+            for row in range(sheet.nrows):
+                ws.append([_xls_value(cell, book.datemode) for cell in sheet.row(row)])
+            book.unload_sheet(index)
+    finally:
+        book.release_resources()
+    wb.save(output_file)
+    return [f"由.xls转换为.xlsx, 工作表数: {book.nsheets}"]
+
+
+def _serial_datetime(value):
+    """Excel日期序列号转换为datetime，小于1时为一天中的时刻（time）"""
+    result = datetime(1899, 12, 30) + timedelta(days=value)
+    # 四舍五入到秒，避免浮点误差产生 23:59:59.999
+    result = result.replace(microsecond=0) + timedelta(seconds=round(result.microsecond / 1e6))
+    return result.time() if value < 1 else result
+
+
+def convert_xlsb(file_path, output_file):
+    """用pyxlsb把.xlsb转换为.xlsx，返回修复说明列表
+
+    pyxlsb不提供单元格的数字格式，表头以“日期”“时间”结尾的列中的数值按日期序列号转换，其余数值保持原样
+    """
+    if not HAS_PYXLSB:
+        raise RepairError("未安装pyxlsb，无法转换.xlsb文件")
+    wb = Workbook(write_only=True)
+    try:
+        with pyxlsb.open_workbook(file_path) as book:
+            for name in book.sheets:
+                ws = wb.create_sheet(name)
+                date_columns = set()
+                with book.get_sheet(name) as sheet:
+                    for row in sheet.rows():
+                        values = []
+                        for cell in row:
+                            value = cell.v
+                            if isinstance(value, str) and XLSB_DATE_HEADER.search(value.strip()):
+                                date_columns.add(cell.c)
+                            elif cell.c in date_columns and isinstance(value, (int, float)) and value >= 0:
+                                value = _serial_datetime(value)
+                            values.append(value)
+                        ws.append(values)
+            sheet_count = len(book.sheets)
+    except RepairError:
+        raise
+    except Exception as e:
+        raise RepairError(f"pyxlsb无法读取: {e}")
+    wb.save(output_file)
+    return [f"由.xlsb转换为.xlsx, 工作表数: {sheet_count}"]
+
+
+def validate_xlsx(file_path):
+    """用流水线读取表格的方式（openpyxl只读模式）打开文件并读取第一个工作表的前几行，失败时抛出 RepairError"""
+    try:
+        # 以文件对象打开，openpyxl不检查扩展名，修复过程中的临时文件也可以校验
+        with open(file_path, 'rb') as f:
+            wb = load_workbook(f, read_only=True, data_only=True, keep_links=False)
+            try:
+                for _ in wb.worksheets[0].iter_rows(max_row=VALIDATE_ROWS, values_only=True):
+                    pass
+            finally:
+                wb.close()
+    except Exception as e:
+        raise RepairError(f"文件无法读取: {e}")
+
+
+def _workbook_parts(rels_content):
+    """工作簿关系文件中引用的包内部件（工作表、样式、共享字符串等），返回[(部件路径, 是否为工作表)]"""
+    parts = []
+    for rel in ET.fromstring(rels_content):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target', '')
+        if target.startswith('/'):
+            path = target.lstrip('/')
+        else:
+            path = posixpath.normpath(posixpath.join('xl', target))
+        parts.append((path, rel.get('Type', '').endswith('/worksheet')))
+    return parts
+
+
+def probe_workbook(file_path):
+    """快速检查文件能否不经修复直接被流水线读取，返回(是否完好, 说明)
+
+    依次检查文件头、zip目录（部件名须为“/”分隔且不以“/”开头）、工作簿关系文件引用的工作表、样式、
+    共享字符串等部件是否齐全，再以只读模式读取第一个工作表的前几行，
+    只读取zip目录和几个很小的部件，不解压全部数据。xls、xlsb需要转换，不算完好
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(len(OLE_MAGIC))
+        if header.startswith(OLE_MAGIC):
+            return False, "xls格式或加密文件，需要转换"
+        if not header.startswith(ZIP_MAGIC):
+            return False, "文件头不是zip容器"
+
+        with zipfile.ZipFile(file_path) as zf:
+            names = set(zf.namelist())
+            # 部件名用“\”分隔或以“/”开头时openpyxl找不到该部件（如样式丢失后日期读成数字），需要重建
+            bad_names = [name for name in names if name != _normalize_name(name)]
+            if bad_names:
+                return False, f"部件名不规范: {', '.join(sorted(bad_names))}"
+            for name in ('[Content_Types].xml', 'xl/workbook.xml', 'xl/_rels/workbook.xml.rels'):
+                if name not in names:
+                    return False, f"缺少部件: {name}"
+            parts = _workbook_parts(zf.read('xl/_rels/workbook.xml.rels'))
+        if not any(is_sheet for _, is_sheet in parts):
+            return False, "工作簿中没有工作表"
+        missing = [name for name, is_sheet in parts if is_sheet and name not in names]
+        if missing:
+            return False, f"缺少工作表部件: {', '.join(missing)}"
+        missing = [name for name, is_sheet in parts if not is_sheet and name not in names]
+        if missing:
+            return False, f"缺少部件: {', '.join(missing)}"
+    except (OSError, zipfile.BadZipFile, ET.ParseError) as e:
+        return False, f"zip容器损坏: {e}"
+
+    try:
+        validate_xlsx(file_path)
+    except RepairError as e:
+        return False, str(e)
+    return True, "可以直接读取"
+
+
+def repair_workbook(file_path, output_file):
+    """不依赖Excel的修复：xlsx重建zip容器并修正损坏的部件，xls、xlsb转换为xlsx，结果保存为 output_file
+
+    公式只保留文件中已保存的计算结果，不重新计算。成功时返回修复说明列表（无需修复时为空），
+    失败时抛出 RepairError，output_file 不会留下写了一半的文件
+    """
+    file_format = detect_format(file_path)
+    if file_format is None:
+        raise RepairError("无法识别的文件格式")
+    converters = {'xlsx': rebuild_xlsx, 'xls': convert_xls, 'xlsb': convert_xlsb}
+
+    temp_file = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        actions = converters[file_format](file_path, temp_file)
+        validate_xlsx(temp_file)
+        os.replace(temp_file, output_file)
+        return actions
+    except RepairError:
+        raise
+    except Exception as e:
+        raise RepairError(f"{file_format}修复失败: {e}")
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
@@ -0,0 +1,150 @@
+import os
+import sys
+import pickle
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+from 流式读取 import read_excel_streaming
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+# 缓存格式版本，解析结果的结构变化时修改，使旧缓存失效
+CACHE_VERSION = 2
+
+# 缓存目录的最大占用空间（字节），超过时按最近最少使用的顺序删除
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+
+
+def get_program_dir():
+    """程序所在目录，打包后为可执行文件所在目录"""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def get_cache_dir(name="解析缓存"):
+    """缓存目录：程序所在目录下名为 name 的文件夹，默认为“解析缓存”
+
+    考勤数据文件夹中的文件在每次处理完成后移入 历史记录，只保留最近几次运行（见 步骤缓存.archive_run_files），
+    缓存放在其外面才能在多次运行之间一直复用
+    """
+    return os.path.join(get_program_dir(), name)
+
+
+def file_hash(file_path):
+    """计算文件内容的哈希值"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(file_path, read_options):
+    """缓存键：文件内容哈希 + 读取参数 + 缓存格式版本"""
+    options = repr(sorted(read_options.items()))
+    digest = hashlib.sha256(f"{CACHE_VERSION}|{file_hash(file_path)}|{options}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _load(cache_file):
+    if cache_file.endswith('.parquet'):
+        df = pd.read_parquet(cache_file)
+        # Parquet把object列中的NaN保存为None，还原为与读取Excel时一致的NaN
+        for col in df.columns:
+            if df[col].dtype == object:
+                df[col] = df[col].where(df[col].notna(), np.nan)
+        return df
+    with open(cache_file, 'rb') as f:
+        return pickle.load(f)
+
+
+def _store(df, cache_base):
+    """保存解析结果，优先使用Parquet，列中类型混杂等无法保存为Parquet时使用pickle
+
+    先写入临时文件再改名，并发读取同一文件的步骤不会读到写了一半的缓存
+    """
+    temp_file = f"{cache_base}.{os.getpid()}.tmp"
+    cache_file = cache_base + '.pkl'
+    try:
+        stored = False
+        if HAS_PYARROW:
+            try:
+                df.to_parquet(temp_file, index=False)
+                cache_file = cache_base + '.parquet'
+                stored = True
+            except Exception:
+                pass
+        if not stored:
+            with open(temp_file, 'wb') as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    return cache_file
+
+
+def evict(cache_dir=None, max_bytes=None):
+    """缓存超过大小上限时，按最近使用时间从早到晚删除缓存文件"""
+    cache_dir = cache_dir or get_cache_dir()
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isfile(path) and not name.endswith('.tmp'):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def read_excel_cached(file_path, **read_options):
+    """读取Excel文件，文件内容和读取参数都未变化时直接使用缓存的解析结果
+
+    参数与 read_excel_streaming 相同。缓存不可用（目录无法写入等）时退回直接读取
+    """
+    cache_dir = get_cache_dir()
+    try:
+        key = cache_key(file_path, read_options)
+        for ext in ('.parquet', '.pkl'):
+            cache_file = os.path.join(cache_dir, key + ext)
+            if os.path.exists(cache_file):
+                df = _load(cache_file)
+                # 更新修改时间，作为最近使用时间
+                os.utime(cache_file)
+                logging.info(f"使用解析缓存: {os.path.basename(file_path)}")
+                return df
+    except Exception as e:
+        logging.warning(f"读取解析缓存失败: {os.path.basename(file_path)}, 错误: {str(e)}")
+        key = None
+
+    df = read_excel_streaming(file_path, **read_options)
+
+    if key is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            _store(df, os.path.join(cache_dir, key))
+            evict(cache_dir)
+        except Exception as e:
+            logging.warning(f"保存解析缓存失败: {os.path.basename(file_path)}, 错误: {str(e)}")
+    return df
@@ -0,0 +1,90 @@
+import time
+import logging
+
+import numpy as np
+
+import 白班稽核1_1
+import 夜班稽核
+from 列类型 import categorize_columns
+from 稽核阈值 import DEFAULT_THRESHOLDS
+
+
+# 白班各规则的名称，序号与 白班稽核1_1.detect_day_anomalies 的规则顺序一致
+DAY_RULES = {1: '迟到', 2: '外出未返回', 3: '外出超时', 4: '有进无出', 5: '连续进入',
+             6: '休息日加班不足', 7: '加班前未进入', 8: '加班时长不足', 9: '早退'}
+
+# 夜班各类异常的名称和异常描述中的关键字
+NIGHT_RULES = [('迟到', '首次进入时间为'), ('早退', '早于正常下班时间'), ('外出超时', '外出时长'),
+               ('有进无出', '无出记录'), ('有出无进', '无进入记录'), ('加班前未进入', '加班开始前未进入'),
+               ('加班时长不足', '少于加班单时数'), ('加班时长不足', '加班时长为')]
+
+
+class ReauditData:
+    """按不同阈值重新稽核所需的缓存数据
+
+    由班别匹配结果、请假区间表、加班单区间表和每日考勤汇总建立一次，其中保存白班的 DayShiftData
+    和夜班的 NightShiftData。之后每次修改阈值只执行检测，不再读取任何Excel文件
+    """
+
+    def __init__(self, matched, leaves=None, overtimes=None, facts=None):
+        """参数与 白班稽核1_1.process_attendance_data、夜班稽核.build_night_result 相同，matched 不会被修改"""
+        day_df = 白班稽核1_1.prepare_attendance_data(matched)
+        self.day = None if day_df is None else 白班稽核1_1.prepare_day_shift(day_df, leaves, overtimes, facts)
+
+        night_df = matched.copy()
+        categorize_columns(night_df)
+        self.night = 夜班稽核.NightShiftData(night_df, leaves, overtimes, facts)
+
+    def count_day(self, thresholds):
+        """白班异常统计：异常组数、异常记录数和各规则的异常组数"""
+        counts = {name: 0 for name in DAY_RULES.values()}
+        if self.day is None:
+            return {'异常组数': 0, '异常记录数': 0, '各规则': counts}
+
+        events, _ = 白班稽核1_1.detect_day_anomalies(self.day, thresholds)
+        groups = np.unique(events['group'].to_numpy(dtype=np.int64))
+        group_sizes = np.diff(np.r_[self.day.starts, len(self.day.group_ids)])
+        rule_groups = events.drop_duplicates(['group', 'rule'])['rule'].value_counts()
+        for rule, count in rule_groups.items():
+            counts[DAY_RULES[rule]] += int(count)
+        return {'异常组数': len(groups), '异常记录数': int(group_sizes[groups].sum()), '各规则': counts}
+
+    def count_night(self, thresholds):
+        """夜班异常统计：异常班次数、异常记录数和各类异常的班次数"""
+        counts = {name: 0 for name, _ in NIGHT_RULES}
+        anomalies = 夜班稽核.detect_night_anomalies(self.night, thresholds)
+        rows = 0
+        for shift, descriptions, _ in anomalies:
+            rows += int(self.night.ends[shift] - self.night.starts[shift])
+            names = {name for name, keyword in NIGHT_RULES if any(keyword in d for d in descriptions)}
+            for name in names:
+                counts[name] += 1
+        return {'异常班次数': len(anomalies), '异常记录数': rows, '各规则': counts}
+
+    def count(self, thresholds=None):
+        """按阈值重新检测并返回白班、夜班的异常统计，thresholds 为None时使用默认阈值"""
+        thresholds = thresholds or DEFAULT_THRESHOLDS
+        start_time = time.time()
+        result = {'白班': self.count_day(thresholds), '夜班': self.count_night(thresholds)}
+        logging.info(f"阈值重算完成, 耗时: {time.time() - start_time:.2f}秒, 阈值: {thresholds}")
+        return result
+
+
+def compare_thresholds(data, thresholds, baseline=None):
+    """比较两组阈值下的异常统计，返回{班次: {统计项: (基准值, 新值)}}，各规则的统计展开为“规则名”项
+
+    baseline 为None时与默认阈值比较
+    """
+    before = data.count(baseline)
+    after = data.count(thresholds)
+    comparison = {}
+    for shift in before:
+        items = {}
+        for key, value in before[shift].items():
+            if key == '各规则':
+                for rule, count in value.items():
+                    items[rule] = (count, after[shift][key][rule])
+            else:
+                items[key] = (value, after[shift][key])
+        comparison[shift] = items
+    return comparison